@@ -14,46 +14,25 @@
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
 
+import os
 import sys
 import re
+from collections import namedtuple
 
-# Opcodes
-OPCODES = {
-    "ADD":  {"type": 2, "code": "10100000"},
-    "AND":  {"type": 2, "code": "10101000"},
-    "CALL": {"type": 1, "code": "01010000"},
-    "CMP":  {"type": 2, "code": "10100111"},
-    "DEC":  {"type": 1, "code": "01100110"},
-    "DIV":  {"type": 2, "code": "10100011"},
-    "HLT":  {"type": 0, "code": "00000001"},
-    "INC":  {"type": 1, "code": "01100101"},
-    "INT":  {"type": 1, "code": "01010010"},
-    "IRET": {"type": 0, "code": "00010011"},
-    "JEQ":  {"type": 1, "code": "01010101"},
-    "JGE":  {"type": 1, "code": "01011010"},
-    "JGT":  {"type": 1, "code": "01010111"},
-    "JLE":  {"type": 1, "code": "01011001"},
-    "JLT":  {"type": 1, "code": "01011000"},
-    "JMP":  {"type": 1, "code": "01010100"},
-    "JNE":  {"type": 1, "code": "01010110"},
-    "LD":   {"type": 2, "code": "10000011"},
-    "LDI":  {"type": 8, "code": "10000010"},
-    "MOD":  {"type": 2, "code": "10100100"},
-    "MUL":  {"type": 2, "code": "10100010"},
-    "NOP":  {"type": 0, "code": "00000000"},
-    "NOT":  {"type": 1, "code": "01101001"},
-    "OR":   {"type": 2, "code": "10101010"},
-    "POP":  {"type": 1, "code": "01000110"},
-    "PRA":  {"type": 1, "code": "01001000"},
-    "PRN":  {"type": 1, "code": "01000111"},
-    "PUSH": {"type": 1, "code": "01000101"},
-    "RET":  {"type": 0, "code": "00010001"},
-    "SHL":  {"type": 2, "code": "10101100"},
-    "SHR":  {"type": 2, "code": "10101101"},
-    "ST":   {"type": 2, "code": "10000100"},
-    "SUB":  {"type": 2, "code": "10100001"},
-    "XOR":  {"type": 2, "code": "10101011"},
-}
+# the instruction set and the binary image format live with the emulator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ls8'))
+import debuginfo
+import image
+import isa
+
+
+def p8(v):
+    return "{:08b}".format(v)
+
+
+# Opcodes, from the instruction set shared with the emulator:
+# mnemonic -> (opcode, operand kind)
+OPCODES = {name: (op, kind) for name, op, kind in isa.INSTRUCTIONS}
 
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
@@ -63,12 +42,40 @@ REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
 REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
 REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
 
+# Compiled once, not per line
+LINE = re.compile(REGEX)
+DS = re.compile(REGEX_DS, re.IGNORECASE)
+DB = re.compile(REGEX_DB, re.IGNORECASE)
+REGISTER = re.compile(r"R([0-7])")
+REGISTERS = {f"R{r}": r for r in range(8)}  # the usual case, without the regex
+
+# Statements, between parsing and emission:
+# an instruction has register numbers in a and b, or for REG_IMM the register
+# in a and the value or symbol in b; text is its listing comment
+Label = namedtuple('Label', 'name line')
+Inst = namedtuple('Inst', 'name a b text line')
+Data = namedtuple('Data', 'code notes line')
+
+# The text format of every byte value
+BITS = [p8(v) for v in range(256)]
+
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-b] [-O] [-g] [inputfile] [outputfile]
+
+    -b: write a binary .ls8b image (the default for an outputfile
+        ending in .ls8b)
+    -O: run the peephole optimizer, see peephole.py
+    -g: also write debug info, labels and source lines by address, to
+        the outputfile's .ls8d sidecar (see ../ls8/debuginfo.py)
     """
 
+    binary = "-b" in argv
+    optimize = "-O" in argv
+    debug = "-g" in argv
+    argv = [a for a in argv if a not in ("-b", "-O", "-g")]
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,13 +89,20 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-b] [-O] [-g] [infile.asm] [outfile.ls8]", file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    if debug and outputfile == "-":
+        print("asm.py: -g needs an outputfile, the debug info goes next to it",
+              file=sys.stderr)
+        sys.exit(1)
+
+    binary = binary or outputfile.endswith(".ls8b")
 
+    return inputfile, outputfile, binary, optimize, debug
 
-def open_files(inputfile, outputfile):
+
+def open_files(inputfile, outputfile, binary=False):
     """
     Open files for reading and writing. If either of the files are named "-",
     stdin or stdout is returned as appropriate.
@@ -100,306 +114,288 @@ def open_files(inputfile, outputfile):
         inputfile = open(inputfile)
 
     if outputfile == "-":
-        outputfile = sys.stdout
+        outputfile = sys.stdout.buffer if binary else sys.stdout
     else:
-        outputfile = open(outputfile, "w")
+        outputfile = open(outputfile, "wb" if binary else "w")
 
     return inputfile, outputfile
 
 
-def normalize_line(groups):
-    """
-    Takes match groups and uppercases them if they're not None.
-    """
+def error(message, status):
+    """Report an error in the source and give up."""
 
-    result = []
+    print(message, file=sys.stderr)
+    sys.exit(status)
 
-    for g in groups:
-        if g is None:
-            result.append(None)
-        else:
-            result.append(g.upper())
 
-    return result
-
-
-def p8(v):
-    return "{:08b}".format(v)
-
-
-def pass1(inputfile, sym, code):
-    """
-    Pass 1
-
-    * Read the source code lines
-    * Parse labels, opcodes, and operands
-    * Record label offsets
-    * Emit machine code
+def parse(inputfile):
     """
+    Parse source lines, one at a time.
 
-    # Source line number
-    line_num = 0
+    * Parse labels, opcodes, and operands with the precompiled patterns
+    * Check opcodes, operand counts and registers
 
-    # Current code address (for labels)
-    addr = 0
+    Yields Label, Inst and Data statements in source order; nothing is
+    kept, so a source of any length streams through.
+    """
 
-    def get_reg(op, fatal=True):
+    def get_reg(op):
         """Get a register number from a string, e.g. "R2" -> 2"""
 
-        nonlocal line_num
+        if op in REGISTERS:
+            return REGISTERS[op]
 
-        m = re.match(r"R([0-7])", op)
+        m = REGISTER.match(op)
 
         if m is None:
-            if fatal:
-                print(f"Line {line_num}: unknown register {op}",
-                      file=sys.stderr)
-                sys.exit(1)
-            else:
-                return None
+            error(f"Line {line_num}: unknown register {op}", 1)
 
         return int(m.group(1))
 
-    def out0(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with zero operands"""
-
-        nonlocal addr
-
-        code.append(f"{machine_code} # {opcode}")
-        addr += 1
-
-    def out1(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with one operand"""
-
-        nonlocal addr
-
-        reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
-        addr += 2
+    def check_ops(opcode, op_type, op_a, op_b):
+        """Check operands for sanity with a particular opcode"""
 
-    def out2(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with two operands"""
+        # 0, 1, or 2 register operands; LDI r,i or LDI r,label
+        desired = 2 if op_type == isa.REG_IMM else op_type
+        found = (op_a is not None) + (op_b is not None)
 
-        nonlocal addr
+        # Makes sure we have right operand count
+        if found < desired:
+            error(f"Line {line_num}: missing operand to {opcode}", 1)
+        elif found > desired:
+            error(f"Line {line_num}: unexpected operand to {opcode}", 1)
 
-        reg_a = get_reg(op_a)
-        reg_b = get_reg(op_b)
+    for line_num, line in enumerate(inputfile, 1):
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
+        # Strip comments
+        comment_index = line.find(';')
+        if comment_index != -1:
+            line = line[:comment_index]
 
-        addr += 3
+        # Normalize
+        line = line.strip()
 
-    def out8(opcode, op_a, op_b, machine_code):
-        """Handle LDI opcode (type 8)"""
+        # Ignore blank lines
+        if not line:
+            continue
 
-        nonlocal addr
+        label, opcode, op_a, op_b = LINE.match(line).groups()
 
-        reg_a = get_reg(op_a)
+        if label is not None:
+            yield Label(label.upper(), line_num)
 
-        try:
-            val_b = int(op_b, 0)
-            out_b = p8(val_b)
+        if opcode is None:
+            continue
 
-        except ValueError:
-            # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
+        opcode = opcode.upper()
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(out_b)
+        if opcode == 'DS':
+            m = DS.match(line)
 
-        addr += 3
+            if m is None or m.group(2) is None:
+                error(f"line {line_num}: missing argument to DS", 2)
 
-    def handle_ds(line):
-        """
-        Handle DS pseudo-opcode
-        """
+            data = m.group(2)
+            yield Data(bytes(ord(c) & 0xff for c in data),
+                       ['[space]' if c == ' ' else c for c in data], line_num)
 
-        nonlocal addr
+        elif opcode == 'DB':
+            m = DB.match(line)
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+            if m is None or m.group(2) is None:
+                error(f"line {line_num}: missing argument to DB", 2)
 
-        if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
-            sys.exit(2)
+            data = m.group(2)
 
-        data = m.group(2)
+            try:
+                val = int(data, 0)
 
-        for i in range(len(data)):
-            print_char = data[i]
+            except ValueError:
+                error(f"line {line_num}: invalid integer argument to DB", 2)
 
-            if print_char == ' ':
-                print_char = '[space]'
+            # Force to byte size
+            yield Data(bytes((val & 0xff,)), [data], line_num)
 
-            code.append(f"{p8(ord(data[i]))} # {print_char}")
+        else:
+            # Make sure we know this opcode at all
+            if opcode not in OPCODES:
+                error(f"line {line_num}: unknown opcode {opcode}", 2)
 
-        addr += len(data)
+            op_type = OPCODES[opcode][1]
+            op_a = op_a and op_a.upper()
+            op_b = op_b and op_b.upper()
 
-    def handle_db(line):
-        """
-        Handle the DB pseudo-opcode
-        """
+            # Check operand count
+            check_ops(opcode, op_type, op_a, op_b)
 
-        nonlocal addr
+            text = opcode
+            if op_a is not None:
+                text += f" {op_a}"
+            if op_b is not None:
+                text += f",{op_b}"
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+            a = b = None
 
-        if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
-            sys.exit(2)
+            if op_type == isa.REG_IMM:
+                a = get_reg(op_a)
 
-        data = m.group(2)
+                try:
+                    b = int(op_b, 0) & 0xff
 
-        try:
-            val = int(data, 0)
+                except ValueError:
+                    # If it's not a value, it might be a symbol
+                    b = op_b
 
-        except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
-                  file=sys.stderr)
-            sys.exit(2)
+            elif op_type != isa.NO_OPERANDS:
+                a = get_reg(op_a)
+                if op_type == isa.REG_REG:
+                    b = get_reg(op_b)
 
-        # Force to byte size
-        val &= 0xff
+            yield Inst(opcode, a, b, text, line_num)
 
-        code.append(f"{p8(val)} # {data}")
 
-        addr += 1
+def emit(statements, listing=None, lines=None):
+    """
+    Emit machine code for statements in a single pass.
+
+    * Emit machine code bytes straight into a bytearray
+    * Record label offsets; a label used before it is defined gets a fixup
+      entry, patched once all the statements have been read
+
+    Returns (code, sym). Only code, the symbol table and the pending fixups
+    are kept, so memory does not grow with the length of the source beyond
+    the program itself. If listing is a list, the notes write_listing()
+    needs for the text format are appended to it as (offset, text, inline).
+    If lines is a list, (offset, source line) of every instruction and data
+    statement is appended to it, for the debug info.
+    """
 
-    def check_ops(opcode, op_a, op_b):
-        """Check operands for sanity with a particular opcode"""
+    code = bytearray()
+    sym = {}
+    fixups = []  # (code offset, symbol)
+    note = listing.append if listing is not None else None
+    line = lines.append if lines is not None else None
 
-        def check_ops_count(desired, found):
-            # Makes sure we have right operand count
-            if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
-            elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
+    for s in statements:
+        if line and type(s) is not Label:
+            line((len(code), s.line))
 
-        # Make sure we know this opcode at all
-        if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
-            sys.exit(2)
+        if type(s) is Inst:
+            op, op_type = OPCODES[s.name]
 
-        op_type = OPCODES[opcode]["type"]
+            if note:
+                note((len(code), s.text, True))
 
-        total_operands = 0
+            code.append(op)
 
-        if op_a is not None:
-            total_operands += 1
+            if op_type == isa.REG_IMM:
+                code.append(s.a)
 
-        if op_b is not None:
-            total_operands += 1
+                if type(s.b) is int:
+                    code.append(s.b)
+                elif s.b in sym:
+                    code.append(sym[s.b] & 0xff)
+                else:
+                    fixups.append((len(code), s.b))
+                    code.append(0)
 
-        if op_type == 0 or op_type == 1 or op_type == 2:
-            # 0, 1, or 2 register operands
-            check_ops_count(op_type, total_operands)
+            elif op_type != isa.NO_OPERANDS:
+                code.append(s.a)
+                if op_type == isa.REG_REG:
+                    code.append(s.b)
 
-        elif op_type == 8:
-            # LDI r,i or LDI r,label
-            check_ops_count(2, total_operands)
+        elif type(s) is Label:
+            # Track label address
+            sym[s.name] = len(code)
 
-    # Type to function mapping
-    type_f = {
-        0: out0,
-        1: out1,
-        2: out2,
-        8: out8,
-    }
+            if note:
+                note((len(code), f'# {s.name} (address {len(code)}):', False))
 
-    for line in inputfile:
-        line_num += 1
+        else:
+            if note:
+                for i, text in enumerate(s.notes):
+                    note((len(code) + i, text, True))
 
-        # Strip comments
-        comment_index = line.find(';')
-        if comment_index != -1:
-            line = line[:comment_index]
+            code += s.code
 
-        # Normalize
-        line = line.strip()
+    # Resolve forward references
+    for offset, name in fixups:
+        if name not in sym:
+            error(f"unknown symbol: {name}", 2)
 
-        # Ignore blank lines
-        if input == '':
-            continue
+        code[offset] = sym[name] & 0xff
 
-        # print(line)  # debug
+    return code, sym
 
-        m = re.match(REGEX, line)
 
-        if m is not None:
-            label, opcode, op_a, op_b = normalize_line(m.groups())
+def assemble(inputfile, listing=None, optimize=False, lines=None):
+    """
+    Assemble source lines: parse() streamed into emit(). With optimize,
+    the statements go through the peephole optimizer in between, which
+    needs them all at once. listing and lines are passed on to emit().
+    """
 
-            # print(label, opcode, op_a, op_b)  # debug
+    statements = parse(inputfile)
 
-            # Track label address
-            if label is not None:
-                sym[label] = addr
-                # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
-
-            if opcode is not None:
-                if opcode == 'DS':
-                    handle_ds(line)
-                elif opcode == 'DB':
-                    handle_db(line)
-                else:
-                    # Check operand count
-                    check_ops(opcode, op_a, op_b)
+    if optimize:
+        import peephole
+        statements = peephole.optimize(list(statements))
 
-                    # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
-        else:
-            print(f"No match: {input}", file=sys.stderr)
-            sys.exit(3)
+    return emit(statements, listing, lines)
 
 
-def pass2(outputfile, sym, code):
+def write_listing(outputfile, code, listing):
     """
-    Output the code, substituting in any symbols.
+    Output the code in the text .ls8 format, one byte per line, with the
+    notes assemble() made: instructions and data are commented, labels get
+    a comment line of their own.
     """
 
-    for c in code:
-        # Replace symbols
-        if c[:4] == 'sym:':
-            s = c[4:].strip()
+    pos = 0
 
-            if s in sym:
-                c = p8(sym[s])
+    for offset, text, inline in listing:
+        # Operand bytes have no note
+        while pos < offset:
+            outputfile.write(f"{BITS[code[pos]]}\n")
+            pos += 1
 
-            else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+        if inline:
+            outputfile.write(f"{BITS[code[pos]]} # {text}\n")
+            pos += 1
+        else:
+            outputfile.write(f"{text}\n")
 
-        outputfile.write(f"{c}\n")
+    for pos in range(pos, len(code)):
+        outputfile.write(f"{BITS[code[pos]]}\n")
 
 
 def main(argv):
     # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+    inputfile, outputfile, binary, optimize, debug = parse_commandline(argv)
+    sidecar = debuginfo.sidecar(outputfile)
+    source = inputfile if inputfile != "-" else ""
 
     # Open files
-    inputfile, outputfile = open_files(inputfile, outputfile)
-
-    # Set up the symbol table
-    sym = {}
-
-    # Set up the machine code output
-    code = []
+    inputfile, outputfile = open_files(inputfile, outputfile, binary)
 
     # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+    lines = [] if debug else None
+    if binary:
+        code, sym = assemble(inputfile, optimize=optimize, lines=lines)
+        image.write_image(outputfile, code, symbols=sym)
+    else:
+        listing = []
+        code, sym = assemble(inputfile, listing, optimize, lines)
+        write_listing(outputfile, code, listing)
+
+    if debug:
+        with open(sidecar, "wb") as f:
+            debuginfo.write_debuginfo(f, len(code), sym, lines, source)
 
     return 0
 
 
 if __name__ == "__main__":
+    # peephole.py imports this module by name: don't let it load a copy
+    sys.modules["asm"] = sys.modules["__main__"]
     sys.exit(main(sys.argv))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""Benchmark: assembling generated sources of growing length.
+
+Usage: bench.py [lines ...]
+
+For each length, a source of that many lines (instructions, labels used
+both before and after they are defined, DB and DS data and comments) is
+streamed into asm.assemble() from a generator, so the source itself is
+never held in memory. Printed per length: time per line, which stays flat
+when assembly is linear, and the peak memory tracemalloc saw against the
+size of the program, which stays a small constant factor when nothing but
+the code, the symbols and the fixups are kept.
+"""
+
+import io
+import sys
+import time
+import tracemalloc
+
+import asm
+
+SIZES = [10000, 100000, 400000]
+
+
+def generate(lines):
+    '''Lines of a made up program, in blocks of 10 lines.'''
+    for i in range(lines // 10):
+        yield f'L{i}:\n'
+        yield f'  LDI R0,L{i + 1}   ; forward reference\n'
+        yield f'  LDI R1,L{i}\n'
+        yield '  ADD R0,R1\n'
+        yield '  CMP R0,R1\n'
+        yield '  JNE R0\n'
+        yield '  PUSH R2\n'
+        yield '; a comment line\n'
+        yield f'  DB {i & 0xff}\n'
+        yield '  DS data\n'
+    yield f'L{lines // 10}: HLT\n'
+
+
+def assemble(lines, text):
+    listing = [] if text else None
+    code, sym = asm.assemble(generate(lines), listing)
+    if text:
+        asm.write_listing(io.StringIO(), code, listing)
+    return code
+
+
+def measure(lines, text=False):
+    '''(seconds, peak bytes, code bytes) of one assembly. The memory is
+       measured in a second run, tracemalloc slows everything down.'''
+    start = time.perf_counter()
+    code = assemble(lines, text)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    assemble(lines, text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, len(code)
+
+
+def main(argv):
+    sizes = [int(n) for n in argv[1:]] or SIZES
+    print(f'{"lines":>8} {"format":>6} {"time":>8} {"us/line":>8} '
+          f'{"code":>9} {"peak":>10} {"peak/code":>9}')
+    for lines in sizes:
+        for name in ('binary', 'text'):
+            elapsed, peak, size = measure(lines, name == 'text')
+            print(f'{lines:8} {name:>6} {elapsed:7.3f}s {elapsed / lines * 1e6:8.2f} '
+                  f'{size:9} {peak:10} {peak / size:9.1f}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""Incremental build of LS-8 assembly sources.
+
+Usage: build.py [-b] [-O] [-j JOBS] [-o OUTDIR] [--force] [source.asm | directory] ...
+
+Assembles every source with asm.py's assemble() in this process, or over a
+process pool when there are many to do, instead of starting one interpreter
+per file. With no arguments it builds asm/*.asm into ls8/examples, like
+buildall did.
+
+A source is only assembled again when its content, the output format, -O
+or the assembler itself (asm.py, peephole.py, isa.py, image.py) changed
+since its last build:
+the cache in OUTDIR/.buildcache.json maps each output to a hash of all of
+them. Outputs are written to a temporary file and renamed into place, so a
+failed or interrupted build never leaves a half written program behind.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import asm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LS8 = os.path.join(HERE, '..', 'ls8')
+CACHE_FILE = '.buildcache.json'
+POOL_MIN = 16 # stale sources before a process pool pays for its startup
+
+
+def toolchain_digest():
+    '''Hash of the assembler's own sources: changing them rebuilds all.'''
+    h = hashlib.sha256()
+    for path in (asm.__file__, os.path.join(HERE, 'peephole.py'),
+                 os.path.join(LS8, 'isa.py'), os.path.join(LS8, 'image.py')):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def source_key(data, binary, optimize, toolchain):
+    head = b'%s %d %d\n' % (toolchain.encode(), binary, optimize)
+    return hashlib.sha256(head + data).hexdigest()
+
+
+def find_sources(paths):
+    '''Expand directories into their *.asm files.'''
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources += [os.path.join(path, f) for f in sorted(os.listdir(path))
+                        if f.endswith('.asm')]
+        else:
+            sources.append(path)
+    return sources
+
+
+def output_path(source, outdir, binary):
+    base = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(outdir, base + ('.ls8b' if binary else '.ls8'))
+
+
+def write_atomic(path, data):
+    '''Replace path with data, unless it already holds exactly that.'''
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data: return
+    except OSError:
+        pass
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError): os.remove(tmp)
+        raise
+
+
+def assemble(text, binary=False, optimize=False):
+    '''Assemble source text. Returns (program bytes, None), or (None, the
+       error message) where asm.py would have exited.'''
+    listing = None if binary else []
+    out = io.BytesIO() if binary else io.StringIO()
+    errors = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(errors):
+            code, sym = asm.assemble(io.StringIO(text), listing, optimize)
+            if binary:
+                asm.image.write_image(out, code, symbols=sym)
+            else:
+                asm.write_listing(out, code, listing)
+    except SystemExit:
+        return None, errors.getvalue().strip() or 'assembly failed'
+    data = out.getvalue()
+    return (data if binary else data.encode()), None
+
+
+def build_one(source, output, binary, optimize=False):
+    '''Assemble source into output. Returns an error message or None.'''
+    try:
+        with open(source) as f:
+            data, error = assemble(f.read(), binary, optimize)
+        if error is None:
+            write_atomic(output, data)
+    except OSError as e:
+        return str(e)
+    return error
+
+
+def load_cache(outdir):
+    try:
+        with open(os.path.join(outdir, CACHE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(outdir, cache):
+    data = json.dumps(cache, indent=1, sort_keys=True).encode() + b'\n'
+    write_atomic(os.path.join(outdir, CACHE_FILE), data)
+
+
+def build(sources, outdir, binary=False, optimize=False, jobs=None, force=False,
+          log=None):
+    '''Assemble the stale sources into outdir. Returns
+       (names of the outputs built, {source: error message}).'''
+    os.makedirs(outdir, exist_ok=True)
+    cache = load_cache(outdir)
+    toolchain = toolchain_digest()
+    todo = [] # (source, output, key)
+    for source in sources:
+        output = output_path(source, outdir, binary)
+        name = os.path.basename(output)
+        with open(source, 'rb') as f:
+            key = source_key(f.read(), binary, optimize, toolchain)
+        if force or cache.get(name) != key or not os.path.exists(output):
+            todo.append((source, output, key))
+
+    jobs = min(jobs or os.cpu_count() or 1, len(todo))
+    if jobs > 1 and len(todo) >= POOL_MIN:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            args = [(s, o, binary, optimize) for s, o, _ in todo]
+            errors = list(pool.map(build_one, *zip(*args),
+                                   chunksize=max(1, len(todo) // (4 * jobs))))
+    else:
+        errors = [build_one(s, o, binary, optimize) for s, o, _ in todo]
+
+    built, failed = [], {}
+    for (source, output, key), error in zip(todo, errors):
+        name = os.path.basename(output)
+        if error is None:
+            cache[name] = key
+            built.append(name)
+        else:
+            cache.pop(name, None)
+            failed[source] = error
+        if log: log(f'{name}: {"ok" if error is None else error}')
+    if todo:
+        save_cache(outdir, cache)
+    return built, failed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Assemble LS-8 sources, skipping unchanged ones.')
+    parser.add_argument('sources', nargs='*', default=[HERE],
+                        help='.asm files or directories of them (default: asm/)')
+    parser.add_argument('-o', '--outdir', default=os.path.join(LS8, 'examples'),
+                        help='output directory (default: ls8/examples)')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='write binary .ls8b images')
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help='run the peephole optimizer (see peephole.py)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild everything, ignoring the cache')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='name each program as it is built')
+    args = parser.parse_args(argv[1:])
+
+    start = time.perf_counter()
+    sources = find_sources(args.sources)
+    log = (lambda line: print(line, file=sys.stderr)) if args.verbose else None
+    built, failed = build(sources, args.outdir, args.binary, args.optimize, args.jobs,
+                          args.force, log)
+    for source, error in failed.items():
+        print(f'{source}: {error}', file=sys.stderr)
+    print(f'{len(built)} built, {len(sources) - len(built) - len(failed)} up to date, '
+          f'{len(failed)} failed in {time.perf_counter() - start:.3f} s', file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,49 @@
+; cores.ls8
+;
+; Every core counts down from 255 two hundred times, then takes a spinlock
+; and adds one to a counter shared by all of them. It prints its core ID
+; and the counter, and releases the lock.
+;
+; Run on several cores with ../ls8/multicore.py -n 4 cores.ls8
+;
+; Expected output, per core: its ID and a count from 1 up to the number of
+; cores, every count printed once. On a single CPU: 0 and 1.
+
+    LDI R4,0
+    LDI R1,200           ; outer turns
+    LDI R2,Outer
+Outer:
+    LDI R0,255
+    LDI R3,Inner
+Inner:
+    DEC R0
+    CMP R0,R4
+    JNE R3
+    DEC R1
+    CMP R1,R4
+    JNE R2
+
+    LDI R1,1             ; taken
+    LDI R2,Lock
+    LDI R3,Spin
+Spin:
+    LD R0,R2             ; wait until the lock looks free...
+    CMP R0,R4
+    JNE R3
+    CAS R2,R1            ; ...then take it, if still free (R0 is 0)
+    JNE R3
+
+    LDI R3,Count
+    LD R0,R3
+    INC R0
+    ST R3,R0
+    CID R1
+    PRN R1
+    PRN R0
+    ST R2,R4             ; release the lock
+    HLT
+
+Lock:
+    DB 0
+Count:
+    DB 0
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""Cycles the peephole optimizer (asm.py -O) saves.
+
+Usage: optreport.py [source.asm ...]
+
+Assembles each source with and without -O, runs both images on the
+emulator and prints their sizes and cycle counts. The two runs must halt
+the same way with the same output, or the source is reported as broken.
+Without arguments it reports on mult.asm, call.asm and sctest.asm.
+"""
+
+import os
+import sys
+
+import asm
+from cpu import CPU
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCES = ['mult.asm', 'call.asm', 'sctest.asm']
+MAX_CYCLES = 1000000
+
+
+def run(path, optimize):
+    '''(code size, RunResult) of the assembled source.'''
+    with open(path) as f:
+        code, sym = asm.assemble(f, optimize=optimize)
+    cpu = CPU(capture=True)
+    cpu.load_bytes(code)
+    cpu.symbols = sym
+    return len(code), cpu.run(max_cycles=MAX_CYCLES)
+
+
+def main(argv):
+    sources = argv[1:] or [os.path.join(HERE, f) for f in SOURCES]
+    print(f'{"source":<20} {"bytes":>11} {"cycles":>17} {"saved":>6}')
+    broken = 0
+    for path in sources:
+        size, plain = run(path, False)
+        size_o, optimized = run(path, True)
+        name = os.path.basename(path)
+        if (plain.reason, plain.output) != (optimized.reason, optimized.output):
+            print(f'{name:<20} BROKEN: {plain.reason} {plain.output!r} -> '
+                  f'{optimized.reason} {optimized.output!r}')
+            broken += 1
+            continue
+        saved = plain.cycles - optimized.cycles
+        print(f'{name:<20} {size:>4} -> {size_o:<4} {plain.cycles:>7} -> {optimized.cycles:<7} '
+              f'{saved:>6}')
+    return 1 if broken else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,255 @@
+"""Peephole optimizer for the LS-8 assembler (asm.py -O).
+
+It rewrites the statement list between parse() and emit(). Labels are still
+names there, so emit() gives every label the address of wherever its code
+ends up, and LDI Rn,Label stays right after instructions were removed.
+
+The passes run again and again until none of them changes anything:
+
+* known values: within a block, the constant each of R0-R4 holds is known
+  after an LDI. Reloading the same value is dropped, ADD/SUB of a known
+  register become ADDI, and ALU operations on known values become an LDI
+  of the result. A conditional jump after a CMP of known values is dropped
+  if it falls through, and becomes a JMP if it is taken.
+* dead code: an instruction that only computes a register which is written
+  again before it is read, in the same block, is dropped.
+* PUSH Rn directly followed by POP Rn is dropped.
+* jumps: LDI Rn,L; JMP Rn where L is LDI Rn,M; JMP Rn jumps to M directly.
+  A JMP to the label right after it is dropped, and so are instructions
+  after a JMP, RET, IRET or HLT that no label leads to.
+
+A block starts at a label or data, and ends at any jump, CALL, RET, IRET
+or HLT. The passes assume what hand-written LS-8 programs do: control
+only enters code at labels or returns right after a CALL, and code does
+not read or write its own instructions. R5 (IM), R6 (IS) and R7 (SP) are
+left alone. Interrupt handlers can run at any point; they restore R0-R5
+on IRET.
+"""
+
+import isa
+from asm import Inst, Label
+
+TRACKED = frozenset(range(5)) # R0-R4
+ALL = frozenset(range(8))
+SP = 7
+
+JUMPS = {'JMP', 'JEQ', 'JNE', 'JGT', 'JLT', 'JLE', 'JGE'}
+# control does not continue with the next instruction
+STOPS = {'JMP', 'RET', 'IRET', 'HLT'}
+# ends a block: anything may hold in the registers after it
+BARRIERS = JUMPS | STOPS | {'CALL', 'INT', 'IPI'}
+# halt on a zero divisor, with every register as it is
+MAY_HALT = {'DIV', 'MOD'}
+
+# FL bits (00000LGE) a conditional jump takes; JNE takes it when E is clear
+JUMP_FLAGS = {'JEQ': 0b001, 'JNE': 0b001, 'JGT': 0b010, 'JLT': 0b100,
+              'JLE': 0b101, 'JGE': 0b011}
+
+# register <- f(register, register), foldable on known values
+FOLD = {
+    'ADD': lambda a, b: a + b,
+    'SUB': lambda a, b: a - b,
+    'MUL': lambda a, b: a * b,
+    'AND': lambda a, b: a & b,
+    'OR': lambda a, b: a | b,
+    'XOR': lambda a, b: a ^ b,
+    'SHL': lambda a, b: a << b if b < 8 else 0,
+    'SHR': lambda a, b: a >> b,
+    'DIV': lambda a, b: a // b, # only when b is not 0, which halts
+    'MOD': lambda a, b: a % b,
+}
+# register <- f(register)
+FOLD_ = {
+    'INC': lambda a: a + 1,
+    'DEC': lambda a: a - 1,
+    'NOT': lambda a: ~a,
+}
+# instructions without a side effect besides writing register A
+PURE = {'LDI', 'ADDI', 'LD', 'CID'} | set(FOLD_) | set(FOLD) - {'DIV', 'MOD'}
+
+
+def uses(s):
+    '''(registers read, registers written) by instruction s.'''
+    name, a, b = s.name, s.a, s.b
+    if name == 'LDI': return (), (a,)
+    if name == 'ADDI' or name in FOLD_: return (a,), (a,)
+    if name in FOLD: return (a, b), (a,)
+    if name == 'LD': return (b,), (a,)
+    if name == 'CID': return (), (a,)
+    if name == 'CAS': return (a, b, 0), (0,)
+    if name == 'IPI': return (a, b), ()
+    if name in ('CMP', 'ST'): return (a, b), ()
+    if name in ('PRN', 'PRA', 'INT') or name in JUMPS: return (a,), ()
+    if name == 'PUSH': return (a, SP), (SP,)
+    if name == 'POP': return (SP,), (a, SP)
+    if name == 'CALL': return (a, SP), (SP,)
+    if name == 'RET': return (SP,), (SP,)
+    if name == 'IRET': return (SP,), ALL
+    return (), ()
+
+
+def inst(name, a=None, b=None, line=None):
+    '''A new instruction, with the listing text the assembler would give it.'''
+    kind = isa.KINDS[name]
+    if kind == isa.REG_IMM:
+        text = f'{name} R{a},{b}'
+    elif kind == isa.REG_REG:
+        text = f'{name} R{a},R{b}'
+    elif kind == isa.REG:
+        text = f'{name} R{a}'
+    else:
+        text = name
+    return Inst(name, a, b, text, line)
+
+
+def known_values(statements):
+    '''Drop reloads of known values and fold operations on them.'''
+    out = []
+    known = {} # register -> value or symbol it holds
+    flags = None # FL, if CMP compared known values
+    for s in statements:
+        if type(s) is not Inst:
+            known.clear()
+            flags = None
+            out.append(s)
+            continue
+        name, a, b = s.name, s.a, s.b
+        if name == 'LDI' and a in known and known[a] == b:
+            continue
+        if name in JUMP_FLAGS and flags is not None:
+            taken = bool(flags & JUMP_FLAGS[name])
+            if taken == (name == 'JNE'): # falls through
+                continue
+            s = inst('JMP', a, None, s.line)
+        if name in FOLD and b in known and a in TRACKED:
+            x, y = known.get(a), known[b]
+            if (type(x) is int and type(y) is int and
+                    not (name in ('DIV', 'MOD') and y == 0)):
+                s = inst('LDI', a, FOLD[name](x, y) & 0xFF, s.line)
+            elif name == 'ADD' and a != b:
+                s = inst('ADDI', a, y, s.line)
+            elif name == 'SUB' and a != b and type(y) is int:
+                s = inst('ADDI', a, -y & 0xFF, s.line)
+        elif name in FOLD_ and type(known.get(a)) is int:
+            s = inst('LDI', a, FOLD_[name](known[a]) & 0xFF, s.line)
+        elif name == 'ADDI' and type(known.get(a)) is int and type(b) is int:
+            s = inst('LDI', a, (known[a] + b) & 0xFF, s.line)
+        out.append(s)
+
+        if s.name in BARRIERS:
+            known.clear()
+            flags = None
+            continue
+        if s.name in ('CMP', 'CAS'):
+            x, y = known.get(a), known.get(b)
+            flags = None
+            if s.name == 'CMP' and type(x) is int and type(y) is int:
+                flags = 0b100 if x < y else 0b010 if x > y else 0b001
+        for r in uses(s)[1]:
+            known.pop(r, None)
+        if s.name == 'LDI' and s.a in TRACKED:
+            known[s.a] = s.b
+    return out
+
+
+def dead_code(statements):
+    '''Drop pure instructions whose result is never read.'''
+    out = []
+    live = ALL
+    for s in reversed(statements):
+        if type(s) is not Inst:
+            live = ALL
+            out.append(s)
+            continue
+        reads, writes = uses(s)
+        if s.name in PURE and s.a in TRACKED and s.a not in live:
+            continue
+        if s.name in BARRIERS or s.name in MAY_HALT:
+            live = ALL
+        live = (live - set(writes)) | set(reads)
+        out.append(s)
+    out.reverse()
+    return out
+
+
+def push_pop(statements):
+    '''Drop PUSH Rn directly followed by POP Rn.'''
+    out = []
+    for s in statements:
+        if (type(s) is Inst and s.name == 'POP' and out and
+                type(out[-1]) is Inst and out[-1].name == 'PUSH' and
+                out[-1].a == s.a):
+            out.pop()
+            continue
+        out.append(s)
+    return out
+
+
+def jumps(statements):
+    '''Shortcut jumps to jumps, drop jumps to the next instruction and
+       unreachable instructions.'''
+    # label -> index of the statement after it and any labels following it
+    targets = {}
+    pending = []
+    for i, s in enumerate(statements):
+        if type(s) is Label:
+            pending.append(s.name)
+        else:
+            for name in pending: targets[name] = i
+            pending = []
+    for name in pending: targets[name] = len(statements)
+
+    def jump_pair(i):
+        '''(register, label) of LDI Rn,Label; JMP Rn at i, or None.'''
+        if i + 1 >= len(statements): return None
+        s, t = statements[i], statements[i + 1]
+        if (type(s) is Inst and type(t) is Inst and s.name == 'LDI' and
+                t.name == 'JMP' and s.a == t.a and type(s.b) is str):
+            return s.a, s.b
+        return None
+
+    def next_label(i, label):
+        '''Whether label is one of the labels right after statement i.'''
+        j = targets.get(label)
+        return (j is not None and j > i and
+                all(type(s) is Label for s in statements[i + 1:j]))
+
+    out = []
+    reachable = True
+    for i, s in enumerate(statements):
+        if type(s) is not Inst:
+            reachable = True
+        elif not reachable:
+            continue
+        pair = jump_pair(i)
+        if pair:
+            r, label = pair
+            seen = {label}
+            while label in targets:
+                hop = jump_pair(targets[label])
+                if not hop or hop[0] != r or hop[1] in seen: break
+                label = hop[1]
+                seen.add(label)
+            if label != s.b:
+                s = inst('LDI', r, label, s.line)
+        if (type(s) is Inst and s.name == 'JMP' and out and
+                type(out[-1]) is Inst and out[-1].name == 'LDI' and
+                out[-1].a == s.a and next_label(i, out[-1].b)):
+            continue
+        out.append(s)
+        if type(s) is Inst and s.name in STOPS:
+            reachable = False
+    return out
+
+
+PASSES = [known_values, dead_code, push_pop, jumps]
+
+
+def optimize(statements):
+    '''Optimized copy of a list of parsed statements.'''
+    while True:
+        before = statements
+        for optimization in PASSES:
+            statements = optimization(statements)
+        if statements == before:
+            return statements
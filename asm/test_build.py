@@ -0,0 +1,74 @@
+"""Incremental builds: what build.py writes and what it skips.
+
+Run with: python -m pytest asm
+"""
+
+import os
+import shutil
+
+import asm
+import build
+from cpu import CPU
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def program(path):
+    '''RAM after loading path.'''
+    cpu = CPU()
+    cpu.load(path)
+    return bytes(cpu.ram)
+
+
+def test_builds_what_asm_assembles(tmp_path):
+    sources = build.find_sources([build.HERE])
+    for binary in (False, True):
+        built, failed = build.build(sources, str(tmp_path), binary)
+        assert (len(built), failed) == (len(sources), {})
+        for source, name in zip(sources, built):
+            with open(source) as f:
+                code, _ = asm.assemble(f)
+            assert program(str(tmp_path / name)) == bytes(code).ljust(256, b'\0')
+
+
+def test_rebuilds_only_what_changed(tmp_path):
+    src = tmp_path / 'src'
+    out = str(tmp_path / 'out')
+    src.mkdir()
+    for name in ('mult.asm', 'stack.asm'):
+        shutil.copy(os.path.join(build.HERE, name), src)
+    sources = build.find_sources([str(src)])
+    assert build.build(sources, out) == (['mult.ls8', 'stack.ls8'], {})
+    assert build.build(sources, out) == ([], {})
+    with open(src / 'mult.asm', 'a') as f:
+        f.write('; one more line\n')
+    assert build.build(sources, out) == (['mult.ls8'], {})
+    # another format or -O is another build
+    assert build.build(sources, out, optimize=True) == (['mult.ls8', 'stack.ls8'], {})
+    assert build.build(sources, out, binary=True) == (['mult.ls8b', 'stack.ls8b'], {})
+    os.remove(os.path.join(out, 'stack.ls8b'))
+    assert build.build(sources, out, binary=True) == (['stack.ls8b'], {})
+
+
+def test_failure_leaves_no_output(tmp_path):
+    source = tmp_path / 'bad.asm'
+    source.write_text('LDI R0,Nowhere\nHLT\n')
+    built, failed = build.build([str(source)], str(tmp_path / 'out'))
+    assert built == [] and list(failed) == [str(source)]
+    assert os.listdir(tmp_path / 'out') == [build.CACHE_FILE]
+
+
+def test_pool_builds_the_same(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    for i in range(build.POOL_MIN):
+        shutil.copy(os.path.join(build.HERE, 'printstr.asm'), src / f'p{i}.asm')
+    sources = build.find_sources([str(src)])
+    built, failed = build.build(sources, str(tmp_path / 'pool'), jobs=2)
+    assert (len(built), failed) == (build.POOL_MIN, {})
+    build.build(sources, str(tmp_path / 'serial'), jobs=1)
+    for name in built:
+        assert read(tmp_path / 'pool' / name) == read(tmp_path / 'serial' / name)
@@ -0,0 +1,60 @@
+"""The peephole optimizer (asm.py -O) must not change what programs do.
+
+Every source in this directory and the benchmark's stress programs are
+assembled with and without -O and run on the emulator: both images must
+stop the same way with the same output, and with the same registers
+unless the code shrank and labels moved. The interrupt examples get
+scripted timer and keyboard interrupts, the same for both images.
+
+Run with: python -m pytest asm
+"""
+
+import glob
+import io
+import os
+
+import pytest
+
+import asm
+import benchmark
+from cpu import CPU
+from interrupts import ScriptedSource, TIMER_INTERRUPT, KEYBOARD_INTERRUPT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAX_CYCLES = 200000
+# (cycle, interrupt[, key]) for the interrupt examples
+SCRIPT = ([(cycle, TIMER_INTERRUPT) for cycle in range(1000, MAX_CYCLES, 5000)] +
+          [(cycle, KEYBOARD_INTERRUPT, ord(key))
+           for cycle, key in zip(range(3500, MAX_CYCLES, 7000), 'peephole')])
+
+
+def sources():
+    '''name -> source of everything the test runs.'''
+    found = {}
+    for path in sorted(glob.glob(os.path.join(HERE, '*.asm'))):
+        with open(path) as f:
+            found[os.path.basename(path)] = f.read()
+    found.update(benchmark.stress_sources())
+    return found
+
+
+SOURCES = sources()
+
+
+def run(source, optimize):
+    '''(code size, RunResult) of the assembled source.'''
+    code, sym = asm.assemble(io.StringIO(source), optimize=optimize)
+    cpu = CPU(capture=True)
+    cpu.load_bytes(code)
+    cpu.symbols = sym
+    cpu.interrupts.add(ScriptedSource(SCRIPT))
+    return len(code), cpu.run(max_cycles=MAX_CYCLES)
+
+
+@pytest.mark.parametrize('name', sorted(SOURCES))
+def test_optimized_runs_the_same(name):
+    size, plain = run(SOURCES[name], False)
+    size_o, optimized = run(SOURCES[name], True)
+    assert (optimized.reason, optimized.output) == (plain.reason, plain.output)
+    if size_o == size:
+        assert optimized.registers == plain.registers
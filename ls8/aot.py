@@ -0,0 +1,165 @@
+"""Ahead-of-time translation of whole LS-8 images into Python modules.
+
+translate() runs the JIT's block compiler over every block it can find from
+the entry point: fallthroughs, the code after CALLs and conditional jumps,
+and every LDI immediate, since jump targets always come from a register.
+It writes one module holding the RAM image, entry point and symbols, a
+function per block, and machine(): a PC state machine running all the
+blocks with the registers in locals. It returns to the JIT's loop when it
+runs out of cycles, an interrupt may be pending, or the PC leaves the
+translated code. As in the JIT, a block ends right after a write to IM or
+IS, so a pending interrupt is taken before the next instruction.
+
+The module is cached in __ls8cache__ next to the image, named after a hash
+of the image's content, and Python keeps the compiled .pyc beside it. A
+warm load() then does no parsing, decoding or compiling.
+
+The blocks are installed in the CPU's BlockCompiler like any compiled
+block. A guest writing into its own code switches the state machine off
+and drops the blocks it hit; those addresses fall back to the JIT and the
+interpreter.
+"""
+import hashlib
+import importlib.util
+import os
+import types
+
+import debuginfo
+from cpu import *
+from jit import BlockCompiler, WRITES, indent
+
+VERSION = 3 # bump when generated modules change
+CACHE_DIR = '__ls8cache__'
+
+
+def digest(data):
+    '''Cache key of an image file's content.'''
+    return hashlib.sha256(b'ls8 aot %d\n' % VERSION + data).hexdigest()[:16]
+
+
+def cache_path(filename, key):
+    base = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(os.path.dirname(filename), CACHE_DIR, f'{base}.{key}.py')
+
+
+def translate(cpu, name=''):
+    '''Python source of a module running the program in cpu's RAM.'''
+    compiler = BlockCompiler(cpu)
+    ram = cpu.ram
+    todo = [cpu.pc] + [ram[addr] for addr in range(0xF8, 0x100) if ram[addr]]
+    found = {} # entry PC -> (instructions, end address)
+    while todo:
+        pc = todo.pop()
+        if pc in found: continue
+        insts, end = compiler.scan(pc)
+        if not insts: continue
+        found[pc] = insts, end
+        todo.append(end & 0xFF)
+        todo += [b for _, op, _, b in insts if op == LDI]
+
+    lines = [f'# LS-8 program {name}, translated by aot.py: do not edit',
+             f'ENTRY = {cpu.pc}',
+             f'SYMBOLS = {cpu.symbols!r}',
+             f'RAM = bytes.fromhex({bytes(ram).hex()!r})',
+             '']
+    for pc in sorted(found):
+        insts, end = found[pc]
+        lines.append(compiler.source(insts, end, f'block_{pc}'))
+    lines.append('# entry PC -> (block, end address)')
+    lines.append('BLOCKS = {')
+    lines += [f'    {pc}: (block_{pc}, {found[pc][1]}),' for pc in sorted(found)]
+    lines.append('}')
+    lines.append('')
+    lines += machine_source(compiler, found)
+    return '\n'.join(lines) + '\n'
+
+
+def machine_source(compiler, found):
+    '''Lines of machine(cpu, reg, ram, code, budget): runs blocks until
+       budget instructions have run, returns (next PC, instructions).'''
+    regs = ', '.join(f'r{r}' for r in range(8))
+    sync = [', '.join(f'reg[{r}]' for r in range(8)) + f' = {regs}', 'cpu.fl = fl']
+
+    def spill(target, n):
+        return [f'pc = {target}', f'n += {n}'] + sync + ['return pc, n']
+
+    def blocks(pcs):
+        '''if tree on pc over the sorted entry PCs'''
+        if len(pcs) > 4:
+            mid = len(pcs) // 2
+            return ([f'if pc < {pcs[mid]}:'] + indent(blocks(pcs[:mid])) +
+                    ['else:'] + indent(blocks(pcs[mid:])))
+        out = []
+        for i, pc in enumerate(pcs):
+            insts, end = found[pc]
+            # an interrupt may become pending if IM (R5) or IS (R6) is
+            # written, which scan() only lets the last instruction do
+            writes = any(op in WRITES and a in (5, 6) for _, op, a, _ in insts)
+
+            def leave(target, n, writes=writes):
+                check = ['if r5 & r6 and cpu.ie: break'] if writes else []
+                return [f'pc = {target}', f'n += {n}'] + check + ['continue']
+
+            out.append(f'{"if" if i == 0 else "elif"} pc == {pc}:')
+            out += indent(compiler.body(insts, end, leave, spill))
+        return out + ['else:', '    break']
+
+    lines = ['def machine(cpu, reg, ram, code, budget):',
+             f'    {regs} = reg',
+             '    fl = cpu.fl',
+             '    console = cpu.console',
+             '    pc = cpu.pc',
+             '    n = 0',
+             '    while n < budget:']
+    lines += indent(blocks(sorted(found)), 2)
+    lines += indent(sync + ['return pc, n'])
+    return lines
+
+
+def import_path(path, key):
+    spec = importlib.util.spec_from_file_location(f'ls8_aot_{key}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def compile_image(cpu, filename):
+    '''The translated module of an image, from the cache if it is there.'''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    key = digest(data)
+    path = cache_path(filename, key)
+    if os.path.exists(path):
+        return import_path(path, key)
+
+    cpu.load(filename)
+    source = translate(cpu, os.path.basename(filename))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path) # never leave a half written module
+        return import_path(path, key)
+    except OSError: # read-only directory: translate without caching
+        module = types.ModuleType(f'ls8_aot_{key}')
+        exec(compile(source, filename, 'exec'), module.__dict__)
+        return module
+
+
+def load(cpu, filename):
+    '''Load an image into cpu along with its translated blocks, and its
+       debug info sidecar as CPU.load() does, cached module or not. run()
+       then executes them through the JIT, which is turned on if it is off.'''
+    module = compile_image(cpu, filename)
+    if cpu.jit is None:
+        cpu.jit = BlockCompiler(cpu)
+    cpu.load_bytes(module.RAM)
+    cpu.pc = module.ENTRY
+    cpu.symbols = dict(module.SYMBOLS)
+    cpu.debug = debuginfo.load_sidecar(filename)
+    for pc, (block, end) in module.BLOCKS.items():
+        cpu.jit.install(pc, block, end)
+        cpu.jit.machine_code[pc:end] = b'\1' * (end - pc)
+    cpu.jit.machine = module.machine
+    return module
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""Batch runner: run many LS-8 images over a process pool.
+
+Usage: batch.py [options] (directory | manifest) ...
+
+A directory is searched for *.ls8 and *.ls8b files, a manifest lists one
+image path per line (relative to the manifest, '#' starts a comment). Each
+worker process keeps one warm CPU and resets it between images. One JSON object per image
+is written as soon as it finishes:
+
+    {"image": ..., "reason": "hlt", "cycles": ..., "wall_time": ...,
+     "output": ..., "error": null}
+
+run_forks() is the library side for many runs sharing a prefix: run the
+prefix once, then run forks of that CPU, one per input.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cpu import *
+
+SLICE = 100000 # cycles between two looks at the wall clock
+TIMEOUT = 'timeout' # halt reason: ran out of wall time
+LOAD_ERROR = 'load_error' # halt reason: image could not be read
+
+worker_cpu = None # one warm CPU per worker process
+
+
+def find_images(sources):
+    """Expand directories and manifests into a list of image paths."""
+    images = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                images += [os.path.join(root, f) for f in sorted(files)
+                           if f.endswith(('.ls8', '.ls8b'))]
+        elif source.endswith(('.ls8', '.ls8b')):
+            images.append(source)
+        else:
+            base = os.path.dirname(source)
+            with open(source) as f:
+                for line in f:
+                    line = line.split('#')[0].strip()
+                    if line: images.append(os.path.join(base, line))
+    return images
+
+
+def run_image(image, max_cycles=None, timeout=None, jit=False, aot=False):
+    """Run one image to completion or to its limits; returns a result dict.
+       With aot=True the image runs translated ahead of time (see aot.py)."""
+    global worker_cpu
+    jit = jit or aot
+    if worker_cpu is None or (worker_cpu.jit is not None) != jit:
+        worker_cpu = CPU(jit=jit, capture=True)
+    cpu = worker_cpu
+    cpu.reset()
+
+    start = time.perf_counter()
+    result = {'image': image, 'reason': None, 'cycles': 0,
+              'wall_time': 0.0, 'output': '', 'error': None}
+    try:
+        if aot:
+            import aot as translator
+            translator.load(cpu, image)
+        else:
+            cpu.load(image)
+    except (OSError, ValueError) as e:
+        result.update(reason=LOAD_ERROR, error=str(e))
+        return result
+
+    output = []
+    while True:
+        budget = SLICE if max_cycles is None else min(SLICE, max_cycles - cpu.cycles)
+        r = cpu.run(max_cycles=budget)
+        output.append(r.output)
+        if r.reason != MAX_CYCLES:
+            reason = r.reason
+            break
+        if max_cycles is not None and cpu.cycles >= max_cycles:
+            reason = MAX_CYCLES
+            break
+        if timeout is not None and time.perf_counter() - start >= timeout:
+            reason = TIMEOUT
+            break
+
+    result.update(reason=reason, cycles=cpu.cycles, output=''.join(output),
+                  wall_time=round(time.perf_counter() - start, 6),
+                  error=repr(cpu.error) if cpu.error is not None else None)
+    return result
+
+
+def run_batch(images, jobs=None, max_cycles=None, timeout=None, jit=False,
+              aot=False):
+    """Yield result dicts as images finish, spread over jobs processes."""
+    if jobs == 1:
+        for image in images:
+            yield run_image(image, max_cycles, timeout, jit, aot)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_image, image, max_cycles, timeout, jit, aot)
+                   for image in images]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def run_forks(cpu, inputs, prepare=None, max_cycles=None, jobs=None):
+    """Run a fork of cpu (see CPU.fork()) per input and return the list of
+       their RunResults. prepare(fork, input) sets a fork up, e.g. writes
+       the input into RAM or adds an interrupt source.
+
+       With jobs > 1 the inputs are split over os.fork() workers, which
+       start from the parent's memory copy-on-write; results come back
+       pickled through a pipe. jobs=1 or no os.fork() runs in-process."""
+    inputs = list(inputs)
+    checkpoint = cpu.checkpoint()
+
+    def run_all(part):
+        results = []
+        for i in part:
+            fork = cpu.fork(checkpoint)
+            if prepare is not None: prepare(fork, inputs[i])
+            results.append((i, fork.run(max_cycles=max_cycles)))
+        return results
+
+    jobs = min(jobs or os.cpu_count() or 1, len(inputs))
+    if jobs <= 1 or not hasattr(os, 'fork'):
+        return [result for _, result in run_all(range(len(inputs)))]
+
+    workers = []
+    for part in (range(n, len(inputs), jobs) for n in range(jobs)):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0: # worker
+            os.close(r)
+            status = 0
+            try:
+                data = pickle.dumps(run_all(part))
+            except BaseException as e:
+                data = pickle.dumps(RuntimeError(f'fork worker failed: {e!r}'))
+                status = 1
+            with os.fdopen(w, 'wb') as f:
+                f.write(data)
+            os._exit(status)
+        os.close(w)
+        workers.append((pid, r))
+
+    results = [None] * len(inputs)
+    failure = None
+    for pid, r in workers:
+        with os.fdopen(r, 'rb') as f:
+            data = pickle.loads(f.read())
+        os.waitpid(pid, 0)
+        if isinstance(data, Exception):
+            failure = data
+            continue
+        for i, result in data:
+            results[i] = result
+    if failure is not None: raise failure
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run LS-8 images in parallel.')
+    parser.add_argument('sources', nargs='+',
+                        help='directories, manifests or .ls8/.ls8b files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--max-cycles', type=int, default=None,
+                        help='per-image cycle limit')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='per-image wall time limit in seconds')
+    parser.add_argument('--jit', action='store_true',
+                        help='use the basic-block JIT')
+    parser.add_argument('--aot', action='store_true',
+                        help='run images translated ahead of time, cached '
+                             'in __ls8cache__')
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON-lines result file (default: stdout)')
+    args = parser.parse_args(argv[1:])
+
+    images = find_images(args.sources)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for result in run_batch(images, args.jobs, args.max_cycles,
+                                args.timeout, args.jit, args.aot):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout: out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
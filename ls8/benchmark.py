@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+"""Benchmark suite for the emulator and the assembler.
+
+Usage: benchmark.py [--engine interp,jit] [--save FILE] [--baseline FILE]
+                    [--threshold 0.1] [--min-time SECONDS] [--quick]
+
+Runs every program in examples/ and a few generated stress programs (long
+loops, deep CALL chains, an ALU-heavy kernel) on CPU, with output going to
+a NullConsole. The interrupt examples get scripted interrupts every
+INTERRUPT_EVERY cycles instead of the wall-clock timer and stdin, so
+nothing is polled and every run does the same work; their idle loops are
+fast-forwarded, which shows in their instructions/second. Each program is
+run from reset() again and again for at least --min-time seconds, so
+decoding (and the JIT's compiling) is part of the time.
+
+Reported per engine and program:
+
+    inst/s      guest instructions (cycles) per second of run()
+    ns/cycle    nanoseconds per guest instruction, the inverse; a fused
+                superinstruction or a JIT block is one dispatch but counts
+                as every instruction in it, so this is not time per dispatch
+    load_us     microseconds for load() of the program's .ls8 file
+    peak_kb     peak memory tracemalloc sees over load() and one run()
+
+and for the assembler, lines per second on generated sources
+(../asm/bench.py).
+
+--save writes the results as JSON. --baseline compares against such a file
+and exits with status 1 if inst/s or lines/s dropped, or peak_kb grew, by
+more than --threshold (a fraction); load times are shown but too noisy to
+fail on.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from cpu import *
+from console import NullConsole
+from interrupts import ScriptedSource, TIMER_INTERRUPT, KEYBOARD_INTERRUPT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'asm'))
+import asm
+
+ENGINES = ('interp', 'jit')
+MAX_CYCLES = 2000000 # per run; the interrupt examples never halt
+INTERRUPT_EVERY = 5000 # cycles between scripted interrupts
+ASM_LINES = 100000 # lines of the generated assembler sources
+VERSION = 2 # of the JSON results
+
+# metric -> True if higher is better; only these can fail a run
+CHECKED = {'inst_s': True, 'lines_s': True, 'peak_kb': False}
+
+
+def stress_sources():
+    '''name -> assembly source of the generated stress programs.'''
+    return {
+        # 255 turns of an inner countdown loop, 200 times
+        'loop': '''
+            LDI R4,0
+            LDI R0,200
+            LDI R2,OUTER
+            LDI R3,INNER
+        OUTER:
+            LDI R1,255
+        INNER:
+            DEC R1
+            CMP R1,R4
+            JNE R3
+            DEC R0
+            CMP R0,R4
+            JNE R2
+            HLT
+        ''',
+        # CALL 60 deep and RET all the way back, 100 times
+        'calls': '''
+            LDI R1,0
+            LDI R2,DOWN
+            LDI R4,100
+        REPEAT:
+            LDI R0,60
+            CALL R2
+            DEC R4
+            LDI R3,REPEAT
+            CMP R4,R1
+            JNE R3
+            HLT
+        DOWN:
+            DEC R0
+            LDI R3,DONE
+            CMP R0,R1
+            JEQ R3
+            CALL R2
+        DONE:
+            RET
+        ''',
+        # MUL/ADD/XOR/SHL/SHR/AND/OR/MOD on two values, 255 * 4 times
+        'alu': '''
+            LDI R0,7
+            LDI R1,13
+            LDI R3,255
+            LDI R4,0
+            LDI R2,KERNEL
+        KERNEL:
+        ''' + '''
+            MUL R0,R1
+            ADD R1,R0
+            XOR R0,R1
+            SHL R1,R3
+            OR R1,R0
+            SHR R0,R4
+            AND R0,R3
+            INC R1
+            MOD R0,R1
+            ADDI R0,3
+        ''' * 4 + '''
+            DEC R3
+            CMP R3,R4
+            JNE R2
+            HLT
+        ''',
+    }
+
+
+def programs(tmpdir):
+    '''(name, .ls8 path, interrupt script) of every program to run.'''
+    found = []
+    for path in sorted(glob.glob(os.path.join(HERE, 'examples', '*.ls8'))):
+        name = os.path.basename(path)
+        number = {'interrupts.ls8': TIMER_INTERRUPT,
+                  'keyboard.ls8': KEYBOARD_INTERRUPT}.get(name)
+        script = None
+        if number is not None:
+            script = [(cycle, number, 65)
+                      for cycle in range(INTERRUPT_EVERY, MAX_CYCLES + 1, INTERRUPT_EVERY)]
+        found.append((name, path, script))
+    for name, source in stress_sources().items():
+        listing = []
+        code, sym = asm.assemble(source.splitlines(), listing)
+        path = os.path.join(tmpdir, f'{name}.ls8')
+        with open(path, 'w') as f:
+            asm.write_listing(f, code, listing)
+        found.append((f'{name} (generated)', path, None))
+    return found
+
+
+def make_cpu(engine):
+    return CPU(jit=engine == 'jit', console=NullConsole())
+
+
+def bench_program(engine, path, script, min_time):
+    '''Metrics of one program on one engine.'''
+    cpu = make_cpu(engine)
+    source = ScriptedSource(script) if script else None
+    if source: cpu.interrupts.add(source)
+
+    loads = []
+    elapsed = cycles = 0
+    while elapsed < min_time or not loads:
+        cpu.reset() # restarts the scripted source
+        t = time.perf_counter()
+        cpu.load(path)
+        loads.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        cycles += cpu.run(max_cycles=MAX_CYCLES).cycles
+        elapsed += time.perf_counter() - t
+
+    # memory in a run of its own: tracemalloc slows everything down
+    cpu = make_cpu(engine)
+    if script: cpu.interrupts.add(ScriptedSource(script))
+    tracemalloc.start()
+    cpu.load(path)
+    cpu.run(max_cycles=MAX_CYCLES)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'inst_s': cycles / elapsed,
+            'ns_cycle': elapsed / cycles * 1e9,
+            'load_us': min(loads) * 1e6,
+            'peak_kb': peak / 1024}
+
+
+def bench_assembler(lines):
+    '''Lines per second of asm.assemble() on a generated source.'''
+    import bench # ../asm/bench.py
+    results = {}
+    for name in ('binary', 'text'):
+        t = time.perf_counter()
+        bench.assemble(lines, name == 'text')
+        results[f'asm {name}'] = {'lines_s': lines / (time.perf_counter() - t)}
+    return results
+
+
+def run_suite(engines, min_time, asm_lines=ASM_LINES, log=None):
+    '''{benchmark name: {metric: value}}'''
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for engine in engines:
+            for name, path, script in programs(tmpdir):
+                key = f'{engine} {name}'
+                results[key] = bench_program(engine, path, script, min_time)
+                if log: log(key, results[key])
+    for key, metrics in bench_assembler(asm_lines).items():
+        results[key] = metrics
+        if log: log(key, metrics)
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''Lines describing regressions of results against baseline.'''
+    regressions = []
+    for key, metrics in results.items():
+        old = baseline.get(key)
+        if old is None: continue
+        for metric, higher_is_better in CHECKED.items():
+            if metric not in metrics or metric not in old or not old[metric]: continue
+            change = metrics[metric] / old[metric] - 1
+            worse = -change if higher_is_better else change
+            if worse > threshold:
+                regressions.append(f'{key}: {metric} {old[metric]:.4g} -> '
+                                   f'{metrics[metric]:.4g} ({change:+.1%})')
+    return regressions
+
+
+def show(key, metrics):
+    if 'inst_s' in metrics:
+        print(f'{key:<34} {metrics["inst_s"] / 1e6:8.2f}M inst/s {metrics["ns_cycle"]:8.1f} ns/cycle '
+              f'{metrics["load_us"]:8.1f} us load {metrics["peak_kb"]:8.1f} kB peak')
+    else:
+        print(f'{key:<34} {metrics["lines_s"] / 1e3:8.1f}k lines/s')
+    sys.stdout.flush()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the LS-8 emulator and assembler.')
+    parser.add_argument('--engine', default=','.join(ENGINES),
+                        help='comma separated engines: interp, jit (default: both)')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='seconds to repeat each program for (default: 0.5)')
+    parser.add_argument('--quick', action='store_true',
+                        help='short runs and a small assembler source, for a smoke test')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='fraction a checked metric may get worse by (default: 0.10)')
+    args = parser.parse_args(argv[1:])
+
+    engines = [e for e in args.engine.split(',') if e]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f'unknown engine {engine}')
+    min_time = 0.05 if args.quick else args.min_time
+    asm_lines = ASM_LINES // 10 if args.quick else ASM_LINES
+    results = run_suite(engines, min_time, asm_lines=asm_lines, log=show)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'version': VERSION, 'results': results}, f, indent=1, sort_keys=True)
+            f.write('\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != VERSION:
+            print(f'{args.baseline}: results version {baseline.get("version")}, '
+                  f'expected {VERSION}', file=sys.stderr)
+            return 2
+        regressions = compare(results, baseline['results'], args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if regressions: return 1
+        print(f'no regression beyond {args.threshold:.0%} against {args.baseline}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
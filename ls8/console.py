@@ -0,0 +1,142 @@
+"""Console devices for the LS-8 CPU: where PRN and PRA output goes.
+
+PRN and PRA append to a bytearray instead of making a write() call per
+instruction; the buffer is handed to the sink according to a flush policy:
+
+* FLUSH_LINE: after every newline, for terminals
+* FLUSH_FULL: once BUFFER_SIZE bytes are waiting, for pipes and files
+* FLUSH_END: only on flush(), which the CPU calls when run() returns and
+  before it sleeps in an idle loop
+
+PRA bytes are characters 0-255, so text is the latin-1 decoding of the
+buffer, which is what chr() gave before.
+"""
+import copy
+import sys
+
+FLUSH_LINE = 'line'
+FLUSH_FULL = 'full'
+FLUSH_END = 'end'
+FLUSH_POLICIES = (FLUSH_LINE, FLUSH_FULL, FLUSH_END)
+
+BUFFER_SIZE = 8192 # bytes waiting before a FLUSH_FULL console writes
+
+
+class Console:
+    """Buffered console; subclasses say where flushed bytes go in emit()."""
+
+    def __init__(self, flush=FLUSH_FULL, size=BUFFER_SIZE):
+        if flush not in FLUSH_POLICIES:
+            raise ValueError(f'Unknown flush policy {flush}')
+        self.buffer = bytearray()
+        self.policy = flush
+        self.line = flush == FLUSH_LINE
+        self.limit = size if flush == FLUSH_FULL else float('inf')
+
+    def prn(self, value):
+        '''PRN: the value in decimal and a newline.'''
+        self.buffer += b'%d\n' % value
+        if self.line or len(self.buffer) >= self.limit: self.flush()
+
+    def pra(self, value):
+        '''PRA: one character.'''
+        self.buffer.append(value)
+        if (self.line and value == 10) or len(self.buffer) >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.emit(bytes(self.buffer))
+            self.buffer.clear()
+
+    def emit(self, data):
+        pass
+
+    def reset(self):
+        '''Called by CPU.reset().'''
+        self.flush()
+
+    def save(self):
+        '''State for CPU.checkpoint(); pending output is written out first.'''
+        self.flush()
+        return None
+
+    def load(self, state):
+        pass
+
+    def fork(self):
+        '''An empty console of the same kind for CPU.fork().'''
+        self.flush()
+        twin = copy.copy(self)
+        twin.buffer = bytearray()
+        return twin
+
+    def close(self):
+        self.flush()
+
+
+class StreamConsole(Console):
+    '''Writes to a text stream, sys.stdout by default. The policy defaults to
+       FLUSH_LINE on a terminal and FLUSH_FULL otherwise.'''
+
+    def __init__(self, stream=None, flush=None, size=BUFFER_SIZE):
+        self.stream = stream or sys.stdout
+        if flush is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            flush = FLUSH_LINE if isatty and isatty() else FLUSH_FULL
+        super().__init__(flush, size)
+
+    def emit(self, data):
+        self.stream.write(data.decode('latin-1'))
+        self.stream.flush()
+
+
+class CaptureConsole(Console):
+    '''Keeps everything in memory, like io.BytesIO.
+       Nothing is lost whatever the policy: tell() and text() see the buffer.'''
+
+    def __init__(self, flush=FLUSH_END, size=BUFFER_SIZE):
+        super().__init__(flush, size)
+        self.data = bytearray()
+
+    def emit(self, data):
+        self.data += data
+
+    def tell(self):
+        return len(self.data) + len(self.buffer)
+
+    def getvalue(self):
+        '''Everything written so far, as bytes.'''
+        self.flush()
+        return bytes(self.data)
+
+    def text(self, start=0):
+        '''Output from byte offset start on, as a string.'''
+        self.flush()
+        return self.data[start:].decode('latin-1')
+
+    def reset(self):
+        self.buffer.clear()
+        self.data.clear()
+
+    def save(self):
+        return self.getvalue()
+
+    def load(self, state):
+        self.buffer.clear()
+        self.data[:] = state
+
+    def fork(self):
+        twin = super().fork()
+        twin.data = bytearray()
+        return twin
+
+
+class NullConsole(Console):
+    '''Drops all output, for benchmarks.'''
+
+    def prn(self, value):
+        pass
+
+    def pra(self, value):
+        pass
@@ -1,125 +1,418 @@
 # https://github.com/Nov05/Lambda-Computer-Architecture
-######################################
-# debug mode
-debug = False
-trace = False
-######################################
 
 """CPU functionality."""
+import struct
 import sys
-from datetime import datetime
-import msvcrt # for keyboard interrupt in Windows OS
-
-
-LDI = 0b10000010
-LD = 0b10000011 # 00000aaa 00000bbb
-PRN = 0b01000111
-HLT = 0b00000001
-PUSH = 0b01000101
-POP = 0b01000110
-JMP = 0b01010100 # 00000rrr
-CALL = 0b01010000
-RET = 0b00010001
-ST = 0b10000100
-PRA = 0b01001000
-IRET = 0b00010011
-JEQ = 0b01010101
-JNE = 0b01010110
-# ALU
-ADD = 0b10100000 # 00000aaa 00000bbb
-SUB = 0b10100011 # 00000aaa 00000bbb
-MUL = 0b10100010 # 00000aaa 00000bbb
-MOD = 0b10100100 # 00000aaa 00000bbb
-AND = 0b10101000 # 00000aaa 00000bbb
-NOT = 0b01101001 # 00000rrr
-OR = 0b10101010 # 00000aaa 00000bbb
-XOR = 0b10101011 # 00000aaa 00000bbb
-SHL = 0b10101100 # 00000aaa 00000bbb
-SHR = 0b10101101 # 00000aaa 00000bbb
-CMP = 0b10100111 # 00000aaa 00000bbb
-INC = 0b01100101 # 00000rrr
-DEC = 0b01100110 # 00000rrr
-ADDI = 0b10101110 # 00000rrr iiiiiiii, extensional op to add an immediate value
-
-# interrupt types
-TIMER_INTERRUPT = 0
-KEYBOARD_INTERRUPT = 1
+import time
+from array import array
+from collections import namedtuple
+from contextlib import nullcontext
+from functools import partial, partialmethod
+import debuginfo
+import image
+from isa import *
+from console import CaptureConsole, StreamConsole
+from interrupts import InterruptController, NEVER, POLL_CYCLES, TIMER_INTERRUPT
+
+
+# ALU engine: registerA <- f(registerA, registerB), kept in 0-255
+ALU_OPS = {
+    ADD: lambda a, b: (a + b) & 0xFF,
+    SUB: lambda a, b: (a - b) & 0xFF,
+    MUL: lambda a, b: (a * b) & 0xFF,
+    DIV: lambda a, b: a // b, # ZeroDivisionError halts the CPU
+    MOD: lambda a, b: a % b,
+    AND: lambda a, b: a & b,
+    OR: lambda a, b: a | b,
+    XOR: lambda a, b: a ^ b,
+    SHL: lambda a, b: (a << b) & 0xFF,
+    SHR: lambda a, b: a >> b,
+}
+# register <- f(register)
+ALU_OPS_ = {
+    NOT: lambda a: ~a & 0xFF,
+    INC: lambda a: (a + 1) & 0xFF,
+    DEC: lambda a: (a - 1) & 0xFF,
+}
+# conditional jumps: jump if any of these FL bits (00000LGE) is set
+JUMP_FLAGS = {
+    JEQ: 0b001,
+    JGT: 0b010,
+    JLT: 0b100,
+    JLE: 0b101,
+    JGE: 0b011,
+}
+
+SPIN_MAX = 8 # longest idle loop spin_length() looks for, in instructions
+IDLE_SLEEP = 0.5 # seconds, when nothing can ever wake an idle CPU
+
+# superinstructions: pairs and runs decode() fuses into one entry in FAST mode
+FUSE_MAX = 4 # most instructions in one fused entry (a run of PUSH or POP)
+FUSE_SPAN = 2 * FUSE_MAX # most bytes one decoded entry covers
+FUSE_JUMPS = (JMP, JEQ, JNE, JGT, JLT, JLE, JGE, CALL) # after LDI
+
+# dispatch modes, each with its own branch table (see CPU.set_mode())
+FAST = 'fast' # plain handlers, no instrumentation
+DEBUG = 'debug' # print what every instruction does
+TRACE = 'trace' # print the CPU state after every instruction
+PROFILE = 'profile' # count cycles per opcode, PC and call stack
+RECORD = 'record' # write TRACE's state as binary records, see tracer.py
+MODES = (FAST, DEBUG, TRACE, PROFILE, RECORD)
+
+# debug mode: what an instruction prints before it executes...
+DEBUG_BEFORE = {
+    LDI: lambda cpu, a, b: f'LDI: R{a} <- {b}',
+    HLT: lambda cpu, a, b: 'HLT',
+    CMP: lambda cpu, a, b: f'CMP: R{a}:{cpu.reg[a]}, R{b}:{cpu.reg[b]}',
+    PRA: lambda cpu, a, b: f'PRA: R{a}:{cpu.reg[a]}',
+}
+for op in ALU_OPS:
+    DEBUG_BEFORE[op] = lambda cpu, a, b: f'ALU: R{a}:{cpu.reg[a]}, R{b}:{cpu.reg[b]}'
+for op in ALU_OPS_:
+    DEBUG_BEFORE[op] = lambda cpu, a, b: f'ALU: R{a}:{cpu.reg[a]}'
+for op in list(JUMP_FLAGS) + [JNE]:
+    DEBUG_BEFORE[op] = (lambda name: lambda cpu, a, b:
+                        f'{name}: LGE:{cpu.fl:03b}')(MNEMONICS[op])
+# ...and after
+DEBUG_AFTER = {
+    LD: lambda cpu, a, b: f'LD: R{a} <- R{b}:{cpu.reg[a]}',
+    POP: lambda cpu, a, b: f'POP: R{a} <- {cpu.reg[a]}',
+    CALL: lambda cpu, a, b: f'CALL: {cpu.pc}',
+    RET: lambda cpu, a, b: f'RET: {cpu.pc}',
+    IRET: lambda cpu, a, b: f'IRET: {cpu.pc}',
+}
+
+# why run() returned
+HALT = 'hlt' # HLT instruction
+MAX_CYCLES = 'max_cycles' # ran out of cycles, can be resumed
+DIV_ZERO = 'div_zero' # DIV or MOD by zero
+ERROR = 'error' # bad instruction, register or address, see CPU.error
+STOPPED = 'stopped' # running was cleared from outside
+
+# outcome of CPU.run(): output is None unless the CPU captures it, error_pc
+# is the address of the instruction behind an ERROR (pc is already past it)
+RunResult = namedtuple('RunResult', 'reason cycles output registers pc fl error_pc',
+                       defaults=(None,))
+
+# CPU.snapshot() layout: RAM, R0-R7, then PC, FL, IE and the cycle count
+SNAPSHOT = struct.Struct('<BBBQ')
+SNAPSHOT_SIZE = 256 + 8 + SNAPSHOT.size
+
+# CPU.checkpoint(): a snapshot() plus what it leaves out, the halt reason
+# and the error behind it, symbols, the interrupt event queue and sources,
+# and the console
+Checkpoint = namedtuple('Checkpoint',
+                        'state halted error error_pc symbols interrupts console')
+
+
+def table(handlers):
+    '''Branch table: a list indexed by all 256 opcodes, None where there
+       is no handler.'''
+    ops = [None] * 256
+    for op, handler in handlers.items():
+        ops[op] = handler
+    return ops
+
+
+class Refetch(Exception):
+    """Raised by a fused handler that stopped early because it overwrote
+       its own code; args[0] of its instructions did not run."""
 
 
 class CPU:
     """Main CPU class."""
 
-    def __init__(self):
-        """Construct a new CPU."""
+    def __init__(self, jit=False, capture=False, mode=FAST, console=None,
+                 core=0, ram=None):
+        """Construct a new CPU.
+           With jit=True, run() compiles basic blocks into Python
+           functions instead of dispatching one op_* call per instruction
+           (in FAST mode).
+           PRN/PRA output goes to console (see console.py), by default a
+           buffered StreamConsole on stdout. With capture=True it is kept
+           in a CaptureConsole for the RunResult instead.
+           mode picks the branch table, see set_mode().
+           core is the ID CID reads, and ram a 256-byte buffer to use as
+           RAM, e.g. one shared with other cores (see multicore.py)."""
         self.running = False
+        self.halted = None # reason the CPU stopped for good, until reset()
+        self.error = None # exception behind an ERROR halt
+        self.error_pc = None # address of the instruction that raised it
+        self.symbols = {} # label -> address, from a binary image
+        self.debug = None # debuginfo.DebugInfo, from the program's sidecar
+        if console is None:
+            console = CaptureConsole() if capture else StreamConsole()
+        self.console = console
         self.pc = 0 # Program Counter
         self.fl = 0 # flags: 0b00000LGE
-        self.reg = [0] * 8 # registers
-        self.ram = [0] * 256 # RAM
+        self.reg = array('B', bytes(8)) # registers, 0-255 only
+        self.ram = bytearray(256) if ram is None else ram # RAM
+        self.core = core # core ID
+        self.cores = None # multicore.Cores this CPU is one of
         self.IM = 5 # register for Interrupt Mask
         self.IS = 6 # register for Interrupt Status
         self.SP = 7 # register for Stack Pointer
         self.reg[self.SP] = 0xF4 # Stack Pointer initial position
+        # decode cache: one (handler, operand A, operand B, next PC,
+        # instructions) entry per RAM address, filled on first fetch,
+        # cleared by ram_write(). In FAST mode an entry may stand for
+        # several fused instructions, see fuse(). Allocated by the first
+        # decode(), so a CPU that has not run carries no cache.
+        self.decoded = None
+        # address -> plain entry of the first instruction of a fused one,
+        # allocated with the first fused entry
+        self.singles = None
+        # opcode -> handler of the branch table bound to this CPU, filled
+        # by decode()
+        self.handlers = None
+        # nonzero where RAM holds bytes of a decoded or compiled instruction
+        self.code = bytearray(256)
+        self.profiler = None # see profiler.py
+        self.tracer = None # see tracer.py
+        self.jit = None
+        if jit:
+            from jit import BlockCompiler
+            self.jit = BlockCompiler(self)
+        self.ie = True # interrupts enabled
+        self.cycles = 0 # instructions executed
+        # timer/keyboard sources are attached with self.interrupts.add()
+        self.interrupts = InterruptController(self)
 
-        # brach table
-        self.ops = {
-            LDI: self.op_ldi,
-            LD: self.op_ld,
-            PRN: self.op_prn,
-            HLT: self.op_hlt,
-            PUSH: self.op_push,
-            POP: self.op_pop,
-            JMP: self.op_jmp,
-            JEQ: self.op_jeq,
-            JNE: self.op_jne,
-            CALL: self.op_call,
-            RET: self.op_ret,
-            ST: self.op_st,
-            PRA: self.op_pra,
-            IRET: self.op_iret,
-            ADD: self.op_alu,
-            SUB: self.op_alu,
-            MUL: self.op_alu,
-            MOD: self.op_alu,
-            CMP: self.op_alu,
-            NOT: self.op_alu_,
-            INC: self.op_alu_,
-            DEC: self.op_alu_,
-            ADDI: self.op_addi,
+        self.mode = FAST
+        self.ops = self.branch_table(FAST)
+        if mode != FAST: self.set_mode(mode)
+
+    # branch tables by mode, shared by all CPUs and built on first use. The
+    # handlers are functions and partialmethods of (cpu, operand A, operand
+    # B), which decode() binds to the CPU.
+    mode_ops = {}
+
+    @classmethod
+    def branch_table(cls, mode):
+        '''The branch table of a mode. PROFILE and RECORD use FAST's, their
+           wrappers are added by decode().'''
+        if mode in (PROFILE, RECORD): mode = FAST
+        if mode not in cls.mode_ops:
+            builder = {FAST: cls.fast_handlers, DEBUG: cls.debug_handlers,
+                       TRACE: cls.trace_handlers}[mode]
+            cls.mode_ops[mode] = builder()
+        return cls.mode_ops[mode]
+
+    @classmethod
+    def fast_handlers(cls):
+        '''Branch table of the plain op_* handlers.'''
+        handlers = {
+            LDI: cls.op_ldi,
+            LD: cls.op_ld,
+            PRN: cls.op_prn,
+            HLT: cls.op_hlt,
+            PUSH: cls.op_push,
+            POP: cls.op_pop,
+            JMP: cls.op_jmp,
+            JEQ: cls.op_jeq,
+            JNE: cls.op_jne,
+            JGT: partialmethod(cls.op_jif, JUMP_FLAGS[JGT]),
+            JLT: partialmethod(cls.op_jif, JUMP_FLAGS[JLT]),
+            JLE: partialmethod(cls.op_jif, JUMP_FLAGS[JLE]),
+            JGE: partialmethod(cls.op_jif, JUMP_FLAGS[JGE]),
+            CALL: cls.op_call,
+            RET: cls.op_ret,
+            ST: cls.op_st,
+            PRA: cls.op_pra,
+            IRET: cls.op_iret,
+            CMP: cls.op_cmp,
+            ADDI: cls.op_addi,
+            NOP: cls.op_nop,
+            INT: cls.op_int,
+            CID: cls.op_cid,
+            CAS: cls.op_cas,
+            IPI: cls.op_ipi,
         }
+        for op in ALU_OPS: handlers[op] = partialmethod(cls.op_alu, op)
+        for op in ALU_OPS_: handlers[op] = partialmethod(cls.op_alu_, op)
+        return table(handlers)
 
-    def load(self):
-        """Load a program into memory."""
-        # For now, we've just hardcoded a program:
-        # program = [
-        #     # From print8.ls8
-        #     0b10000010, # LDI R0,8
-        #     0b00000000,
-        #     0b00001000,
-        #     0b01000111, # PRN R0
-        #     0b00000000,
-        #     0b00000001, # HLT
-        # ]
-        # address = 0
-        # for instruction in program:
-        #     self.ram[address] = instruction
-        #     address += 1
-
-        if len(sys.argv) != 2:
-            print('Please specify program file name.')
-            sys.exit(1)
+    @classmethod
+    def debug_handlers(cls):
+        '''Branch table printing what each instruction does.'''
+        def debugged(handler, before, after):
+            def debug_handler(cpu, a, b):
+                cpu.console.flush() # keep output in order with ours
+                if before: print(before(cpu, a, b))
+                handler.__get__(cpu)(a, b)
+                cpu.console.flush()
+                if after: print(after(cpu, a, b))
+            return debug_handler
+        return table({op: debugged(handler, DEBUG_BEFORE.get(op), DEBUG_AFTER.get(op))
+                      for op, handler in enumerate(cls.branch_table(FAST)) if handler})
 
-        try:
-            with open(sys.argv[1]) as f:
-                address = 0
-                for line in f:
-                    instruction = line.split('#')[0].strip()
-                    if instruction: 
-                        self.ram[address] = int(instruction, 2)
-                        address += 1
-        except FileNotFoundError:
-            print('File is not found.')
-            sys.exit(2)
+    @classmethod
+    def trace_handlers(cls):
+        '''Branch table printing the CPU state after each instruction.'''
+        def traced(handler):
+            def trace_handler(cpu, a, b):
+                handler.__get__(cpu)(a, b)
+                cpu.console.flush()
+                cpu.trace()
+            return trace_handler
+        return table({op: traced(handler)
+                      for op, handler in enumerate(cls.branch_table(FAST)) if handler})
+
+    def set_mode(self, mode):
+        """Switch the branch table to FAST, DEBUG, TRACE, PROFILE or RECORD.
+           PROFILE attaches a profiler.Profiler if there is none, RECORD
+           a tracer.Tracer."""
+        if mode not in MODES: raise ValueError(f'Unknown mode {mode}')
+        if mode != PROFILE and self.profiler is not None:
+            self.profiler.stop()
+        if mode != RECORD and self.tracer is not None:
+            self.tracer.stop()
+        self.mode = mode
+        self.ops = self.branch_table(mode)
+        self.handlers = None
+        if mode == PROFILE and self.profiler is None:
+            from profiler import Profiler
+            Profiler(self) # attaches itself
+        if mode == RECORD and self.tracer is None:
+            from tracer import Tracer
+            Tracer(self) # attaches itself
+        self.flush_code() # redecode with the new handlers
+
+    def load(self, filename):
+        """Load a program file into memory: an .ls8 text file or an .ls8b
+           binary image (see image.py), and the debug info sidecar next to
+           it if there is one (see debuginfo.py)."""
+        with open(filename, 'rb') as f:
+            self.load_file(f)
+        self.debug = debuginfo.load_sidecar(filename)
+        if self.debug is not None and not self.symbols:
+            self.symbols = dict(self.debug.symbols)
+
+    def load_file(self, f):
+        """Load a program from a binary file object, e.g. an io.BytesIO:
+           .ls8 text or an .ls8b image."""
+        head = f.read(image.HEADER.size)
+        if head[:4] == image.MAGIC:
+            return self.load_image(f, head)
+        text = (head + f.read()).decode()
+        program = []
+        for line in text.splitlines():
+            instruction = line.split('#')[0].strip()
+            if instruction: 
+                program.append(int(instruction, 2))
+        self.load_bytes(program)
+
+    def where(self, addr):
+        """addr as 'LABEL+n (source:line)' if there is debug info, else
+           in hex."""
+        if self.debug is not None: return self.debug.where(addr)
+        return f'{addr:#04x}'
+
+    def load_image(self, f, head):
+        """Read the code of a binary image straight into RAM."""
+        entry, length, count = image.parse_header(head)
+        if length > len(self.ram):
+            raise ValueError(f'Program too large: {length} bytes')
+        if f.readinto(memoryview(self.ram)[:length]) != length:
+            raise ValueError('Truncated LS-8 image')
+        self.symbols = image.read_symbols(f, count)
+        self.pc = entry
+        self.flush_code()
+
+    def load_bytes(self, buf, address=0):
+        """Load a program image (bytes or a list of ints) into RAM."""
+        if address + len(buf) > len(self.ram):
+            raise ValueError(f'Program too large: {len(buf)} bytes at {address}')
+        self.ram[address:address+len(buf)] = bytes(buf)
+        self.flush_code()
+
+    def flush_code(self):
+        '''Drop everything decoded or compiled from RAM.'''
+        if self.decoded is not None: # in place, interpret() holds on to it
+            self.decoded[:] = [None] * 256
+        self.code[:] = bytes(256)
+        if self.jit is not None: self.jit.reset()
+
+    def reset(self):
+        """Back to the power on state: RAM, registers, PC and FL cleared,
+           SP at 0xF4, interrupt sources restarted."""
+        self.running = False
+        self.halted = None
+        self.error = None
+        self.error_pc = None
+        self.symbols = {}
+        self.debug = None
+        self.pc = 0
+        self.fl = 0
+        self.reg[:] = array('B', bytes(8))
+        self.reg[self.SP] = 0xF4
+        self.ram[:] = bytes(256)
+        self.ie = True
+        self.cycles = 0
+        self.flush_code()
+        self.interrupts.reset()
+        self.console.reset()
+
+    def snapshot(self, into=None):
+        """Copy the machine state (RAM, registers, PC, FL, IE, cycles) into
+           a bytearray of SNAPSHOT_SIZE bytes, or into the given buffer."""
+        buf = bytearray(SNAPSHOT_SIZE) if into is None else into
+        view = memoryview(buf)
+        view[:256] = self.ram
+        view[256:264] = self.reg
+        SNAPSHOT.pack_into(buf, 264, self.pc, self.fl, self.ie, self.cycles)
+        return buf
+
+    def restore(self, snap):
+        """Put back the machine state saved by snapshot()."""
+        view = memoryview(snap)
+        if view[:256] != self.ram: # keep decoded code if RAM is the same
+            self.ram[:] = view[:256]
+            self.flush_code()
+        memoryview(self.reg)[:] = view[256:264]
+        self.pc, self.fl, ie, self.cycles = SNAPSHOT.unpack_from(snap, 264)
+        self.ie = bool(ie)
+        self.halted = None
+        self.error = None
+        self.error_pc = None
+
+    def checkpoint(self):
+        """Everything needed to carry on from here, in this CPU with
+           resume() or in new ones with fork(). Immutable, so any number of
+           forks can start from one checkpoint."""
+        return Checkpoint(bytes(self.snapshot()), self.halted, self.error, self.error_pc,
+                          dict(self.symbols), self.interrupts.save(), self.console.save())
+
+    def resume(self, checkpoint):
+        """Put back the state saved by checkpoint(): the machine state, why
+           it halted, pending interrupt events, interrupt sources and
+           console."""
+        self.restore(checkpoint.state)
+        self.halted = checkpoint.halted
+        self.error, self.error_pc = checkpoint.error, checkpoint.error_pc
+        self.symbols = dict(checkpoint.symbols)
+        self.interrupts.load(checkpoint.interrupts)
+        self.console.load(checkpoint.console)
+
+    def fork(self, checkpoint=None):
+        """A new CPU carrying on from checkpoint (by default from now), with
+           copies of this one's interrupt sources and console. While RAM is
+           the same, it shares the blocks the JIT compiled, instead of
+           compiling them again."""
+        if checkpoint is None: checkpoint = self.checkpoint()
+        cpu = CPU(mode=self.mode, console=self.console.fork())
+        for source in self.interrupts.sources:
+            cpu.interrupts.sources.append(source.fork())
+        cpu.resume(checkpoint)
+        cpu.debug = self.debug
+        if self.jit is not None:
+            cpu.jit = self.jit.fork(cpu)
+        return cpu
+
+    def halt(self, reason):
+        '''Stop the CPU for good.'''
+        self.running = False
+        self.halted = reason
 
 
     def trace(self):
@@ -144,149 +437,213 @@ class CPU:
         return self.ram[addr]
     def ram_write(self, addr, value):
         self.ram[addr] = value
+        if self.code[addr]: self.invalidate(addr)
+
+    def invalidate(self, addr):
+        '''Forget cached code covering addr after it was written to.'''
+        # a decoded entry covers at most FUSE_SPAN bytes, so the write may
+        # have hit the entry decoded at any of the FUSE_SPAN addresses up
+        # to addr (negative indices wrap around to the top of RAM, like
+        # the PC)
+        decoded = self.decoded
+        if decoded is not None:
+            for i in range(FUSE_SPAN):
+                decoded[addr-i] = None
+        self.code[addr] = 0
+        if self.jit is not None: self.jit.invalidate(addr)
+
+    def decode(self, addr):
+        '''Decode the instruction at addr and cache it.'''
+        op = self.ram[addr]
+        if self.handlers is None: self.handlers = {}
+        handler = self.handlers.get(op)
+        if handler is None:
+            handler = self.ops[op]
+            if handler is None:
+                raise Exception(f'Unsupported operation {bin(op)} at {self.where(addr)}')
+            handler = self.handlers[op] = handler.__get__(self)
+        if self.profiler is not None:
+            handler = self.profiler.wrap(addr, op, handler)
+        if self.tracer is not None:
+            handler = self.tracer.wrap(addr, op, handler)
+        entry = (handler,
+                 self.ram[(addr+1) & 0xFF],
+                 self.ram[(addr+2) & 0xFF],
+                 (addr + LENGTH[op]) & 0xFF,
+                 1)
+        if self.mode == FAST:
+            fused = self.fuse(addr)
+            if fused is not None:
+                if self.singles is None: self.singles = [None] * 256
+                self.singles[addr] = entry
+                entry = fused
+        if self.decoded is None: self.decoded = [None] * 256
+        self.decoded[addr] = entry
+        for i in range((entry[3] - addr) & 0xFF or 256):
+            self.code[(addr+i) & 0xFF] = 1
+        return entry
+
+    def single(self, addr):
+        '''Decoded entry of just the instruction at addr, never a fused one.'''
+        entry = self.decoded[addr] if self.decoded is not None else None
+        if entry is None:
+            entry = self.decode(addr)
+        if entry[4] > 1:
+            entry = self.singles[addr]
+        return entry
+
+    def fuse(self, addr):
+        '''Superinstruction for the code at addr, or None. Fused are:
+            * LDI Ra,v followed by JMP/JEQ/JNE/JGT/JLT/JLE/JGE/CALL Rc
+            * CMP Ra,Rb followed by JEQ/JNE/JGT/JLT/JLE/JGE Rc
+            * runs of 2 to FUSE_MAX PUSHes or POPs
+           Nothing that writes IM or IS is fused, so no interrupt can become
+           pending inside a fused entry; interpret() only uses one when no
+           event is due before it ends.'''
+        ram = self.ram
+        op, a, b = ram[addr], ram[(addr+1) & 0xFF], ram[(addr+2) & 0xFF]
+        if op == LDI and a < self.IM:
+            op2, c = ram[(addr+3) & 0xFF], ram[(addr+4) & 0xFF]
+            if op2 not in FUSE_JUMPS or c > 7: return None
+            if op2 == JMP: handler = partial(self.op_ldi_jmp, c)
+            elif op2 == JNE: handler = partial(self.op_ldi_jne, c)
+            elif op2 == CALL: handler = partial(self.op_ldi_call, c)
+            else: handler = partial(self.op_ldi_jif, JUMP_FLAGS[op2], c)
+            return (handler, a, b, (addr+5) & 0xFF, 2)
+        if op == CMP and a < 8 and b < 8:
+            op2, c = ram[(addr+3) & 0xFF], ram[(addr+4) & 0xFF]
+            if c > 7: return None
+            if op2 == JNE: handler = partial(self.op_cmp_jne, c)
+            elif op2 in JUMP_FLAGS:
+                handler = partial(self.op_cmp_jif, JUMP_FLAGS[op2], c)
+            else: return None
+            return (handler, a, b, (addr+5) & 0xFF, 2)
+        if op in (PUSH, POP):
+            regs = []
+            while (len(regs) < FUSE_MAX and ram[(addr + 2*len(regs)) & 0xFF] == op):
+                r = ram[(addr + 2*len(regs) + 1) & 0xFF]
+                if r > 7 or (op == POP and r in (self.IM, self.IS)): break
+                regs.append(r)
+            if len(regs) < 2: return None
+            n = len(regs)
+            if op == PUSH:
+                return (partial(self.op_push_run, addr), tuple(regs), 0,
+                        (addr + 2*n) & 0xFF, n)
+            return (self.op_pop_run, tuple(regs), 0, (addr + 2*n) & 0xFF, n)
+        return None
 
 
     def alu(self, op, reg_a, reg_b):
         """ALU operations."""
-        if debug: print(f'ALU: R{reg_a}:{self.reg[reg_a]}, R{reg_b}:{self.reg[reg_b]}')
-        # if op == ADD:
-        #     self.reg[reg_a] += self.reg[reg_b]
-        # elif op == SUB:
-        #     self.reg[reg_a] -= self.reg[reg_b]
-        # else:
-        #     raise Exception("Unsupported ALU operation")
-        
-        def alu_add(): self.reg[reg_a] += self.reg[reg_b]
-        def alu_sub(): self.reg[reg_a] -= self.reg[reg_b]
-        def alu_mul(): 
-            self.reg[reg_a] *= self.reg[reg_b]
-        def alu_cmp(): 
-            if self.reg[reg_a] < self.reg[reg_b]:
-                self.fl = 0b00000100
-            elif self.reg[reg_a] > self.reg[reg_b]:
-                self.fl = 0b00000010
-            else: # equal
-                self.fl = 0b00000001
-        alus = {
-            ADD: alu_add,
-            SUB: alu_sub,
-            MUL: alu_mul,
-            CMP: alu_cmp,
-        }
-        if op not in alus:
+        try:
+            self.reg[reg_a] = ALU_OPS[op](self.reg[reg_a], self.reg[reg_b])
+        except KeyError:
             raise Exception(f'Unsupported ALU operation {bin(op)}')
-        alus[op]()
+        except ZeroDivisionError:
+            print(f'Error: division by zero (R{reg_b} is 0)', file=sys.stderr)
+            self.halt(DIV_ZERO)
 
-        
     def alu_(self, op, reg_num):
         '''ALU operations'''
-        if debug: print(f'ALU: R{reg_num}:{self.reg[reg_num]}')
-
-        def alu_not(): self.reg[reg_num] = ~self.reg[reg_num]
-        def alu_inc(): self.reg[reg_num] += 1
-        def alu_dec(): self.reg[reg_num] -= 1
-        alus = {
-            NOT: alu_not,
-            INC: alu_inc,
-            DEC: alu_dec,
-        }
-        if op not in alus:
+        try:
+            self.reg[reg_num] = ALU_OPS_[op](self.reg[reg_num])
+        except KeyError:
             raise Exception(f'Unsupported ALU operation {bin(op)}')
-        alus[op]()
 
 
-    def op_ldi(self, op): # e.g. LDI R0, 8
+    # Handlers take the pre-decoded operands A and B. The PC has already
+    # been advanced past the instruction, so only the ones that set the
+    # PC themselves (JMP, CALL, RET, ...) touch it.
+    def op_ldi(self, reg_num, value): # e.g. LDI R0, 8
         '''Load immidiate value'''
-        reg_num = self.ram_read(self.pc+1)
-        value = self.ram_read(self.pc+2)
-        if debug: print(f'LDI: R{reg_num} <- {value}')
         self.reg[reg_num] = value
-        self.pc += 3
-    def op_ld(self, op):
+    def op_ld(self, reg_a, reg_b):
         '''Loads register A with the value at the 
            memory address stored in register B.'''
-        reg_a = self.ram_read(self.pc+1)
-        reg_b = self.ram_read(self.pc+2) # RAM address
         self.reg[reg_a] = self.ram_read(self.reg[reg_b])
-        if debug: print(f'LD: R{reg_a} <- R{reg_b}:{self.ram_read(self.reg[reg_b])}')
-        self.pc += 3
-    def op_prn(self, op): # e.g. PRN R0
-        reg_num = self.ram_read(self.pc+1)
-        print(self.reg[reg_num])
-        self.pc += 2
-    def op_hlt(self, op): # Halt the CPU (and exit the emulator).
-        if debug: print(f'HLT')
-        self.running = False
-        sys.exit()
-    def op_alu(self, op):  # e.g. add, sub, div, mul
-        reg_a = self.ram_read(self.pc+1)
-        reg_b = self.ram_read(self.pc+2)
+    def op_prn(self, reg_num, _): # e.g. PRN R0
+        self.console.prn(self.reg[reg_num])
+    def op_hlt(self, *_): # Halt the CPU
+        self.halt(HALT)
+    def op_alu(self, op, reg_a, reg_b):  # e.g. add, sub, div, mul
         self.alu(op, reg_a, reg_b)
-        self.pc += 3
-    def op_alu_(self, op):
-        reg_num = self.ram_read(self.pc+1)
+    def op_alu_(self, op, reg_num, _):
         self.alu_(op, reg_num)
-        self.pc += 2
-    def op_push(self, op): # Push from register to stack
-        self.reg[self.SP] -= 1
-        reg_num = self.ram_read(self.pc+1)
-        self.ram[self.reg[self.SP]] = self.reg[reg_num]
-        self.pc += 2
-    def op_pop(self, op): # Pop stack to register
-        reg_num = self.ram_read(self.pc+1)
+    def op_cmp(self, reg_a, reg_b): # Compare, sets FL to 00000LGE
+        a, b = self.reg[reg_a], self.reg[reg_b]
+        if a < b:
+            self.fl = 0b00000100
+        elif a > b:
+            self.fl = 0b00000010
+        else: # equal
+            self.fl = 0b00000001
+    def op_push(self, reg_num, _): # Push from register to stack
+        self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+        self.ram_write(self.reg[self.SP], self.reg[reg_num])
+    def op_pop(self, reg_num, _): # Pop stack to register
         self.reg[reg_num] = self.ram[self.reg[self.SP]]
-        self.reg[self.SP] += 1
-        self.pc += 2
-        if debug: print(f'POP: R{reg_num} <- {self.reg[reg_num]}')
-    def op_jmp(self, op): # Jump
-        reg_num = self.ram_read(self.pc+1)
+        self.reg[self.SP] = (self.reg[self.SP] + 1) & 0xFF
+    def op_jmp(self, reg_num, _): # Jump
         self.pc = self.reg[reg_num]
-    def op_jeq(self, op): # Jump if equal
+    def op_jeq(self, reg_num, _): # Jump if equal
         '''If Equal flag is set (true), jump to the 
            address stored in the given register.'''
         if (self.fl & 1):
-            reg_num = self.ram_read(self.pc+1)
             self.pc = self.reg[reg_num]
-        else:
-            self.pc += 2
-        if debug: print(f'JEQ: LGE:{self.fl:03b}')
-    def op_jne(self, op): # Jump if not equal
+    def op_jne(self, reg_num, _): # Jump if not equal
         '''If Equal flag is clear (false, 0), jump to the 
            address stored in the given register.'''
-        if debug: print(f'JNE: LGE:{self.fl:03b}')
         if not (self.fl & 1):
-            reg_num = self.ram_read(self.pc+1)
             self.pc = self.reg[reg_num]
-        else:
-            self.pc += 2
-    def op_call(self, op): # Call subroutine
+    def op_jif(self, flags, reg_num, _): # JGT, JLT, JLE, JGE
+        '''If any of the given LGE flags is set, jump to the
+           address stored in the given register.'''
+        if self.fl & flags:
+            self.pc = self.reg[reg_num]
+    def op_call(self, reg_num, _): # Call subroutine
         '''Calls a subroutine (function) at the 
            address stored in the register.'''
-        # Push return address to stack
-        self.reg[self.SP] -= 1
-        self.ram[self.reg[self.SP]] = self.pc + 2 
-        reg_num = self.ram_read(self.pc+1)
+        # Push return address (already in PC) to stack
+        self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+        self.ram_write(self.reg[self.SP], self.pc)
         # Jump to subroutine address
         self.pc = self.reg[reg_num] 
-        if debug: print(f'CALL: {self.pc}')
-    def op_ret(self, op): # Return
+    def op_ret(self, *_): # Return
         '''Pop return address and jump there'''
         self.pc = self.ram[self.reg[self.SP]]
-        self.reg[self.SP] += 1
-        if debug: print(f'RET: {self.pc}')
-    def op_st(self, op): # store value to RAM
-        reg_a = self.ram_read(self.pc+1)  # RAM address
-        reg_b = self.ram_read(self.pc+2)  # value
-        self.ram[self.reg[reg_a]] = self.reg[reg_b]
-        self.pc += 3
-    def op_pra(self, op): # pseudo-instruction
+        self.reg[self.SP] = (self.reg[self.SP] + 1) & 0xFF
+    def op_st(self, reg_a, reg_b): # store value to RAM
+        # reg_a holds the RAM address, reg_b the value
+        self.ram_write(self.reg[reg_a], self.reg[reg_b])
+    def op_cid(self, reg_num, _): # load the core ID
+        self.reg[reg_num] = self.core
+    def op_cas(self, reg_a, reg_b):
+        '''Compare and exchange, atomic across cores: if the value at the
+           address in register A equals R0, store register B there, else
+           load it into R0. FL is set as CMP R0 with the old value would.'''
+        with self.cores.lock if self.cores is not None else nullcontext():
+            addr, expected = self.reg[reg_a], self.reg[0]
+            old = self.ram[addr]
+            if old == expected:
+                self.ram_write(addr, self.reg[reg_b])
+            else:
+                self.reg[0] = old
+        self.fl = 0b100 if expected < old else 0b010 if expected > old else 0b001
+    def op_ipi(self, reg_a, reg_b):
+        '''Raise the interrupt number in register A on the core whose ID
+           is in register B.'''
+        core = self.reg[reg_b]
+        if core == self.core:
+            self.interrupt(self.reg[reg_a])
+        elif self.cores is None:
+            raise Exception(f'No core {core}')
+        else:
+            self.cores.ipi(core, self.reg[reg_a])
+    def op_pra(self, reg_num, _): # pseudo-instruction
         '''Print to the console the ASCII character 
            corresponding to the value in the register.'''
-        reg_num = self.ram_read(self.pc+1)
-        if debug: print(f'PRA: R{reg_num}:{self.reg[reg_num]}')
-        print(chr(self.reg[reg_num]), end='')
-        self.pc += 2
-    def op_iret(self, op):
+        self.console.pra(self.reg[reg_num])
+    def op_iret(self, *_):
         '''Return from an interrupt handler.
            The following steps are executed:
             1. Registers R6-R0 are popped off the stack in that order.
@@ -295,75 +652,264 @@ class CPU:
             4. Interrupts are re-enabled.'''
         for i in range(6):
             self.reg[5-i] = self.ram[self.reg[self.SP]] # pop register
-            self.reg[self.SP] += 1
+            self.reg[self.SP] = (self.reg[self.SP] + 1) & 0xFF
         self.fl = self.ram[self.reg[self.SP]] # pop FL
-        self.reg[self.SP] += 1
+        self.reg[self.SP] = (self.reg[self.SP] + 1) & 0xFF
         self.pc = self.ram[self.reg[self.SP]] # pop return address
-        self.reg[self.SP] += 1
-        if debug: print(f'IRET: {self.pc}')
-    def op_addi(self, op):
+        self.reg[self.SP] = (self.reg[self.SP] + 1) & 0xFF
+        self.ie = True # re-enable interrupts
+    def op_addi(self, reg_num, value):
         '''Add an immediate value to a register'''
-        reg_num = self.ram_read(self.pc+1)
-        self.reg[reg_num] += self.ram_read(self.pc+2)
-        self.pc += 1
+        self.reg[reg_num] = (self.reg[reg_num] + value) & 0xFF
+    def op_nop(self, *_): # No operation
+        pass
+    def op_int(self, reg_num, _): # Issue the interrupt number in the register
+        self.interrupt(self.reg[reg_num])
 
 
+
+    # Fused handlers, see fuse(). Like the handlers above, they run with
+    # the PC already past the last instruction of the entry.
+    def op_ldi_jmp(self, reg_c, reg_num, value): # LDI Ra,v; JMP Rc
+        self.reg[reg_num] = value
+        self.pc = self.reg[reg_c]
+    def op_ldi_jne(self, reg_c, reg_num, value): # LDI Ra,v; JNE Rc
+        self.reg[reg_num] = value
+        if not (self.fl & 1):
+            self.pc = self.reg[reg_c]
+    def op_ldi_jif(self, flags, reg_c, reg_num, value): # LDI Ra,v; JEQ/... Rc
+        self.reg[reg_num] = value
+        if self.fl & flags:
+            self.pc = self.reg[reg_c]
+    def op_ldi_call(self, reg_c, reg_num, value): # LDI Ra,v; CALL Rc
+        self.reg[reg_num] = value
+        self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+        self.ram_write(self.reg[self.SP], self.pc)
+        self.pc = self.reg[reg_c]
+    def op_cmp_jne(self, reg_c, reg_a, reg_b): # CMP Ra,Rb; JNE Rc
+        self.op_cmp(reg_a, reg_b)
+        if not (self.fl & 1):
+            self.pc = self.reg[reg_c]
+    def op_cmp_jif(self, flags, reg_c, reg_a, reg_b): # CMP Ra,Rb; JEQ/... Rc
+        self.op_cmp(reg_a, reg_b)
+        if self.fl & flags:
+            self.pc = self.reg[reg_c]
+    def op_push_run(self, addr, regs, _): # PUSH Ra; PUSH Rb; ...
+        reg, ram, code, SP = self.reg, self.ram, self.code, self.SP
+        for i, r in enumerate(regs):
+            sp = reg[SP] = (reg[SP] - 1) & 0xFF
+            ram[sp] = reg[r]
+            if code[sp]:
+                self.invalidate(sp)
+                # the stack ran into the rest of this run: fetch it again
+                left = len(regs) - i - 1
+                if left and (sp - addr) & 0xFF < 2 * len(regs):
+                    self.pc = (addr + 2 * (i+1)) & 0xFF
+                    raise Refetch(left)
+    def op_pop_run(self, regs, _): # POP Ra; POP Rb; ...
+        reg, ram, SP = self.reg, self.ram, self.SP
+        for r in regs:
+            reg[r] = ram[reg[SP]]
+            reg[SP] = (reg[SP] + 1) & 0xFF
     def interrupt(self, mode=TIMER_INTERRUPT):
-        '''Timer interrupt triggers once per second.'''
-        if mode == TIMER_INTERRUPT: self.reg[self.IS] = 0b00000001 # timer interrupt
-        elif mode == KEYBOARD_INTERRUPT: self.reg[self.IS] = 0b00000010 # keyboard interrupt
-        else: raise Exception(f'Wrong interrupt mode {mode}')
+        '''Raise an interrupt: set its bit in the IS register.
+           It is delivered by dispatch() before a later instruction fetch.'''
+        if not 0 <= mode < 8: raise Exception(f'Wrong interrupt mode {mode}')
+        self.reg[self.IS] |= 1 << mode
 
+    def dispatch(self):
+        '''Deliver the lowest pending unmasked interrupt, if enabled.'''
+        if not self.ie: return
         masked_interrupts = self.reg[self.IM] & self.reg[self.IS]
         for i in range(8):
             # Right shift interrupts down by i, then mask with 1 to see if that bit was set
             interrupt_happened = ((masked_interrupts >> i) & 1) == 1
         
             if interrupt_happened:
-                # clear timer interrupt status
-                if mode == TIMER_INTERRUPT: self.reg[self.IS] = self.reg[self.IS] & 0b11111110
-                else: self.reg[self.IS] = self.reg[self.IS] & 0b11111101
+                # disable further interrupts until IRET
+                self.ie = False
+                # clear the interrupt status bit
+                self.reg[self.IS] &= ~(1 << i) & 0xFF
                 # push PC register
-                self.reg[self.SP] -= 1
-                self.ram[self.reg[self.SP]] = self.pc
+                self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+                self.ram_write(self.reg[self.SP], self.pc)
                 # push FL register
-                self.reg[self.SP] -= 1
-                self.ram[self.reg[self.SP]] = self.fl
+                self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+                self.ram_write(self.reg[self.SP], self.fl)
                 # registers R0-R6 are pushed on the stack in that order
-                for i in range(6):
-                    self.reg[self.SP] -= 1
-                    self.ram[self.reg[self.SP]] = self.reg[i]
+                for r in range(6):
+                    self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+                    self.ram_write(self.reg[self.SP], self.reg[r])
                 # look up the interrupt handler address in the interrupt 
                 # vector table at address 0xF8, and set the PC to it
-                if mode == TIMER_INTERRUPT: addr = 0xf8
-                else: addr = 0xf9
-                self.pc = self.ram_read(addr)
-                
-
-    def run(self):
-        """Run the CPU."""
-        self.running = True
-        if trace: self.trace()
-
-        # set timer for interrupt
-        time_past = datetime.now()
-
-        while self.running:
-            '''timer interrupt'''
-            # if 1 sec is elapsed
-            if (datetime.now() - time_past).seconds >= 1:
-                self.interrupt(mode=TIMER_INTERRUPT)
-                time_past = datetime.now() # reset timer
-
-            '''keyboard interrupt'''
-            if msvcrt.kbhit():
-                # store value of the key pressed at '0xf4'
-                self.ram_write(0xf4, ord(msvcrt.getch())) 
-                self.interrupt(mode=KEYBOARD_INTERRUPT)
-
-            op = self.ram_read(self.pc)
-            if op not in self.ops:
-                print(self.pc)
-                raise Exception(f'Unsupported operation {bin(op)}')
-            self.ops[op](op)
-            if trace: self.trace()       
\ No newline at end of file
+                self.pc = self.ram_read(0xf8 + i)
+                if self.mode == DEBUG: print(f'INTERRUPT {i}: {self.pc}')
+                if self.profiler is not None: self.profiler.interrupt(i, self.pc)
+                break
+
+    def spin_length(self):
+        '''If the CPU spins in a loop starting at PC that changes nothing
+           (no stores, output, register or flag changes), the number of
+           instructions in one turn of it, else 0.'''
+        ram, reg, fl = self.ram, self.reg, self.fl
+        pc = self.pc
+        for n in range(1, SPIN_MAX + 1):
+            op, a, b = ram[pc], ram[(pc+1) & 0xFF], ram[(pc+2) & 0xFF]
+            if REGISTERS[op] and a > 7: return 0
+            if REGISTERS[op] == 2 and b > 7: return 0
+            next_pc = (pc + LENGTH[op]) & 0xFF
+            if op == JMP:
+                next_pc = reg[a]
+            elif op == JNE:
+                if not fl & 1: next_pc = reg[a]
+            elif op in JUMP_FLAGS:
+                if fl & JUMP_FLAGS[op]: next_pc = reg[a]
+            elif op == LDI:
+                if reg[a] != b: return 0
+            elif op == LD:
+                if reg[a] != ram[reg[b]]: return 0
+            elif op == CMP:
+                x, y = reg[a], reg[b]
+                if fl != (0b100 if x < y else 0b010 if x > y else 0b001): return 0
+            elif op in ALU_OPS:
+                try:
+                    if ALU_OPS[op](reg[a], reg[b]) != reg[a]: return 0
+                except ZeroDivisionError:
+                    return 0
+            elif op in ALU_OPS_:
+                if ALU_OPS_[op](reg[a]) != reg[a]: return 0
+            elif op == NOP:
+                pass
+            else:
+                return 0
+            pc = next_pc
+            if pc == self.pc: return n
+        return 0
+
+    def skip_idle(self, limit):
+        '''Called at an event boundary. If the CPU is spinning in an idle
+           loop, sleep until an interrupt source may have something, then
+           move the cycle count up to the next event (or the limit) by whole
+           turns of the loop, as if it had run that long. Returns True if
+           the cycle count moved.'''
+        if self.reg[self.IS] & self.reg[self.IM] and self.ie: return False
+        length = self.spin_length()
+        if not length: return False
+        target = min(self.interrupts.next_event, limit)
+        if target == NEVER:
+            # no source and no limit: nothing will ever happen
+            while self.running: time.sleep(IDLE_SLEEP)
+            return False
+        if self.interrupts.next_event <= limit:
+            self.console.flush()
+            self.interrupts.wait()
+        turns = (target - self.cycles) // length
+        self.cycles += turns * length
+        return turns > 0
+
+    def execute(self):
+        '''Execute the single instruction at PC.'''
+        pc = self.pc
+        try:
+            handler, a, b, self.pc, _ = self.single(pc)
+            self.cycles += 1
+            handler(a, b)
+        except Exception:
+            self.error_pc = pc
+            raise
+
+    def step(self, n=1):
+        """Execute n instructions (fewer if the CPU halts) with the
+           interpreter, taking interrupts as run() does."""
+        return self.run(max_cycles=n, jit=False)
+
+    def run(self, max_cycles=None, jit=True):
+        """Run the CPU until it halts or has executed max_cycles
+           instructions. Returns a RunResult."""
+        start = self.cycles
+        capture = isinstance(self.console, CaptureConsole)
+        mark = self.console.tell() if capture else 0
+        limit = NEVER if max_cycles is None else start + max_cycles
+        if not self.halted:
+            self.running = True
+            try:
+                if jit and self.jit is not None and self.mode == FAST:
+                    self.jit.run(limit)
+                else:
+                    self.interpret(limit)
+            except Exception as e: # bad opcode, register or address
+                self.error = e
+                self.halt(ERROR)
+            self.running = False
+            self.console.flush()
+
+        if self.halted:
+            reason = self.halted
+        elif self.cycles >= limit:
+            reason = MAX_CYCLES
+        else:
+            reason = STOPPED
+        output = None
+        if capture:
+            output = self.console.text(mark)
+        return RunResult(reason, self.cycles - start, output,
+                         tuple(self.reg), self.pc, self.fl, self.error_pc)
+
+    def interpret(self, limit=NEVER):
+        """Fetch, decode and execute instructions until the CPU stops
+           running or reaches cycle limit."""
+        if self.mode == TRACE: self.trace()
+        if self.tracer is not None:
+            self.tracer.sync(self.cycles)
+            self.tracer.record()
+
+        if self.decoded is None: self.decoded = [None] * 256
+        decoded = self.decoded
+        reg = self.reg
+        IM, IS = self.IM, self.IS
+        cycles = self.cycles
+        pc = self.pc # of the instruction being executed
+        next_event = 0
+        horizon = 0 # fused entries may only start below this cycle
+
+        try:
+            while self.running:
+                # interrupts and the cycle limit are only looked at when
+                # an event is due or an interrupt is pending
+                if cycles >= horizon or (reg[IS] & reg[IM] and self.ie):
+                    if cycles >= next_event or (reg[IS] & reg[IM] and self.ie):
+                        if cycles >= limit: break
+                        due = cycles >= next_event
+                        self.cycles = cycles
+                        next_event = min(self.interrupts.service(), limit)
+                        if due:
+                            # look for idle loops even without interrupt sources
+                            next_event = min(next_event, cycles + POLL_CYCLES)
+                            if self.skip_idle(limit):
+                                cycles = self.cycles
+                                if self.tracer is not None: self.tracer.sync(cycles)
+                                next_event = horizon = 0
+                                continue
+                        horizon = next_event - FUSE_MAX + 1
+                    if cycles >= horizon:
+                        # a fused entry could run past the next event
+                        pc = self.pc
+                        handler, a, b, self.pc, _ = self.single(pc)
+                        cycles += 1
+                        handler(a, b)
+                        continue
+                pc = self.pc
+                entry = decoded[pc]
+                if entry is None:
+                    entry = self.decode(pc)
+                handler, a, b, self.pc, n = entry
+                cycles += n
+                try:
+                    handler(a, b)
+                except Refetch as e:
+                    cycles -= e.args[0]
+        except Exception:
+            self.error_pc = pc
+            raise
+        finally:
+            self.cycles = cycles
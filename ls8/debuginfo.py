@@ -0,0 +1,113 @@
+"""Debug info sidecar files (.ls8d), written by asm.py -g.
+
+Layout, little-endian:
+
+    header   magic b'LS8D', version, code length, symbol count, line count
+             and source name length (2 bytes each)
+    source   name of the assembly source (UTF-8)
+    symbols  per symbol: address, name length, name (ASCII)
+    lines    per instruction or data statement: address, source line
+             (4 bytes)
+
+CPU.load() reads the sidecar next to a program, if there is one, into a
+DebugInfo: 256-entry lists indexed by address, so symbolizing a PC in a
+profile, trace or crash report is one list lookup.
+"""
+import os
+import struct
+
+MAGIC = b'LS8D'
+VERSION = 1
+HEADER = struct.Struct('<4sBHHHH')
+LINE = struct.Struct('<BI')
+EXTENSION = '.ls8d'
+
+
+def sidecar(filename):
+    """The debug info file for a program file: prog.ls8 -> prog.ls8d."""
+    return os.path.splitext(filename)[0] + EXTENSION
+
+
+def write_debuginfo(f, length, symbols, lines, source=''):
+    """Write the code length, {label: address} and [(address, source line)]
+       of the statements to f."""
+    source = source.encode()
+    f.write(HEADER.pack(MAGIC, VERSION, length, len(symbols), len(lines), len(source)))
+    f.write(source)
+    for name, addr in symbols.items():
+        name = name.encode('ascii')
+        f.write(bytes((addr & 0xFF, len(name))) + name)
+    for addr, line in lines:
+        f.write(LINE.pack(addr & 0xFF, line))
+
+
+def read_debuginfo(f):
+    """Read a whole sidecar; returns a DebugInfo."""
+    head = f.read(HEADER.size)
+    if len(head) < HEADER.size:
+        raise ValueError('Truncated LS-8 debug info header')
+    magic, version, length, nsymbols, nlines, size = HEADER.unpack(head)
+    if magic != MAGIC:
+        raise ValueError('Not LS-8 debug info')
+    if version != VERSION:
+        raise ValueError(f'Unsupported LS-8 debug info version {version}')
+    source = f.read(size).decode()
+    symbols = {}
+    for _ in range(nsymbols):
+        addr, size = f.read(2)
+        symbols[f.read(size).decode('ascii')] = addr
+    data = f.read(nlines * LINE.size)
+    if len(data) != nlines * LINE.size:
+        raise ValueError('Truncated LS-8 debug info')
+    return DebugInfo(length, symbols, list(LINE.iter_unpack(data)), source)
+
+
+def load_sidecar(filename):
+    """DebugInfo of the sidecar of a program file, or None if it has none."""
+    try:
+        with open(sidecar(filename), 'rb') as f:
+            return read_debuginfo(f)
+    except FileNotFoundError:
+        return None
+
+
+class DebugInfo:
+    """Labels and source lines, looked up by address."""
+
+    def __init__(self, length, symbols, lines, source=''):
+        self.length = length # of the code
+        self.symbols = dict(symbols) # label -> address
+        self.source = source
+        self.labels = [None] * 256 # address -> first label defined there
+        for name, addr in symbols.items():
+            if self.labels[addr] is None: self.labels[addr] = name
+
+        # address -> source line of the statement the byte belongs to
+        self.lines = [None] * 256
+        starts = sorted(lines)
+        for i, (addr, line) in enumerate(starts):
+            end = starts[i + 1][0] if i + 1 < len(starts) else length
+            for a in range(addr, min(end, 256)):
+                self.lines[a] = line
+
+        # address -> "LABEL+n (source:line)", all made up front
+        self.locations = []
+        label, base = None, 0
+        name = os.path.basename(source)
+        for addr in range(256):
+            if self.labels[addr] is not None:
+                label, base = self.labels[addr], addr
+            where = f'{addr:#04x}' if label is None else \
+                label if addr == base else f'{label}+{addr - base}'
+            if self.lines[addr] is not None:
+                where += f' ({name}:{self.lines[addr]})' if name else \
+                         f' (line {self.lines[addr]})'
+            self.locations.append(where)
+
+    def where(self, addr):
+        """Where addr is, as 'LABEL+n (source:line)'."""
+        return self.locations[addr & 0xFF]
+
+    def line(self, addr):
+        """The source line of the code at addr, or None."""
+        return self.lines[addr & 0xFF]
@@ -0,0 +1,57 @@
+"""Binary LS-8 image format (.ls8b).
+
+Layout, little-endian:
+
+    header   magic b'LS8B', version, entry point, code length (2 bytes),
+             symbol count (2 bytes)
+    code     code length bytes, loaded at address 0
+    symbols  per symbol: address, name length, name (ASCII)
+
+The code section can be read straight into RAM with readinto(), so loading
+an image costs one header parse and one bulk read.
+"""
+import struct
+
+MAGIC = b'LS8B'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHH')
+
+
+def write_image(f, code, entry=0, symbols=None):
+    """Write code (bytes) and an optional {label: address} dict to f."""
+    symbols = symbols or {}
+    f.write(HEADER.pack(MAGIC, VERSION, entry, len(code), len(symbols)))
+    f.write(bytes(code))
+    for name, addr in symbols.items():
+        name = name.encode('ascii')
+        f.write(bytes((addr & 0xFF, len(name))) + name)
+
+
+def parse_header(head):
+    """Returns (entry, code length, symbol count) from the header bytes."""
+    if len(head) < HEADER.size:
+        raise ValueError('Truncated LS-8 image header')
+    magic, version, entry, length, count = HEADER.unpack_from(head)
+    if magic != MAGIC:
+        raise ValueError('Not an LS-8 image')
+    if version != VERSION:
+        raise ValueError(f'Unsupported LS-8 image version {version}')
+    return entry, length, count
+
+
+def read_symbols(f, count):
+    """Read the symbol section; returns {label: address}."""
+    symbols = {}
+    for _ in range(count):
+        addr, size = f.read(2)
+        symbols[f.read(size).decode('ascii')] = addr
+    return symbols
+
+
+def read_image(f):
+    """Read a whole image; returns (code, entry, symbols)."""
+    entry, length, count = parse_header(f.read(HEADER.size))
+    code = f.read(length)
+    if len(code) != length:
+        raise ValueError('Truncated LS-8 image')
+    return code, entry, read_symbols(f, count)
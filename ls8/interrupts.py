@@ -0,0 +1,293 @@
+"""Interrupt controller for the LS-8 CPU.
+
+Interrupt sources don't get polled on every instruction. Each one schedules
+itself on an event queue keyed by the CPU cycle count, and the CPU only
+calls service() when the next event is due or an unmasked interrupt is
+pending in IS, so the hot loop never makes a syscall.
+"""
+import copy
+import heapq
+import os
+import select
+import selectors
+import sys
+import time
+
+# interrupt numbers
+TIMER_INTERRUPT = 0
+KEYBOARD_INTERRUPT = 1
+
+KEY_ADDR = 0xF4 # most recent key pressed
+POLL_CYCLES = 4096 # cycles between two looks at the wall clock or stdin
+NEVER = float('inf')
+
+
+class InterruptController:
+    """Event queue of interrupt sources, keyed by cycle count."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.events = [] # heap of (cycle, seq, source)
+        self.seq = 0 # keeps events at the same cycle in FIFO order
+        self.sources = []
+
+    def add(self, source):
+        '''Attach an interrupt source and let it schedule its first event.'''
+        self.sources.append(source)
+        source.start(self)
+        return source
+
+    def reset(self):
+        '''Empty the queue and restart every source, e.g. after CPU.reset().'''
+        self.events.clear()
+        for source in self.sources:
+            source.start(self)
+
+    def schedule(self, cycle, source):
+        '''Call source.fire(self) once the CPU reaches cycle.'''
+        heapq.heappush(self.events, (cycle, self.seq, source))
+        self.seq += 1
+
+    def after(self, cycles, source):
+        self.schedule(self.cpu.cycles + cycles, source)
+
+    @property
+    def next_event(self):
+        return self.events[0][0] if self.events else NEVER
+
+    def key(self, value):
+        '''A key was pressed: store it at 0xF4 and raise the interrupt.'''
+        self.cpu.ram_write(KEY_ADDR, value)
+        self.cpu.interrupt(KEYBOARD_INTERRUPT)
+
+    def service(self):
+        '''Fire the due events and deliver a pending interrupt.
+           Returns the cycle of the next event.'''
+        cpu = self.cpu
+        events = self.events
+        while events and events[0][0] <= cpu.cycles:
+            _, _, source = heapq.heappop(events)
+            source.fire(self)
+        cpu.dispatch()
+        return events[0][0] if events else NEVER
+
+    def wait(self):
+        '''The CPU is idle: sleep until some source may raise an interrupt,
+           i.e. a wall-clock deadline passes or an input becomes readable.'''
+        timeouts = [t for t in (s.timeout() for s in self.sources) if t is not None]
+        fds = [fd for fd in (s.fileno() for s in self.sources) if fd is not None]
+        timeout = min(timeouts) if timeouts else None
+        if timeout == 0: return
+        if fds:
+            select.select(fds, [], [], timeout)
+        elif timeout is not None:
+            time.sleep(timeout)
+
+    def save(self):
+        '''Event queue and source states, for CPU.checkpoint().'''
+        index = {id(source): i for i, source in enumerate(self.sources)}
+        events = [(cycle, seq, index[id(source)]) for cycle, seq, source in self.events]
+        return events, self.seq, [source.save() for source in self.sources]
+
+    def load(self, state):
+        '''Put back a save() of this controller or of the one it was forked
+           from, whose sources ours are copies of, in the same order.'''
+        events, self.seq, states = state
+        for source, saved in zip(self.sources, states):
+            source.load(saved)
+        # a heap stays a heap through the same order
+        self.events = [(cycle, seq, self.sources[i]) for cycle, seq, i in events]
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+
+class Source:
+    """Base interrupt source: fire() is called when its event is due."""
+
+    def start(self, controller):
+        pass
+
+    def fire(self, controller):
+        pass
+
+    def timeout(self):
+        '''Seconds until this source may raise an interrupt, None if only
+           its fileno() becoming readable can tell. 0: don't sleep.'''
+        return 0
+
+    def fileno(self):
+        return None
+
+    def save(self):
+        '''State for a checkpoint, for load() to put back.'''
+        return None
+
+    def load(self, state):
+        pass
+
+    def fork(self):
+        '''A copy for a forked CPU.'''
+        return copy.copy(self)
+
+    def close(self):
+        pass
+
+
+class TimerSource(Source):
+    '''Timer interrupt triggers once per second (wall clock), checked
+       every poll_cycles cycles.'''
+
+    def __init__(self, interval=1.0, poll_cycles=POLL_CYCLES, clock=time.monotonic):
+        self.interval = interval
+        self.poll_cycles = poll_cycles
+        self.clock = clock
+
+    def start(self, controller):
+        self.deadline = self.clock() + self.interval
+        controller.after(self.poll_cycles, self)
+
+    def fire(self, controller):
+        now = self.clock()
+        if now >= self.deadline:
+            controller.cpu.interrupt(TIMER_INTERRUPT)
+            self.deadline = now + self.interval
+        controller.after(self.poll_cycles, self)
+
+    def timeout(self):
+        return max(0, self.deadline - self.clock())
+
+    def save(self):
+        return self.deadline - self.clock() # time left, the clock moves on
+
+    def load(self, state):
+        self.deadline = self.clock() + state
+
+
+class StdinKeyboard(Source):
+    '''Keyboard interrupt from a nonblocking stdin, using selectors.
+       A terminal is put in cbreak mode so keys arrive without Enter, from
+       start() on: attach the source once nothing can fail before the run
+       whose finally calls close().'''
+
+    def __init__(self, stream=None, poll_cycles=POLL_CYCLES):
+        self.fd = (stream or sys.stdin).fileno()
+        self.poll_cycles = poll_cycles
+        self.selector = self.open_selector()
+        self.saved = None
+        self.owner = True # of the terminal mode, forks are not
+        self.eof = False
+
+    def open_selector(self):
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(self.fd, selectors.EVENT_READ)
+        except PermissionError: # regular files are always readable
+            selector.close()
+            return None
+        return selector
+
+    def start(self, controller):
+        if self.owner and self.saved is None and os.isatty(self.fd):
+            import termios, tty
+            self.saved = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+        controller.after(self.poll_cycles, self)
+
+    def fire(self, controller):
+        if self.selector is None or self.selector.select(timeout=0):
+            data = os.read(self.fd, 1)
+            if not data: # end of input, stop polling
+                self.eof = True
+                return
+            controller.key(data[0])
+        controller.after(self.poll_cycles, self)
+
+    def timeout(self):
+        if self.eof: return None
+        return 0 if self.selector is None else None
+
+    def fileno(self):
+        if self.eof or self.selector is None: return None
+        return self.fd
+
+    def save(self):
+        return self.eof
+
+    def load(self, state):
+        self.eof = state
+
+    def fork(self):
+        twin = copy.copy(self)
+        twin.selector = self.open_selector()
+        twin.saved = None # the original gives the terminal back
+        twin.owner = False
+        return twin
+
+    def close(self):
+        if self.selector is not None: self.selector.close()
+        if self.saved is not None:
+            import termios
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved)
+            self.saved = None
+
+
+class MsvcrtKeyboard(Source):
+    '''Keyboard interrupt on Windows, via msvcrt.kbhit().'''
+
+    def __init__(self, poll_cycles=POLL_CYCLES):
+        import msvcrt
+        self.msvcrt = msvcrt
+        self.poll_cycles = poll_cycles
+
+    def start(self, controller):
+        controller.after(self.poll_cycles, self)
+
+    def fire(self, controller):
+        if self.msvcrt.kbhit():
+            controller.key(ord(self.msvcrt.getch()))
+        controller.after(self.poll_cycles, self)
+
+    def timeout(self):
+        return 0.01 # the console can't be waited on, look again soon
+
+
+def keyboard():
+    '''The keyboard source for this OS.'''
+    if sys.platform == 'win32':
+        return MsvcrtKeyboard()
+    return StdinKeyboard()
+
+
+class ScriptedSource(Source):
+    '''Replays interrupts at fixed cycles, for tests.
+       script is a list of (cycle, interrupt) or (cycle, interrupt, key).'''
+
+    def __init__(self, script):
+        self.script = sorted(script, key=lambda event: event[0])
+        self.next = 0
+
+    def start(self, controller):
+        self.next = 0
+        if self.script:
+            controller.schedule(self.script[0][0], self)
+
+    def fire(self, controller):
+        cycle, number, *key = self.script[self.next]
+        self.next += 1
+        if key:
+            controller.cpu.ram_write(KEY_ADDR, key[0])
+        controller.cpu.interrupt(number)
+        if self.next < len(self.script):
+            controller.schedule(self.script[self.next][0], self)
+
+    def timeout(self):
+        # driven by cycles: nothing to wait for, except when done
+        return 0 if self.next < len(self.script) else None
+
+    def save(self):
+        return self.next
+
+    def load(self, state):
+        self.next = state
@@ -0,0 +1,79 @@
+"""The LS-8 instruction set, shared by the emulator (cpu.py) and the
+assembler (../asm/asm.py).
+
+Opcodes are laid out as AABCDDDD:
+
+    AA    number of operands, so an instruction is AA + 1 bytes long
+    B     1 if the instruction is handled by the ALU
+    C     1 if the instruction sets the PC
+    DDDD  instruction identifier
+
+Everything the emulator needs per opcode is precomputed from that layout
+into 256-entry tables, so it never has to look at the bits at run time.
+"""
+
+# operand kinds, the assembler's "type" of an instruction
+NO_OPERANDS = 0
+REG = 1 # 00000rrr
+REG_REG = 2 # 00000aaa 00000bbb
+REG_IMM = 8 # 00000rrr iiiiiiii, immediate value or label
+
+# mnemonic, opcode, operand kind
+INSTRUCTIONS = [
+    ('ADD', 0b10100000, REG_REG),
+    ('ADDI', 0b10101110, REG_IMM), # extensional op to add an immediate value
+    ('AND', 0b10101000, REG_REG),
+    ('CALL', 0b01010000, REG),
+    ('CAS', 0b10000101, REG_REG), # multi-core: atomic compare and exchange
+    ('CID', 0b01001001, REG), # multi-core: load the core ID
+    ('CMP', 0b10100111, REG_REG),
+    ('DEC', 0b01100110, REG),
+    ('DIV', 0b10100011, REG_REG),
+    ('HLT', 0b00000001, NO_OPERANDS),
+    ('INC', 0b01100101, REG),
+    ('INT', 0b01010010, REG),
+    ('IPI', 0b10000110, REG_REG), # multi-core: interrupt another core
+    ('IRET', 0b00010011, NO_OPERANDS),
+    ('JEQ', 0b01010101, REG),
+    ('JGE', 0b01011010, REG),
+    ('JGT', 0b01010111, REG),
+    ('JLE', 0b01011001, REG),
+    ('JLT', 0b01011000, REG),
+    ('JMP', 0b01010100, REG),
+    ('JNE', 0b01010110, REG),
+    ('LD', 0b10000011, REG_REG),
+    ('LDI', 0b10000010, REG_IMM),
+    ('MOD', 0b10100100, REG_REG),
+    ('MUL', 0b10100010, REG_REG),
+    ('NOP', 0b00000000, NO_OPERANDS),
+    ('NOT', 0b01101001, REG),
+    ('OR', 0b10101010, REG_REG),
+    ('POP', 0b01000110, REG),
+    ('PRA', 0b01001000, REG),
+    ('PRN', 0b01000111, REG),
+    ('PUSH', 0b01000101, REG),
+    ('RET', 0b00010001, NO_OPERANDS),
+    ('SHL', 0b10101100, REG_REG),
+    ('SHR', 0b10101101, REG_REG),
+    ('ST', 0b10000100, REG_REG),
+    ('SUB', 0b10100001, REG_REG),
+    ('XOR', 0b10101011, REG_REG),
+]
+
+OPCODES = {name: op for name, op, _ in INSTRUCTIONS} # mnemonic -> opcode
+MNEMONICS = {op: name for name, op, _ in INSTRUCTIONS} # opcode -> mnemonic
+KINDS = {name: kind for name, _, kind in INSTRUCTIONS} # mnemonic -> kind
+
+for name, op, kind in INSTRUCTIONS:
+    if op >> 6 != (2 if kind == REG_IMM else kind):
+        raise ValueError(f'{name}: operand kind does not match {op:08b}')
+del name, op, kind
+
+# ADD, LDI, ... as module constants
+globals().update(OPCODES)
+
+# per opcode, for all 256 values
+LENGTH = bytes((op >> 6) + 1 for op in range(256)) # bytes, operands included
+# register operands: both operands of REG_REG, only A of REG_IMM
+IMMEDIATE = {op for _, op, kind in INSTRUCTIONS if kind == REG_IMM}
+REGISTERS = bytes(1 if op in IMMEDIATE else op >> 6 for op in range(256))
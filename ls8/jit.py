@@ -0,0 +1,238 @@
+"""Basic-block JIT for the LS-8 CPU.
+
+Straight-line runs of instructions ending at a jump, CALL, RET or HLT, or
+right after a write to IM or IS, are translated into Python source with the
+registers held in locals, compiled with compile() and cached per entry PC.
+Anything the block compiler doesn't know how to translate (HLT, IRET, DIV,
+MOD, ...) is left to the interpreter.
+"""
+from cpu import *
+
+MAX_BLOCK = 64 # instructions per block
+
+# instruction -> lines of Python; {a} and {b} are the operand bytes
+BODY = {
+    LDI: ['r{a} = {b}'],
+    LD: ['r{a} = ram[r{b}]'],
+    PRN: ['console.prn(r{a})'],
+    PRA: ['console.pra(r{a})'],
+    POP: ['r{a} = ram[r7]', 'r7 = (r7 + 1) & 0xFF'],
+    ADD: ['r{a} = (r{a} + r{b}) & 0xFF'],
+    SUB: ['r{a} = (r{a} - r{b}) & 0xFF'],
+    MUL: ['r{a} = (r{a} * r{b}) & 0xFF'],
+    AND: ['r{a} &= r{b}'],
+    OR: ['r{a} |= r{b}'],
+    XOR: ['r{a} ^= r{b}'],
+    SHL: ['r{a} = (r{a} << r{b}) & 0xFF'],
+    SHR: ['r{a} >>= r{b}'],
+    CMP: ['fl = 4 if r{a} < r{b} else 2 if r{a} > r{b} else 1'],
+    NOT: ['r{a} = ~r{a} & 0xFF'],
+    INC: ['r{a} = (r{a} + 1) & 0xFF'],
+    DEC: ['r{a} = (r{a} - 1) & 0xFF'],
+    ADDI: ['r{a} = (r{a} + {b}) & 0xFF'],
+    NOP: [],
+}
+# instructions writing to RAM: (lines before the store, address, value)
+STORE = {
+    ST: ([], 'r{a}', 'r{b}'),
+    PUSH: (['r7 = (r7 - 1) & 0xFF'], 'r7', 'r{a}'),
+}
+# conditional jumps -> test on the flags
+COND = {op: f'fl & {flags}' for op, flags in JUMP_FLAGS.items()}
+COND[JNE] = 'not fl & 1'
+# instructions ending a block
+BRANCH = (JMP, CALL, RET) + tuple(COND)
+# instructions writing to register A
+WRITES = frozenset(BODY) - {CMP, PRN, PRA, NOP}
+
+NOBLOCK = False # marks an entry PC the interpreter has to handle
+
+
+def indent(lines, depth=1):
+    return ['    ' * depth + line for line in lines]
+
+
+class BlockCompiler:
+    """Compiles and runs LS-8 basic blocks for a CPU."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = [None] * 256 # entry PC -> compiled block
+        self.lengths = bytearray(256) # entry PC -> most instructions its block runs
+        self.owners = {} # address -> entry PCs, where there are blocks
+        # whole-program state machine translated ahead of time (aot.py),
+        # run from the loop before single blocks, and the bytes it covers
+        self.machine = None
+        self.machine_code = bytearray(256)
+
+    def reset(self):
+        self.blocks[:] = [None] * 256
+        self.owners.clear()
+        self.machine = None
+        self.machine_code[:] = bytes(256)
+
+    def fork(self, cpu):
+        '''A compiler for cpu, a fork of ours: blocks take the CPU as an
+           argument, so they are shared as long as RAM is the same.'''
+        twin = BlockCompiler(cpu)
+        if cpu.ram == self.cpu.ram:
+            twin.blocks[:] = self.blocks
+            twin.lengths[:] = self.lengths
+            twin.owners = {addr: list(owner) for addr, owner in self.owners.items()}
+            twin.machine = self.machine
+            twin.machine_code[:] = self.machine_code
+            for addr in twin.owners:
+                cpu.code[addr] = 1
+        return twin
+
+    def invalidate(self, addr):
+        '''Drop every block covering addr.'''
+        for entry in self.owners.pop(addr, ()):
+            self.blocks[entry] = None
+        if self.machine_code[addr]: # self-modifying code: blocks only
+            self.machine = None
+
+    def scan(self, pc):
+        '''Find the instructions of the basic block starting at pc.'''
+        ram = self.cpu.ram
+        interrupt_regs = (self.cpu.IM, self.cpu.IS)
+        insts = []
+        addr = pc
+        while len(insts) < MAX_BLOCK and addr < 256:
+            op = ram[addr]
+            size = LENGTH[op]
+            if addr + size > 256: break
+            if op not in BODY and op not in STORE and op not in BRANCH: break
+            a, b = ram[(addr+1) & 0xFF], ram[(addr+2) & 0xFF]
+            # leave bad register numbers for the interpreter to fail on
+            if REGISTERS[op] and a > 7: break
+            if REGISTERS[op] == 2 and b > 7: break
+            insts.append((addr, op, a, b))
+            addr += size
+            if op in BRANCH: break
+            # an interrupt may have become pending: run() delivers it before
+            # the next instruction, as the interpreter does
+            if op in WRITES and a in interrupt_regs: break
+        return insts, addr
+
+    def source(self, insts, end, name='block'):
+        '''Generate the Python source of a block, a function called name.'''
+        used = set() # registers kept in locals
+        for _, op, a, b in insts:
+            if REGISTERS[op]: used.add(a)
+            if REGISTERS[op] == 2: used.add(b)
+            if op in (PUSH, POP, CALL, RET): used.add(7)
+        uses_fl = any(op == CMP or op in COND for _, op, _, _ in insts)
+
+        head = [f'r{r} = reg[{r}]' for r in sorted(used)]
+        if any(op in (PRN, PRA) for _, op, _, _ in insts): head.append('console = cpu.console')
+        if uses_fl: head.append('fl = cpu.fl')
+        sync = [f'reg[{r}] = r{r}' for r in sorted(used)]
+        if uses_fl: sync.append('cpu.fl = fl')
+
+        # blocks return (next PC, instructions executed)
+        def leave(target, n):
+            return sync + [f'return {target}, {n}']
+
+        lines = head + self.body(insts, end, leave, leave)
+        return '\n'.join([f'def {name}(cpu, reg, ram, code):'] + indent(lines)) + '\n'
+
+    def body(self, insts, end, leave, spill):
+        '''Unindented lines of Python running the instructions of a block.
+           leave(target, n) gives the lines going to target after n
+           instructions, spill(target, n) those after a store hit code.'''
+        lines = []
+
+        def store(addr, value, target, n):
+            lines.append(f'ram[{addr}] = {value}')
+            lines.append(f'if code[{addr}]:')
+            lines.extend(indent([f'cpu.invalidate({addr})'] + spill(target, n)))
+
+        for n, (addr, op, a, b) in enumerate(insts, 1):
+            next_pc = (addr + LENGTH[op]) & 0xFF
+            lines.append(f'# {addr}: {op:08b} {a} {b}')
+            if op in BODY:
+                lines += [line.format(a=a, b=b) for line in BODY[op]]
+            elif op in STORE:
+                before, where, value = STORE[op]
+                lines += before
+                store(where.format(a=a, b=b), value.format(a=a, b=b), next_pc, n)
+            elif op == CALL:
+                lines.append('r7 = (r7 - 1) & 0xFF')
+                store('r7', next_pc, f'r{a}', n)
+                lines += leave(f'r{a}', n)
+            elif op == RET:
+                lines += ['pc = ram[r7]', 'r7 = (r7 + 1) & 0xFF'] + leave('pc', n)
+            elif op == JMP:
+                lines += leave(f'r{a}', n)
+            elif op in COND:
+                lines.append(f'if {COND[op]}:')
+                lines += indent(leave(f'r{a}', n)) + leave(next_pc, n)
+        if insts[-1][1] not in BRANCH:
+            lines += leave(end & 0xFF, len(insts))
+        return lines
+
+    def compile(self, pc):
+        '''Compile and cache the block starting at pc.'''
+        insts, end = self.scan(pc)
+        if not insts:
+            self.blocks[pc] = NOBLOCK
+            self.owners.setdefault(pc, []).append(pc)
+            self.cpu.code[pc] = 1
+            return NOBLOCK
+        namespace = {}
+        exec(compile(self.source(insts, end), f'<ls8 block {pc}>', 'exec'), namespace)
+        return self.install(pc, namespace['block'], end)
+
+    def install(self, pc, block, end):
+        '''Cache a block covering pc up to end, e.g. one translated ahead
+           of time, so writes to its bytes drop it.'''
+        self.blocks[pc] = block
+        ram, n, addr = self.cpu.ram, 0, pc
+        while addr < end: # count the instructions, the most it runs
+            addr += LENGTH[ram[addr]]
+            n += 1
+        self.lengths[pc] = n
+        for addr in range(pc, end):
+            self.owners.setdefault(addr, []).append(pc)
+            self.cpu.code[addr] = 1
+        return block
+
+    def run(self, limit=NEVER):
+        '''Run the CPU a block at a time, up to cycle limit. A block that
+           could run past the next event is interpreted instead, up to the
+           event, so interrupts come at the same cycle as they would in
+           the interpreter.'''
+        cpu = self.cpu
+        blocks, lengths, reg, ram, code = self.blocks, self.lengths, cpu.reg, cpu.ram, cpu.code
+        IM, IS = cpu.IM, cpu.IS
+        next_event = horizon = 0 # any block may start below horizon
+
+        while cpu.running:
+            # interrupts are delivered between blocks
+            if cpu.cycles >= next_event or (reg[IS] & reg[IM] and cpu.ie):
+                if cpu.cycles >= limit: break
+                due = cpu.cycles >= next_event
+                next_event = min(cpu.interrupts.service(), limit)
+                if due:
+                    next_event = min(next_event, cpu.cycles + POLL_CYCLES)
+                    if cpu.skip_idle(limit):
+                        next_event = 0
+                        continue
+                horizon = next_event - MAX_BLOCK
+            if self.machine is not None:
+                # no block is longer than MAX_BLOCK: stop short of the event
+                cpu.pc, n = self.machine(cpu, reg, ram, code, horizon - cpu.cycles)
+                if n:
+                    cpu.cycles += n
+                    continue
+            block = blocks[cpu.pc]
+            if block is None:
+                block = self.compile(cpu.pc)
+            if block is NOBLOCK:
+                cpu.execute()
+            elif cpu.cycles > horizon and cpu.cycles + lengths[cpu.pc] > next_event:
+                cpu.interpret(next_event)
+            else:
+                cpu.pc, n = block(cpu, reg, ram, code)
+                cpu.cycles += n
@@ -2,10 +2,94 @@
 
 """Main."""
 
+import argparse
 import sys
 from cpu import *
+from console import FLUSH_POLICIES, NullConsole, StreamConsole
+from interrupts import TimerSource, keyboard
 
-cpu = CPU()
 
-cpu.load()
-cpu.run()
\ No newline at end of file
+def main(argv):
+    parser = argparse.ArgumentParser(description='LS-8 emulator.')
+    parser.add_argument('program', help='.ls8 or .ls8b program file')
+    parser.add_argument('--jit', action='store_true',
+                        help='run compiled basic blocks instead of one '
+                             'op_* call per instruction')
+    parser.add_argument('--aot', action='store_true',
+                        help='run the whole program translated ahead of time, '
+                             'cached in __ls8cache__ (implies --jit)')
+    parser.add_argument('--debug', action='store_true',
+                        help='print what every instruction does')
+    parser.add_argument('--trace', action='store_true',
+                        help='print the CPU state after every instruction')
+    parser.add_argument('--record', metavar='FILE',
+                        help='write the CPU state after every instruction to '
+                             'a binary trace file (see tracer.py)')
+    parser.add_argument('--record-size', type=int, metavar='N',
+                        help='keep only the last N records (default: %d)' % 2**20)
+    parser.add_argument('--flush', choices=FLUSH_POLICIES,
+                        help='when PRN/PRA output is written out (default: '
+                             'line on a terminal, full otherwise)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='discard PRN/PRA output')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write opcode, PC and call stack counts as JSON')
+    parser.add_argument('--collapsed', metavar='FILE',
+                        help='write collapsed call stacks for flamegraphs')
+    args = parser.parse_args(argv[1:])
+    if args.record and (args.debug or args.trace or args.profile or args.collapsed):
+        parser.error('--record replaces the branch table as --debug, --trace '
+                     'and --profile do, it cannot be combined with them')
+
+    mode = DEBUG if args.debug else TRACE if args.trace else FAST
+    if args.quiet:
+        console = NullConsole()
+    else:
+        console = StreamConsole(flush=args.flush)
+    cpu = CPU(jit=args.jit, mode=mode, console=console)
+
+    try:
+        if args.aot:
+            import aot
+            aot.load(cpu, args.program)
+        else:
+            cpu.load(args.program)
+    except FileNotFoundError:
+        print('File is not found.')
+        return 2
+    # only now: the keyboard takes over the terminal until close() below
+    cpu.interrupts.add(TimerSource())
+    cpu.interrupts.add(keyboard())
+
+    profiler = None
+    if args.profile or args.collapsed:
+        from profiler import Profiler
+        profiler = Profiler(cpu)
+
+    tracer = None
+    if args.record:
+        from tracer import Tracer, CAPACITY
+        tracer = Tracer(cpu, args.record_size or CAPACITY, args.record)
+
+    try:
+        result = cpu.run()
+    finally:
+        cpu.interrupts.close() # give the terminal back
+        if tracer is not None:
+            tracer.close()
+        if profiler is not None:
+            if args.profile:
+                with open(args.profile, 'w') as f: profiler.write_json(f)
+            if args.collapsed:
+                with open(args.collapsed, 'w') as f: f.write(profiler.collapsed())
+
+    if result.reason == ERROR:
+        pc = result.error_pc
+        at = f' ({cpu.where(pc)})' if cpu.debug is not None else ''
+        print(f'Error at PC {pc}{at}: {cpu.error!r}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
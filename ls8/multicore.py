@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+"""Multi-core LS-8: cores in processes of their own, sharing RAM.
+
+Usage: multicore.py [-n CORES] [--max-cycles N] [--stack BYTES] [--jit] program
+
+run() loads a program once into RAM held in multiprocessing.shared_memory
+and starts one process per core. Each core is a CPU with its own PC, FL,
+registers, decode cache and interrupt controller, whose RAM is a view of
+the shared block, so the code, data, interrupt vectors and the key at 0xF4
+are the same for all of them. Three instructions (see isa.py) let cores
+work together:
+
+    CID Rn      load the core ID (0, 1, ...) into Rn
+    CAS Ra,Rb   compare and exchange, atomic across cores: if the value at
+                the address in Ra equals R0, store Rb there, else load it
+                into R0; FL is set as CMP R0 with the old value would
+    IPI Ra,Rb   raise interrupt Ra on core Rb: the bit is set in that
+                core's IS, and taken through IM and the vector table as
+                any other interrupt
+
+A spinlock, reading the lock before trying to take it so that a waiting
+core counts as idle (see CPU.skip_idle()) and sleeps instead of burning
+its host core:
+
+    SPIN:   LD R0,R2        ; R2: address of the lock
+            CMP R0,R4       ; R4: 0
+            JNE R3          ; R3: SPIN
+            CAS R2,R1       ; R1: 1, R0 is 0 here
+            JNE R3          ; someone else was faster
+            ...             ; critical section
+            ST R2,R4        ; release
+
+Core n starts with SP at 0xF4 - n * stack, so that stacks don't overlap.
+Every core runs until it halts or has executed max_cycles instructions;
+run() returns the RunResults in core order, with the output of each.
+
+CAS is only atomic with respect to other CAS and IPI: take locks with CAS
+and release them with a plain store by their holder. A core's decode cache
+only sees its own stores, so cores must not modify code another one runs.
+"""
+
+import argparse
+import sys
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+
+from cpu import *
+from interrupts import Source
+
+RAM_SIZE = 256
+STACK = 16 # bytes of stack per core
+IPI_POLL_CYCLES = 256 # cycles between two looks for inter-core interrupts
+SPIN_SLEEP = 0.001 # longest sleep of an idle core, others may store meanwhile
+
+
+def context():
+    '''fork where there is one: the cores inherit the shared memory and
+       the pipes instead of attaching to them again.'''
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+
+class Cores:
+    """What the cores of one run share: the RAM, the inter-core interrupts
+       each core has pending, and the lock making CAS and IPI atomic."""
+
+    def __init__(self, count, ctx):
+        self.count = count
+        self.shm = shared_memory.SharedMemory(create=True, size=RAM_SIZE + count)
+        self.shm.buf[:RAM_SIZE + count] = bytes(RAM_SIZE + count)
+        self.lock = ctx.Lock()
+        # a byte in a core's pipe wakes it while it sleeps, idle
+        self.wakers = [ctx.Pipe(duplex=False) for _ in range(count)]
+        self.attach()
+
+    def attach(self):
+        self.ram = self.shm.buf[:RAM_SIZE]
+        self.pending = self.shm.buf[RAM_SIZE:RAM_SIZE + self.count]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['ram'], state['pending']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+    def ipi(self, core, number):
+        '''Raise interrupt number on core.'''
+        if not 0 <= number < 8: raise Exception(f'Wrong interrupt mode {number}')
+        if core >= self.count: raise Exception(f'No core {core}')
+        with self.lock:
+            # a byte is in the pipe exactly while some bits are pending
+            if not self.pending[core]:
+                self.wakers[core][1].send_bytes(b'\0')
+            self.pending[core] |= 1 << number
+
+    def take(self, core):
+        '''Clear and return the interrupt bits pending for core.'''
+        with self.lock:
+            bits = self.pending[core]
+            self.pending[core] = 0
+            if bits: self.wakers[core][0].recv_bytes()
+        return bits
+
+    def detach(self):
+        '''Unmap the shared memory; the views of it must go first.'''
+        self.ram.release()
+        self.pending.release()
+        self.shm.close()
+
+    def close(self):
+        '''Detach and free the shared memory, after the run.'''
+        self.detach()
+        self.shm.unlink()
+
+
+class IPISource(Source):
+    '''Delivers the inter-core interrupts raised for a core, checked every
+       poll_cycles cycles.'''
+
+    def __init__(self, cores, core, poll_cycles=IPI_POLL_CYCLES):
+        self.cores = cores
+        self.core = core
+        self.poll_cycles = poll_cycles
+
+    def start(self, controller):
+        controller.after(self.poll_cycles, self)
+
+    def fire(self, controller):
+        if self.cores.pending[self.core]: # no lock until there is something
+            bits = self.cores.take(self.core)
+            for i in range(8):
+                if bits >> i & 1: controller.cpu.interrupt(i)
+        controller.after(self.poll_cycles, self)
+
+    def timeout(self):
+        return SPIN_SLEEP
+
+    def fileno(self):
+        return self.cores.wakers[self.core][0].fileno()
+
+
+def run_core(cores, core, entry, max_cycles, stack, jit, results):
+    '''Body of a core's process; sends (RunResult, error) to results.'''
+    result = error = None
+    try:
+        cpu = CPU(jit=jit, capture=True, core=core, ram=cores.ram)
+        cpu.cores = cores
+        cpu.pc = entry
+        cpu.reg[cpu.SP] = (0xF4 - core * stack) & 0xFF
+        cpu.interrupts.add(IPISource(cores, core))
+        result = cpu.run(max_cycles=max_cycles)
+        if cpu.error is not None: error = repr(cpu.error)
+    except Exception as e:
+        error = repr(e)
+    results.send((result, error))
+    results.close()
+    cores.detach()
+
+
+def run(filename, count, max_cycles=None, stack=STACK, jit=False):
+    """Run a program on count cores, each in a process of its own.
+       Returns [(RunResult or None, error or None)] in core order."""
+    ctx = context()
+    cores = Cores(count, ctx)
+    try:
+        loader = CPU(ram=cores.ram)
+        loader.load(filename)
+        entry = loader.pc
+        del loader
+        processes = []
+        for core in range(count):
+            reader, writer = ctx.Pipe(duplex=False)
+            p = ctx.Process(target=run_core,
+                            args=(cores, core, entry, max_cycles, stack, jit, writer))
+            p.start()
+            writer.close() # so that a core dying shows as EOF
+            processes.append((p, reader))
+        done = []
+        for p, reader in processes:
+            try:
+                done.append(reader.recv())
+            except EOFError:
+                p.join()
+                done.append((None, f'core process exited with status {p.exitcode}'))
+            reader.close()
+        for p, _ in processes: p.join()
+        return done
+    finally:
+        cores.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run an LS-8 program on several cores.')
+    parser.add_argument('program', help='.ls8 or .ls8b program file')
+    parser.add_argument('-n', '--cores', type=int, default=2,
+                        help='number of cores (default: 2)')
+    parser.add_argument('--max-cycles', type=int,
+                        help='stop each core after this many instructions')
+    parser.add_argument('--stack', type=int, default=STACK,
+                        help=f'bytes of stack per core (default: {STACK})')
+    parser.add_argument('--jit', action='store_true',
+                        help='run compiled basic blocks on every core')
+    args = parser.parse_args(argv[1:])
+    if not 1 <= args.cores <= 256:
+        parser.error('there can be 1 to 256 cores')
+
+    start = time.perf_counter()
+    try:
+        done = run(args.program, args.cores, args.max_cycles, args.stack, args.jit)
+    except FileNotFoundError:
+        print('File is not found.')
+        return 2
+    elapsed = time.perf_counter() - start
+
+    status = 0
+    total = 0
+    for core, (result, error) in enumerate(done):
+        if result is not None:
+            sys.stdout.write(result.output)
+            total += result.cycles
+        if error is not None:
+            pc = result.error_pc if result is not None else '?'
+            print(f'core {core}: error at PC {pc}: {error}', file=sys.stderr)
+            status = 1
+    print(f'{args.cores} cores: {total} instructions in {elapsed:.3f}s, '
+          f'{total / elapsed / 1e6:.2f}M instructions/s', file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,116 @@
+"""Guest profiler for the LS-8 CPU.
+
+Attaching a Profiler puts the CPU in PROFILE mode, where CPU.decode() wraps
+every handler it caches with a counting closure. Nothing changes in the
+dispatch loop, so a CPU in any other mode pays nothing. It collects:
+
+* executed instructions per opcode
+* hits per PC
+* instructions per guest call stack, the stack being rebuilt from CALL/RET
+  and from interrupt entry/IRET
+* with debug info (asm.py -g), instructions per source line
+
+and exports them as JSON or as collapsed stacks ("main;sub 123" lines) for
+flamegraph.pl and friends.
+"""
+import json
+
+from cpu import *
+
+
+class Profiler:
+    """Counts where a CPU spends its cycles."""
+
+    def __init__(self, cpu, root=None):
+        self.cpu = cpu
+        self.labels = {} # address -> label, from the image's symbols
+        for label, addr in cpu.symbols.items():
+            self.labels.setdefault(addr, label)
+        self.ops = [0] * 256 # opcode -> instructions executed
+        self.pcs = [0] * 256 # address -> instructions executed
+        self.stack = [root or self.name(cpu.pc)] # guest call stack
+        self.stack_ids = {} # call stack tuple -> index in stack_counts
+        self.stack_counts = []
+        self.current = self.stack_id()
+        cpu.profiler = self
+        cpu.set_mode(PROFILE) # redecode with counting handlers
+
+    def stop(self):
+        '''Detach from the CPU; the counts are kept.'''
+        self.cpu.profiler = None
+        if self.cpu.mode == PROFILE: self.cpu.set_mode(FAST)
+
+    def name(self, addr):
+        return self.labels.get(addr, f'{addr:#04x}')
+
+    def stack_id(self):
+        key = tuple(self.stack)
+        if key not in self.stack_ids:
+            self.stack_ids[key] = len(self.stack_counts)
+            self.stack_counts.append(0)
+        return self.stack_ids[key]
+
+    def push(self, frame):
+        self.stack.append(frame)
+        self.current = self.stack_id()
+
+    def pop(self):
+        if len(self.stack) > 1: # RET without a CALL keeps the root frame
+            self.stack.pop()
+            self.current = self.stack_id()
+
+    def interrupt(self, number, vector):
+        '''Called by CPU.dispatch() when an interrupt is taken.'''
+        self.push(f'I{number}:{self.name(vector)}')
+
+    def wrap(self, addr, op, handler):
+        '''Counting version of the handler decoded at addr.'''
+        ops, pcs, counts, cpu = self.ops, self.pcs, self.stack_counts, self.cpu
+
+        def profiled(a, b):
+            ops[op] += 1
+            pcs[addr] += 1
+            counts[self.current] += 1
+            handler(a, b)
+
+        def profiled_call(a, b):
+            profiled(a, b)
+            self.push(self.name(cpu.pc))
+
+        def profiled_return(a, b):
+            profiled(a, b)
+            self.pop()
+
+        if op == CALL: return profiled_call
+        if op in (RET, IRET): return profiled_return
+        return profiled
+
+    def report(self):
+        '''The counts as a JSON-friendly dict.'''
+        report = {
+            'cycles': sum(self.ops),
+            'opcodes': {MNEMONICS.get(op, f'{op:#04x}'): n
+                        for op, n in enumerate(self.ops) if n},
+            'pcs': {f'{addr:#04x}': n for addr, n in enumerate(self.pcs) if n},
+            'stacks': {';'.join(key): self.stack_counts[i]
+                       for key, i in self.stack_ids.items()
+                       if self.stack_counts[i]},
+        }
+        debug = self.cpu.debug
+        if debug is not None:
+            lines = {}
+            for addr, n in enumerate(self.pcs):
+                line = debug.lines[addr]
+                if n and line is not None: lines[line] = lines.get(line, 0) + n
+            report['source'] = debug.source
+            report['lines'] = {str(line): lines[line] for line in sorted(lines)}
+        return report
+
+    def write_json(self, f):
+        json.dump(self.report(), f, indent=2)
+        f.write('\n')
+
+    def collapsed(self):
+        '''Brendan Gregg's collapsed stack format, one stack per line.'''
+        return ''.join(f'{stack} {n}\n'
+                       for stack, n in self.report()['stacks'].items())
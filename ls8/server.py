@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+"""LS-8 emulator service: concurrent sessions over a Unix domain socket.
+
+Usage: server.py serve [--socket PATH] [--slice CYCLES] [--pool N]
+       server.py run [--socket PATH] [--max-cycles N] [--jit] [--timer]
+                     [--keys TEXT] [--key-interval SECONDS] program
+
+Every connection is a session. Requests and events are JSON objects, one
+per line:
+
+    {"op": "run", "program": BASE64, "max_cycles": N, "jit": false,
+     "timer": false}
+                                    load an .ls8 or .ls8b image and run it,
+                                    one run at a time per session
+    {"op": "key", "key": 65}        store the key at 0xF4 and raise the
+                                    keyboard interrupt
+    {"op": "stop"}                  stop the run
+
+    {"event": "output", "data": TEXT}
+                                    PRN/PRA output, as it is produced
+    {"event": "done", "reason": "hlt", "cycles": N, "registers": [...],
+     "pc": N, "fl": N, "error": null, "error_pc": null}
+                                    the run is over, see RunResult
+    {"event": "error", "message": TEXT}
+                                    a request the session could not take,
+                                    or a run that failed: nothing follows
+
+key and stop do nothing when no program is running.
+
+All sessions run in one event loop. A run executes `slice` cycles at a time
+and then yields to the loop, so that no session starves the others, and
+its output is sent after every slice. A guest spinning in an idle loop (see
+CPU.skip_idle()) is not run again until a key, its timer (one interrupt a
+second with "timer": true) or stop wakes it, unless the run has a
+max_cycles: then the idle loop is fast-forwarded to the limit. CPUs are kept in a pool and
+reset() between runs, so a request costs a load and the run, not a new
+process and a new CPU.
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import stat
+import sys
+
+from cpu import *
+from console import Console, FLUSH_FULL
+
+SOCKET = 'ls8.sock'
+SLICE = 10000 # cycles a session runs before it yields to the others
+POOL = 64 # idle CPUs kept warm, per engine
+LINE_LIMIT = 1 << 20 # bytes of a request: a base64 image and then some
+BACKLOG = 1024 # connections waiting to be accepted; asyncio's 100 is too few
+TIMER_INTERVAL = 1.0 # seconds between two timer interrupts
+
+
+class SessionConsole(Console):
+    """Console handing flushed output to send(), the session's."""
+
+    def __init__(self, send=None):
+        super().__init__(FLUSH_FULL)
+        self.send = send
+
+    def emit(self, data):
+        if self.send is not None: self.send(data)
+
+
+class Server:
+    """Pool of warm CPUs shared by the sessions."""
+
+    def __init__(self, slice_cycles=SLICE, pool=POOL):
+        self.slice = slice_cycles
+        self.pool_size = pool
+        self.pool = {False: [], True: []} # jit -> idle CPUs
+
+    def acquire(self, jit, send):
+        '''A CPU in the power on state, writing its output to send.'''
+        idle = self.pool[jit]
+        cpu = idle.pop() if idle else CPU(jit=jit, console=SessionConsole())
+        cpu.reset()
+        cpu.console.send = send
+        return cpu
+
+    def release(self, cpu):
+        cpu.console.send = None
+        idle = self.pool[cpu.jit is not None]
+        if len(idle) < self.pool_size: idle.append(cpu)
+
+    async def session(self, reader, writer):
+        await Session(self, reader, writer).serve()
+
+    async def serve(self, path):
+        '''Listen on the socket at path until cancelled.'''
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path) # left over from a server that is gone
+        server = await asyncio.start_unix_server(self.session, path, limit=LINE_LIMIT,
+                                                 backlog=BACKLOG)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+class Session:
+    """One connection: its requests, and the run going on, if any."""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.cpu = None # while a run is going
+        self.task = None
+        self.stopped = False
+        self.wake = asyncio.Event() # set by keys, the timer and stop
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b'\n')
+
+    def output(self, data):
+        self.send({'event': 'output', 'data': data.decode('latin-1')})
+
+    async def serve(self):
+        try:
+            while True:
+                try:
+                    line = await self.reader.readline()
+                except ValueError: # longer than LINE_LIMIT
+                    self.send({'event': 'error', 'message': 'request too long'})
+                    break
+                if not line: break
+                try:
+                    request = json.loads(line)
+                    self.handle(request)
+                except (ValueError, TypeError, KeyError) as e:
+                    self.send({'event': 'error', 'message': f'bad request: {e}'})
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if self.task is not None:
+                self.task.cancel()
+                await asyncio.gather(self.task, return_exceptions=True)
+            self.writer.close()
+
+    def handle(self, request):
+        op = request['op']
+        if op == 'run':
+            if self.cpu is not None:
+                raise ValueError('a program is running')
+            max_cycles = request.get('max_cycles')
+            if max_cycles is not None and (type(max_cycles) is not int or max_cycles < 0):
+                raise ValueError('max_cycles must be null or a count of cycles')
+            program = base64.b64decode(request['program'], validate=True)
+            cpu = self.server.acquire(bool(request.get('jit')), self.output)
+            try:
+                cpu.load_file(io.BytesIO(program))
+            except Exception:
+                self.server.release(cpu)
+                raise ValueError('not an LS-8 program')
+            self.cpu = cpu
+            self.stopped = False
+            self.task = asyncio.create_task(
+                self.run(max_cycles, bool(request.get('timer'))))
+        elif op == 'key':
+            key = int(request['key']) & 0xFF
+            if self.cpu is not None:
+                self.cpu.interrupts.key(key)
+                self.wake.set()
+        elif op == 'stop':
+            if self.cpu is not None:
+                self.stopped = True
+                self.wake.set()
+        else:
+            raise ValueError(f'unknown op {op}')
+
+    def idle(self):
+        '''Whether the guest only spins until an interrupt comes.'''
+        cpu = self.cpu
+        if cpu.reg[cpu.IS] & cpu.reg[cpu.IM] and cpu.ie: return False
+        return cpu.spin_length() > 0
+
+    async def tick(self):
+        while True:
+            await asyncio.sleep(TIMER_INTERVAL)
+            self.cpu.interrupt(TIMER_INTERRUPT)
+            self.wake.set()
+
+    async def run(self, max_cycles, timer):
+        cpu = self.cpu
+        timer = asyncio.create_task(self.tick()) if timer else None
+        try:
+            while True:
+                if self.stopped:
+                    reason = STOPPED
+                    break
+                budget = self.server.slice
+                if max_cycles is not None:
+                    budget = min(budget, max_cycles - cpu.cycles)
+                reason = cpu.run(max_cycles=budget).reason
+                self.wake.clear() # what comes from now on is news
+                await self.writer.drain()
+                if reason != MAX_CYCLES: break
+                if max_cycles is not None and cpu.cycles >= max_cycles: break
+                # with a limit, run() fast-forwards the idle loop up to it
+                if max_cycles is None and self.idle() and not self.stopped:
+                    await self.wake.wait()
+                else:
+                    await asyncio.sleep(0) # let the other sessions run
+            self.send({'event': 'done', 'reason': reason, 'cycles': cpu.cycles,
+                       'registers': list(cpu.reg), 'pc': cpu.pc, 'fl': cpu.fl,
+                       'error': repr(cpu.error) if cpu.error is not None else None,
+                       'error_pc': cpu.error_pc})
+            await self.writer.drain()
+        except Exception as e:
+            # a bug, not the guest's doing: the client still gets an answer
+            self.send({'event': 'error', 'message': f'run failed: {e!r}'})
+        finally:
+            if timer is not None: timer.cancel()
+            self.cpu = None
+            self.server.release(cpu)
+
+
+async def run_client(path, program, max_cycles=None, jit=False, timer=False,
+                     keys='', key_interval=0.1, out=None):
+    """Run program (bytes) on the server at path, writing its output to out
+       as it comes, and typing keys. Returns the done event."""
+    out = out or sys.stdout
+    reader, writer = await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+
+    def send(message):
+        writer.write(json.dumps(message).encode() + b'\n')
+
+    async def type_keys():
+        for key in keys:
+            await asyncio.sleep(key_interval)
+            send({'op': 'key', 'key': ord(key) & 0xFF})
+            await writer.drain()
+
+    send({'op': 'run', 'program': base64.b64encode(program).decode(),
+          'max_cycles': max_cycles, 'jit': jit, 'timer': timer})
+    typist = asyncio.create_task(type_keys())
+    try:
+        while True:
+            line = await reader.readline()
+            if not line: raise ConnectionError('server closed the connection')
+            event = json.loads(line)
+            if event['event'] == 'output':
+                out.write(event['data'])
+                out.flush()
+            elif event['event'] == 'done':
+                return event
+            elif event['event'] == 'error':
+                raise ValueError(event['message'])
+    finally:
+        typist.cancel()
+        writer.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='LS-8 emulator service.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('serve', help='serve sessions on a Unix socket')
+    p.add_argument('--socket', default=SOCKET, help=f'socket path (default: {SOCKET})')
+    p.add_argument('--slice', type=int, default=SLICE,
+                   help=f'cycles a session runs before yielding (default: {SLICE})')
+    p.add_argument('--pool', type=int, default=POOL,
+                   help=f'idle CPUs kept warm, per engine (default: {POOL})')
+    p = commands.add_parser('run', help='run a program on a server')
+    p.add_argument('program', help='.ls8 or .ls8b program file')
+    p.add_argument('--socket', default=SOCKET, help=f'socket path (default: {SOCKET})')
+    p.add_argument('--max-cycles', type=int, help='stop after this many instructions')
+    p.add_argument('--jit', action='store_true', help='run compiled basic blocks')
+    p.add_argument('--timer', action='store_true', help='raise the timer interrupt every second')
+    p.add_argument('--keys', default='', help='keys to type, one by one')
+    p.add_argument('--key-interval', type=float, default=0.1,
+                   help='seconds between two keys (default: 0.1)')
+    args = parser.parse_args(argv[1:])
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(Server(args.slice, args.pool).serve(args.socket))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    try:
+        with open(args.program, 'rb') as f:
+            program = f.read()
+    except FileNotFoundError:
+        print('File is not found.')
+        return 2
+    try:
+        done = asyncio.run(run_client(args.socket, program, args.max_cycles, args.jit,
+                                      args.timer, args.keys, args.key_interval))
+    except (OSError, ValueError) as e:
+        print(f'{args.socket}: {e}', file=sys.stderr)
+        return 2
+    if done['reason'] == ERROR:
+        print(f'Error at PC {done["error_pc"]}: {done["error"]}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,38 @@
+"""Loading translated images, from a cold and from a warm cache.
+
+Run with: python -m pytest ls8
+"""
+
+import os
+
+import aot
+import debuginfo
+from cpu import *
+
+# LDI R0,1 / PRN R0 / BAD: an opcode that does not exist
+CODE = [LDI, 0, 1, PRN, 0, 0xFF]
+SYMBOLS = {'BAD': 5}
+LINES = [(0, 1), (3, 2), (5, 3)]
+
+
+def write(tmp_path):
+    path = str(tmp_path / 'bad.ls8')
+    with open(path, 'w') as f:
+        f.write(''.join(f'{b:08b}\n' for b in CODE))
+    with open(debuginfo.sidecar(path), 'wb') as f:
+        debuginfo.write_debuginfo(f, len(CODE), SYMBOLS, LINES)
+    return path
+
+
+def test_cold_and_warm_load_the_same(tmp_path):
+    path = write(tmp_path)
+    runs = []
+    for _ in range(2): # translate, then from __ls8cache__
+        cpu = CPU(capture=True)
+        aot.load(cpu, path)
+        result = cpu.run()
+        runs.append((result, cpu.symbols, cpu.where(result.error_pc)))
+    assert os.listdir(tmp_path / aot.CACHE_DIR)
+    assert runs[0] == runs[1]
+    assert (runs[0][0].reason, runs[0][0].error_pc) == (ERROR, 5)
+    assert runs[0][2].startswith('BAD')
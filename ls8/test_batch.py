@@ -0,0 +1,41 @@
+"""The batch runner: images over a process pool, as one CPU runs them.
+
+Run with: python -m pytest ls8
+"""
+
+import glob
+import os
+
+import batch
+from cpu import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.join(HERE, 'examples')
+MAX_CYCLES = 50000 # the interrupt examples never halt
+
+
+def expected(image):
+    cpu = CPU(capture=True)
+    cpu.load(image)
+    result = cpu.run(max_cycles=MAX_CYCLES)
+    return result.reason, result.cycles, result.output
+
+
+def test_examples_in_a_pool():
+    images = batch.find_images([EXAMPLES])
+    assert images == sorted(glob.glob(os.path.join(EXAMPLES, '*.ls8')))
+    results = list(batch.run_batch(images, jobs=2, max_cycles=MAX_CYCLES))
+    assert sorted(r['image'] for r in results) == images
+    for r in results:
+        assert (r['reason'], r['cycles'], r['output']) == expected(r['image'])
+
+
+def test_manifest_timeout_and_load_error(tmp_path):
+    manifest = tmp_path / 'manifest'
+    manifest.write_text(f'{EXAMPLES}/interrupts.ls8 # spins\nmissing.ls8\n')
+    images = batch.find_images([str(manifest)])
+    assert images == [f'{EXAMPLES}/interrupts.ls8', str(tmp_path / 'missing.ls8')]
+    spins, missing = batch.run_batch(images, jobs=1, timeout=0)
+    assert spins['reason'] == batch.TIMEOUT
+    assert spins['cycles'] == batch.SLICE
+    assert missing['reason'] == batch.LOAD_ERROR
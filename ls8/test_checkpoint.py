@@ -0,0 +1,57 @@
+"""Checkpoints: resume() and fork() carry on as if nothing happened.
+
+Run with: python -m pytest ls8
+"""
+
+import batch
+from cpu import *
+
+# R0 <- RAM[INPUT] * 3, printed after a countdown from 50
+INPUT = 0x80
+COUNT = [
+    LDI, 1, INPUT, LD, 0, 1, LDI, 2, 3, MUL, 0, 2,
+    LDI, 1, 50, LDI, 2, 0, LDI, 3, 21,
+    DEC, 1, CMP, 1, 2, JNE, 3, # 21: countdown loop
+    PRN, 0, HLT,
+]
+
+
+def cpu_at(code, cycles, **options):
+    cpu = CPU(capture=True, **options)
+    cpu.load_bytes(code)
+    cpu.run(max_cycles=cycles)
+    return cpu
+
+
+def test_resume_and_fork_carry_on():
+    cpu = cpu_at(COUNT, 20, jit=True)
+    checkpoint = cpu.checkpoint()
+    fork = cpu.fork()
+    expected = cpu.run()
+    assert expected.reason == HALT
+    assert fork.run() == expected
+    cpu.resume(checkpoint)
+    assert cpu.run() == expected
+
+
+def test_fork_keeps_the_error():
+    cpu = cpu_at([LDI, 0, 1, 0xFF], None)
+    halted = cpu.run()
+    assert (halted.reason, halted.error_pc) == (ERROR, 3)
+    fork = cpu.fork()
+    assert (fork.run(), repr(fork.error)) == (halted, repr(cpu.error))
+    checkpoint = cpu.checkpoint()
+    cpu.reset()
+    cpu.resume(checkpoint)
+    assert cpu.run() == halted
+
+
+def test_run_forks():
+    def prepare(fork, value):
+        fork.ram[INPUT] = value
+    cpu = cpu_at(COUNT, 0)
+    inputs = list(range(0, 256, 37))
+    expected = [f'{value * 3 & 0xFF}\n' for value in inputs]
+    for jobs in (1, 3):
+        results = batch.run_forks(cpu, inputs, prepare, jobs=jobs)
+        assert [result.output for result in results] == expected
@@ -0,0 +1,127 @@
+"""Differential tests: every fast engine against the DEBUG interpreter.
+
+Random programs (ALU, stack, jumps and calls, INT, writes to IM and IS,
+faults) run with scripted interrupts on the DEBUG interpreter, which
+decodes every instruction on its own, and on FAST with fused
+instructions, the JIT and the AOT translation. All of them must stop the
+same way after the same number of cycles, with the same registers, RAM,
+output and error.
+
+Run with: python -m pytest ls8
+"""
+
+import contextlib
+import io
+import random
+
+import pytest
+
+import aot
+from cpu import *
+from interrupts import ScriptedSource
+
+SEED = 13
+PROGRAMS = 300
+MAX_CYCLES = 500
+HANDLER_OUTPUT = 99 # printed by the interrupt handler
+IM, IS = 5, 6 # interrupt mask and status registers
+
+REG_REG = [ADD, SUB, MUL, AND, OR, XOR, SHL, SHR, CMP, LD, ST]
+JUMPS = [JMP, JEQ, JNE, JGT, JLT, JLE, JGE, CALL]
+
+
+def register(rng):
+    '''Mostly R0-R3, sometimes any register, IM/IS/SP included.'''
+    return rng.randrange(8) if rng.random() < .3 else rng.randrange(4)
+
+
+def instruction(rng, count):
+    '''Instructions for one random step; ('label', i) is the address of
+       the i-th step.'''
+    k = rng.random()
+    if k < .15:
+        return [[LDI, register(rng), rng.randrange(256)]]
+    if k < .45:
+        return [[rng.choice(REG_REG), register(rng), register(rng)]]
+    if k < .55:
+        return [[rng.choice([INC, DEC, NOT]), register(rng)]]
+    if k < .6:
+        return [[ADDI, register(rng), rng.randrange(256)]]
+    if k < .7:
+        return [[PRN, register(rng)]]
+    if k < .75:
+        return [[rng.choice([PUSH, POP]), register(rng)]]
+    if k < .9:
+        return [[LDI, 4, ('label', rng.randrange(count))], [rng.choice(JUMPS), 4]]
+    if k < .93:
+        return [[rng.choice([RET, NOP])]]
+    if k < .94:
+        return [[LDI, 3, rng.choice([0, 1, 2, 9])], [INT, 3]]
+    if k < .96:
+        return [[rng.choice([DIV, MOD]), register(rng), register(rng)]]
+    # enable or acknowledge interrupts in the middle of a block
+    return [[rng.choice([LDI, INC]), rng.choice([IM, IS]), rng.randrange(256)]]
+
+
+def program(rng):
+    '''(ram, interrupt script) of a random program.'''
+    count = rng.randint(4, 30)
+    steps = [instruction(rng, count) for _ in range(count)] + [[[HLT]]]
+    addrs, addr = [], 0
+    for step in steps:
+        addrs.append(addr)
+        addr += sum(LENGTH[inst[0]] for inst in step)
+    code = []
+    for step in steps:
+        for inst in step:
+            code += [addrs[x[1]] if isinstance(x, tuple) else x
+                     for x in inst[:LENGTH[inst[0]]]]
+    handler = len(code)
+    code += [LDI, 0, HANDLER_OUTPUT, PRN, 0, IRET]
+    ram = bytearray(256)
+    ram[:len(code)] = bytes(code)
+    # timer and keyboard interrupts
+    ram[0xF8] = ram[0xF9] = handler
+    script = sorted((rng.randrange(300), rng.randrange(2))
+                    for _ in range(rng.randrange(4)))
+    return ram, script
+
+
+def run(ram, script, engine, path=None):
+    '''Everything a run leaves behind on the given engine. AOT writes the
+       image to path.'''
+    cpu = CPU(capture=True, mode=DEBUG if engine == 'debug' else FAST,
+              jit=engine == 'jit')
+    if script:
+        cpu.interrupts.add(ScriptedSource(script))
+    if engine == 'aot':
+        path.write_text(''.join(f'{b:08b}\n' for b in ram))
+        aot.load(cpu, str(path))
+    else:
+        cpu.load_bytes(ram)
+    # DEBUG reports faults on stderr
+    with contextlib.redirect_stdout(io.StringIO()), \
+         contextlib.redirect_stderr(io.StringIO()):
+        result = cpu.run(max_cycles=MAX_CYCLES, jit=engine != 'fast')
+    return result, repr(cpu.error), bytes(cpu.ram), cpu.ie
+
+
+def programs():
+    rng = random.Random(SEED)
+    return [program(rng) for _ in range(PROGRAMS)]
+
+
+@pytest.mark.parametrize('engine', ['fast', 'jit', 'aot'])
+def test_engine_matches_debug(engine, tmp_path):
+    for i, (ram, script) in enumerate(programs()):
+        expected = run(ram, script, 'debug')
+        got = run(ram, script, engine, tmp_path / f'program{i}.ls8')
+        assert got == expected, \
+            f'program {i}, script {script}'
+
+
+def test_programs_take_interrupts():
+    '''The random programs do reach the interrupt handler.'''
+    taken = sum(f'{HANDLER_OUTPUT}\n' in run(ram, script, 'fast')[0].output
+                for ram, script in programs())
+    assert taken > PROGRAMS // 20
@@ -0,0 +1,63 @@
+"""Cores sharing RAM, and the multi-core instructions on a single CPU.
+
+Run with: python -m pytest ls8
+"""
+
+import os
+
+import pytest
+
+import multicore
+from cpu import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORES = os.path.join(HERE, 'examples', 'cores.ls8')
+
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_cores_count_under_a_lock(jit):
+    # every core prints its ID and the shared counter after its increment
+    count = 3
+    done = multicore.run(CORES, count, jit=jit)
+    assert [error for _, error in done] == [None] * count
+    assert [result.reason for result, _ in done] == [HALT] * count
+    printed = [result.output.split() for result, _ in done]
+    assert [int(core) for core, _ in printed] == list(range(count))
+    assert sorted(int(counter) for _, counter in printed) == list(range(1, count + 1))
+
+
+def single_core():
+    '''A program using CID, CAS and IPI on a CPU that is not one of
+       several, and what it prints.'''
+    code = [
+        LDI, 1, 7, CID, 1, PRN, 1,     # core 0
+        LDI, 2, 200, LDI, 0, 0, LDI, 3, 9,
+        CAS, 2, 3, PRN, 0,             # RAM[200] was 0: stored 9, R0 stays 0
+        CAS, 2, 3, PRN, 0,             # now 9: R0 loads it
+        LDI, 5, 0, LDI, 0, 3, LDI, 1, 0,
+        IPI, 0, 1, PRN, 6,             # interrupt 3 on core 0, masked
+        LDI, 1, 1, IPI, 0, 1,          # core 1: no such core
+        HLT,
+    ]
+    return code, '0\n0\n9\n8\n'
+
+
+def test_single_core_instructions():
+    code, printed = single_core()
+    cpu = CPU(capture=True)
+    cpu.load_bytes(code)
+    result = cpu.run()
+    assert (result.reason, result.output) == (ERROR, printed)
+    assert result.error_pc == len(code) - 4
+
+
+def test_vector_single_core_instructions():
+    # VectorCPU runs every machine as core 0, see vector.py
+    pytest.importorskip('numpy')
+    from vector import VectorCPU
+    code, _ = single_core()
+    cpu = CPU(capture=True)
+    cpu.load_bytes(code)
+    engine = VectorCPU(2)
+    engine.load_bytes(code)
+    assert engine.run() == [cpu.run()] * 2
@@ -0,0 +1,88 @@
+"""Sessions of the emulator service, over a socket of their own.
+
+Run with: python -m pytest ls8
+"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+
+import server
+from cpu import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TIMEOUT = 10 # seconds a test waits for an answer
+
+
+def example(name):
+    with open(os.path.join(HERE, 'examples', name), 'rb') as f:
+        return f.read()
+
+
+async def serving(path, test, service=None):
+    '''Await test() while service (a Server) listens on path.'''
+    service = service or server.Server()
+    listening = asyncio.create_task(service.serve(path))
+    while not os.path.exists(path):
+        await asyncio.sleep(0.01)
+    try:
+        return await asyncio.wait_for(test(), TIMEOUT)
+    finally:
+        listening.cancel()
+        await asyncio.gather(listening, return_exceptions=True)
+
+
+async def events(path, request):
+    '''Send one run request and collect the events up to the last one.'''
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(json.dumps(request).encode() + b'\n')
+    got = []
+    while not got or got[-1]['event'] == 'output':
+        got.append(json.loads(await reader.readline()))
+    writer.close()
+    return got
+
+
+def request(name, **options):
+    return dict(op='run', program=base64.b64encode(example(name)).decode(), **options)
+
+
+def test_run(tmp_path):
+    path = str(tmp_path / 'ls8.sock')
+    out = io.StringIO()
+    done = asyncio.run(serving(path, lambda: server.run_client(
+        path, example('printstr.ls8'), out=out)))
+    assert (done['reason'], out.getvalue()) == (HALT, 'Hello, world!\n')
+
+
+def test_bad_max_cycles(tmp_path):
+    path = str(tmp_path / 'ls8.sock')
+    for max_cycles in ['10', -1, 1.5, True]:
+        got = asyncio.run(serving(path, lambda: events(
+            path, request('print8.ls8', max_cycles=max_cycles))))
+        assert got[-1]['event'] == 'error'
+        assert got[-1]['message'].startswith('bad request')
+
+
+def test_idle_loop_runs_to_max_cycles(tmp_path):
+    # keyboard.ls8 spins until a key comes, which never does
+    path = str(tmp_path / 'ls8.sock')
+    done = asyncio.run(serving(path, lambda: server.run_client(
+        path, example('keyboard.ls8'), max_cycles=2000000)))
+    assert (done['reason'], done['cycles']) == (MAX_CYCLES, 2000000)
+
+
+def test_failed_run_answers(tmp_path):
+    class Broken(server.Server):
+        def acquire(self, jit, send):
+            cpu = super().acquire(jit, send)
+            def run(*args, **kwargs): raise RuntimeError('broken')
+            cpu.run = run
+            return cpu
+    path = str(tmp_path / 'ls8.sock')
+    service = Broken()
+    got = asyncio.run(serving(path, lambda: events(path, request('print8.ls8')), service))
+    assert got[-1] == {'event': 'error', 'message': "run failed: RuntimeError('broken')"}
+    assert len(service.pool[False]) == 1 # the CPU went back to the pool
@@ -0,0 +1,64 @@
+"""The binary tracer records what TRACE mode prints.
+
+Run with: python -m pytest ls8
+"""
+
+import argparse
+import os
+
+import tracer
+from console import NullConsole
+from cpu import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROGRAM = os.path.join(HERE, 'examples', 'call.ls8')
+
+
+def trace_lines(capsys):
+    '''What TRACE mode prints over a run of PROGRAM.'''
+    cpu = CPU(mode=TRACE, console=NullConsole())
+    cpu.load(PROGRAM)
+    capsys.readouterr()
+    cpu.run()
+    return capsys.readouterr().out.splitlines()
+
+
+def recorded(capacity=tracer.CAPACITY, filename=None):
+    cpu = CPU(console=NullConsole())
+    cpu.load(PROGRAM)
+    t = tracer.Tracer(cpu, capacity, filename)
+    result = cpu.run()
+    t.close()
+    return t, result
+
+
+def test_records_match_trace_mode(capsys):
+    expected = trace_lines(capsys)
+    t, result = recorded()
+    records = t.records()
+    assert [tracer.trace_line(r) for r in records] == expected
+    assert [r.cycle for r in records] == list(range(result.cycles + 1))
+
+
+def test_ring_keeps_the_last_records(capsys, tmp_path):
+    expected = trace_lines(capsys)
+    path = str(tmp_path / 'call.ls8t')
+    recorded(5, path)
+    assert [tracer.trace_line(r) for r in tracer.read(path)] == expected[-5:]
+
+
+def test_diff(capsys, tmp_path):
+    a, b = str(tmp_path / 'a.ls8t'), str(tmp_path / 'b.ls8t')
+    recorded(filename=a)
+    recorded(filename=b)
+    with open(b, 'r+b') as f: # FL of the fourth record: after cycle and PC
+        f.seek(tracer.HEADER.size + 3 * tracer.ENTRY.size + 9)
+        f.write(b'\7')
+    args = argparse.Namespace(file1=a, file2=a, context=2, debug=None)
+    assert tracer.diff(args) == 0
+    capsys.readouterr()
+    args.file2 = b
+    assert tracer.diff(args) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert [line[0] for line in lines] == [' ', ' ', '-', '+']
+    assert lines[3].split()[3] == '111' # FL in binary
@@ -0,0 +1,50 @@
+"""The lockstep engine against CPU: every machine must end as a CPU would.
+
+Skipped without numpy. Run with: python -m pytest ls8
+"""
+
+import glob
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import test_engines
+from cpu import *
+from vector import VectorCPU
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = sorted(glob.glob(os.path.join(HERE, 'examples', '*.ls8')))
+# the interrupt examples spin forever: there are no sources, nothing comes
+SPINNING = {'interrupts.ls8': 20000, 'keyboard.ls8': 20000}
+
+
+def cpu_run(ram, max_cycles):
+    cpu = CPU(capture=True)
+    cpu.load_bytes(ram)
+    return cpu.run(max_cycles=max_cycles), bytes(cpu.ram)
+
+
+@pytest.mark.parametrize('path', EXAMPLES, ids=os.path.basename)
+def test_examples(path):
+    engine = VectorCPU(3)
+    engine.load(path)
+    cpu = CPU(capture=True)
+    cpu.load(path)
+    max_cycles = SPINNING.get(os.path.basename(path))
+    expected = cpu.run(max_cycles=max_cycles)
+    assert engine.run(max_cycles) == [expected] * 3
+
+
+def test_random_programs():
+    # one machine per program, all of them in lockstep; the interrupt
+    # scripts are left out, the engine has no sources
+    programs = [ram for ram, _ in test_engines.programs()]
+    engine = VectorCPU(len(programs))
+    for i, ram in enumerate(programs):
+        engine.ram[i] = list(ram)
+    results = engine.run(test_engines.MAX_CYCLES)
+    for i, ram in enumerate(programs):
+        expected = cpu_run(ram, test_engines.MAX_CYCLES)
+        assert (results[i], bytes(engine.ram[i])) == expected, f'program {i}'
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+"""Binary instruction tracer for the LS-8 CPU, and the offline tool for its
+traces.
+
+Attaching a Tracer puts the CPU in RECORD mode, where CPU.decode() wraps
+every handler it caches with a closure writing one fixed-size record, the
+state TRACE mode would print, into a preallocated ring buffer: a bytearray,
+or an mmap'd file that survives the process. Nothing is formatted while
+the program runs; when the ring is full the oldest records are overwritten,
+so a trace of any length keeps the last `capacity` instructions.
+
+A trace file is a header and the ring:
+
+    HEADER  magic b'LS8T', version, record size, capacity, records written
+    ENTRY   cycle (8 bytes), pc, fl, the 3 bytes at pc, R0-R7
+
+A record is the state after `cycle` instructions, like a TRACE: line; the
+first of a run is the state it starts in. Idle loops run() fast-forwards
+are not in the trace, their cycles are skipped.
+
+Usage: tracer.py show [--trace] [--pc ADDR] [--op MNEMONIC] [--debug FILE]
+                      [--from CYCLE] [--to CYCLE] [--last N] file
+       tracer.py diff [--context N] [--debug FILE] file1 file2
+
+show prints the records, --trace exactly as TRACE mode would have. diff
+prints the first record in which two traces differ, with the records
+before it, and exits with status 1 if there is one. With --debug, the
+program's .ls8d debug info (asm.py -g), every PC is shown as label and
+source line too.
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+from collections import namedtuple
+
+from cpu import *
+import debuginfo
+import isa
+
+MAGIC = b'LS8T'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIQ') # magic, version, record size, capacity, written
+ENTRY = struct.Struct('<QBB3s8s') # cycle, pc, fl, ram[pc:pc+3], registers
+CAPACITY = 1 << 20 # records
+
+Record = namedtuple('Record', 'cycle pc fl ram reg')
+
+
+class Tracer:
+    """Records the CPU state after every instruction."""
+
+    def __init__(self, cpu, capacity=CAPACITY, filename=None):
+        if capacity < 1: raise ValueError('Tracer capacity must be positive')
+        self.cpu = cpu
+        self.capacity = capacity
+        self.written = 0 # records, including the overwritten ones
+        self.cycle = cpu.cycles
+        size = HEADER.size + capacity * ENTRY.size
+        self.file = None
+        if filename is None:
+            self.buffer = bytearray(size)
+        else:
+            self.file = open(filename, 'w+b')
+            self.file.truncate(size)
+            self.buffer = mmap.mmap(self.file.fileno(), size)
+        self.offset = HEADER.size # of the next record
+        self.end = size
+        self.flush()
+        cpu.tracer = self
+        cpu.set_mode(RECORD) # redecode with recording handlers
+
+    def stop(self):
+        '''Detach from the CPU; the records are kept.'''
+        self.flush()
+        self.cpu.tracer = None
+        if self.cpu.mode == RECORD: self.cpu.set_mode(FAST)
+
+    def close(self):
+        '''Stop, and write out and close the trace file, if any.'''
+        if self.cpu.tracer is self: self.stop()
+        if self.file is not None:
+            self.buffer.flush()
+            self.buffer.close()
+            self.file.close()
+            self.file = None
+
+    def flush(self):
+        '''Bring the header up to date.'''
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, ENTRY.size,
+                         self.capacity, self.written)
+
+    def save(self, filename):
+        '''Write the trace to a file, as an mmap'd tracer would have.'''
+        self.flush()
+        with open(filename, 'wb') as f:
+            f.write(self.buffer)
+
+    def sync(self, cycles):
+        '''Called by the CPU when its cycle count moved without executing
+           instructions: at the start of a run and after an idle loop.'''
+        self.cycle = cycles
+
+    def record(self):
+        '''Append the current CPU state to the ring.'''
+        cpu = self.cpu
+        pc = cpu.pc
+        ENTRY.pack_into(self.buffer, self.offset, self.cycle, pc, cpu.fl,
+                        cpu.ram[pc:pc+3], cpu.reg.tobytes())
+        self.written += 1
+        self.offset += ENTRY.size
+        if self.offset == self.end: self.wrapped()
+
+    def wrapped(self):
+        '''Start over at the oldest record.'''
+        self.offset = HEADER.size
+        self.flush()
+        return self.offset
+
+    def wrap(self, addr, op, handler):
+        '''Recording version of the handler decoded at addr. This is
+           record() inlined, with everything it can in closure cells.'''
+        pack, size, end = ENTRY.pack_into, ENTRY.size, self.end
+        cpu, buffer, ram, reg = self.cpu, self.buffer, self.cpu.ram, self.cpu.reg
+
+        def recorded(a, b):
+            handler(a, b)
+            pc = cpu.pc
+            self.cycle += 1
+            offset = self.offset
+            pack(buffer, offset, self.cycle, pc, cpu.fl, ram[pc:pc+3], reg.tobytes())
+            self.written += 1
+            offset += size
+            self.offset = offset if offset != end else self.wrapped()
+
+        return recorded
+
+    def records(self):
+        '''The records still in the ring, oldest first.'''
+        return list(decode(self.buffer, self.capacity, self.written))
+
+
+def decode(buffer, capacity, written):
+    '''Records of a ring buffer with the given header values, oldest first.'''
+    count = min(written, capacity)
+    first = written - count # index of the oldest record still there
+    for i in range(first, written):
+        cycle, pc, fl, ram, reg = ENTRY.unpack_from(
+            buffer, HEADER.size + (i % capacity) * ENTRY.size)
+        yield Record(cycle, pc, fl, ram, tuple(reg))
+
+
+def read(filename):
+    '''Records of a trace file, oldest first.'''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f'{filename}: not an LS-8 trace')
+    magic, version, size, capacity, written = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f'{filename}: not an LS-8 trace')
+    if version != VERSION or size != ENTRY.size:
+        raise ValueError(f'{filename}: trace version {version}, expected {VERSION}')
+    if len(data) < HEADER.size + capacity * size:
+        raise ValueError(f'{filename}: truncated trace')
+    return list(decode(data, capacity, written))
+
+
+def trace_line(r):
+    '''A record as the line CPU.trace() prints.'''
+    return ('TRACE: %02X %02X | %02X %02X %02X |' % ((r.pc, r.fl) + tuple(r.ram)) +
+            ''.join(' %02X' % v for v in r.reg))
+
+
+def show_line(r, debug=None):
+    '''A record with its instruction disassembled, and located with the
+       DebugInfo if there is one.'''
+    op = r.ram[0]
+    name = isa.MNEMONICS.get(op, f'{op:#04x}')
+    kind = isa.KINDS.get(name, isa.NO_OPERANDS)
+    if kind == isa.REG_IMM:
+        text = f'{name} R{r.ram[1]},{r.ram[2]}'
+    elif kind == isa.REG_REG:
+        text = f'{name} R{r.ram[1]},R{r.ram[2]}'
+    elif kind == isa.REG:
+        text = f'{name} R{r.ram[1]}'
+    else:
+        text = name
+    regs = ' '.join(f'{v:3}' for v in r.reg)
+    line = f'{r.cycle:10} {r.pc:3} {r.fl:03b} {regs}   {text:<12}'
+    if debug is not None: line += f' {debug.where(r.pc)}'
+    return line.rstrip()
+
+
+def load_debug(args):
+    if args.debug is None: return None
+    with open(args.debug, 'rb') as f:
+        return debuginfo.read_debuginfo(f)
+
+
+def show(args):
+    records = read(args.file)
+    debug = load_debug(args)
+    op = None
+    if args.op is not None:
+        op = isa.OPCODES.get(args.op.upper())
+        if op is None: raise ValueError(f'unknown opcode {args.op}')
+    selected = [r for r in records
+                if (args.pc is None or r.pc == args.pc) and
+                   (op is None or r.ram[0] == op) and
+                   (args.first is None or r.cycle >= args.first) and
+                   (args.last_cycle is None or r.cycle <= args.last_cycle)]
+    if args.last is not None:
+        selected = selected[-args.last:] if args.last else []
+    if not args.trace:
+        regs = ' '.join(f'R{i}'.rjust(3) for i in range(8))
+        print(f'{"cycle":>10} {"pc":>3} {"fl":>3} {regs}   next')
+    for r in selected:
+        print(trace_line(r) if args.trace else show_line(r, debug))
+    return 0
+
+
+def diff(args):
+    a, b = read(args.file1), read(args.file2)
+    debug = load_debug(args)
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y: break
+    else:
+        if len(a) == len(b):
+            print(f'{len(a)} records, no difference')
+            return 0
+        i = min(len(a), len(b))
+        print(f'{args.file1 if len(a) < len(b) else args.file2} ends after {i} records')
+        return 1
+    for r in a[max(0, i - args.context):i]:
+        print(f'  {show_line(r, debug)}')
+    print(f'- {show_line(a[i], debug)}')
+    print(f'+ {show_line(b[i], debug)}')
+    return 1
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Decode LS-8 binary traces.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('show', help='print the records of a trace')
+    p.add_argument('file')
+    p.add_argument('--trace', action='store_true',
+                   help='print TRACE: lines, as the --trace option does')
+    p.add_argument('--pc', type=lambda s: int(s, 0), help='only records at this address')
+    p.add_argument('--op', help='only records about to execute this instruction')
+    p.add_argument('--from', dest='first', type=int, help='only from this cycle on')
+    p.add_argument('--to', dest='last_cycle', type=int, help='only up to this cycle')
+    p.add_argument('--last', type=int, help='only the last N records selected')
+    p.add_argument('--debug', metavar='FILE', help='debug info to locate PCs with')
+    p.set_defaults(func=show)
+    p = commands.add_parser('diff', help='find the first difference of two traces')
+    p.add_argument('file1')
+    p.add_argument('file2')
+    p.add_argument('--context', type=int, default=5,
+                   help='records to show before the difference (default: 5)')
+    p.add_argument('--debug', metavar='FILE', help='debug info to locate PCs with')
+    p.set_defaults(func=diff)
+    args = parser.parse_args(argv[1:])
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        return 0
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
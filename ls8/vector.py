@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""Lockstep engine running many LS-8 machines as NumPy arrays.
+
+Usage: vector.py [-n MACHINES] [--max-cycles N] program
+
+For fuzzing and differential testing: N machines, usually the same program
+with different inputs, kept as
+
+    reg     (N, 8) uint8
+    ram     (N, 256) uint8
+    pc, fl  (N,) uint8
+
+Each step() fetches the instruction of every running machine at once,
+groups the machines by opcode and applies that opcode's semantics as one
+masked NumPy operation per group. Instructions are fetched from RAM on
+every step, so self-modifying code behaves as in CPU, and interrupts a
+program raises itself by writing IS are dispatched the same way; there are
+no interrupt sources. Every machine is a single core 0: CID loads 0, CAS
+needs no lock, and IPI can only interrupt the machine itself; any other
+core is an ERROR, as on a CPU that is not one of several. run() returns
+one RunResult per machine, equal to what CPU.run() gives. Output (PRN/PRA)
+is the only per-machine Python work.
+
+The gain is about 5x, not orders of magnitude: on histogram.ls8 (971
+instructions, the same path on every machine), 10,000 machines run at
+27-31M instructions/s against 5.5-6M/s for CPU.run() on one CPU after
+another. Every step pays a fixed cost per group of machines on the same
+opcode, so machines whose paths diverge gain less.
+
+Needs numpy, which nothing else in the emulator does.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from cpu import *
+
+U8 = np.uint8
+LENGTHS = np.frombuffer(LENGTH, dtype=U8)
+REGISTER_OPERANDS = np.frombuffer(REGISTERS, dtype=U8).copy()
+REGISTER_OPERANDS[[JNE, *JUMP_FLAGS]] = 0 # checked when taken
+SP, IM, IS = 7, 5, 6
+# index of the lowest set bit, the interrupt dispatch() delivers
+LOWEST_BIT = np.array([(v & -v).bit_length() - 1 for v in range(256)])
+
+
+def wrap(values):
+    return (values & 0xFF).astype(U8)
+
+
+class VectorCPU:
+    """N LS-8 machines stepped in lockstep."""
+
+    def __init__(self, n):
+        self.n = n
+        self.reg = np.zeros((n, 8), dtype=U8)
+        self.ram = np.zeros((n, 256), dtype=U8)
+        self.pc = np.zeros(n, dtype=U8)
+        self.fl = np.zeros(n, dtype=U8)
+        self.ie = np.ones(n, dtype=bool)
+        self.cycles = np.zeros(n, dtype=np.int64)
+        self.running = np.ones(n, dtype=bool)
+        self.halted = [None] * n # halt reason per machine
+        self.fetched = np.zeros(n, dtype=U8) # PC of the last instruction fetched
+        self.output = [[] for _ in range(n)]
+        self.reg[:, SP] = 0xF4
+        self.ops = self.handlers()
+        self.known = np.array([op in self.ops for op in range(256)])
+
+    def handlers(self):
+        '''opcode -> handler(machines, A, B) working on index arrays.'''
+        ops = {
+            LDI: self.op_ldi,
+            LD: self.op_ld,
+            ST: self.op_st,
+            PRN: self.op_prn,
+            PRA: self.op_pra,
+            HLT: self.op_hlt,
+            PUSH: self.op_push,
+            POP: self.op_pop,
+            JMP: self.op_jmp,
+            JNE: self.op_jne,
+            CALL: self.op_call,
+            RET: self.op_ret,
+            IRET: self.op_iret,
+            CMP: self.op_cmp,
+            ADDI: self.op_addi,
+            NOP: self.op_nop,
+            INT: self.op_int,
+            CID: self.op_cid,
+            CAS: self.op_cas,
+            IPI: self.op_ipi,
+        }
+        for op, flags in JUMP_FLAGS.items():
+            ops[op] = (lambda flags: lambda m, a, b: self.op_jif(flags, m, a))(flags)
+        for op in ALU_OPS:
+            ops[op] = (lambda op: lambda m, a, b: self.op_alu(op, m, a, b))(op)
+        for op in ALU_OPS_:
+            ops[op] = (lambda op: lambda m, a, b: self.op_alu_(op, m, a))(op)
+        return ops
+
+    def load(self, filename):
+        '''Load a .ls8 or .ls8b program into every machine.'''
+        cpu = CPU(capture=True)
+        cpu.load(filename)
+        self.load_bytes(cpu.ram)
+        self.pc[:] = cpu.pc
+
+    def load_bytes(self, buf, address=0):
+        '''Load a program into every machine's RAM.'''
+        if address + len(buf) > 256:
+            raise ValueError(f'Program too large: {len(buf)} bytes at {address}')
+        self.ram[:, address:address+len(buf)] = np.frombuffer(bytes(buf), dtype=U8)
+
+    def halt(self, machines, reason):
+        self.running[machines] = False
+        for i in machines.tolist():
+            self.halted[i] = reason
+
+    def bad_register(self, m, ops):
+        '''Halt machines with an out of range register operand, keeping what
+           CPU's handlers did before their IndexError: PUSH and CALL move
+           SP first, and CALL stores the return address.'''
+        stack = m[(ops == PUSH) | (ops == CALL)]
+        self.reg[stack, SP] = wrap(self.reg[stack, SP].astype(np.int16) - 1)
+        call = m[ops == CALL]
+        self.ram[call, self.reg[call, SP]] = self.pc[call]
+        self.halt(m, ERROR)
+
+    def dispatch(self):
+        '''Deliver the lowest pending unmasked interrupt, if enabled, on
+           every running machine, as CPU.dispatch() does.'''
+        pending = self.reg[:, IM] & self.reg[:, IS]
+        m = np.flatnonzero(self.running & self.ie & (pending != 0))
+        if not len(m): return
+        bit = LOWEST_BIT[pending[m]]
+        self.ie[m] = False
+        self.reg[m, IS] &= wrap(~(1 << bit))
+        for value in [self.pc[m], self.fl[m]] + [self.reg[m, r] for r in range(6)]:
+            self.reg[m, SP] = wrap(self.reg[m, SP].astype(np.int16) - 1)
+            self.ram[m, self.reg[m, SP]] = value
+        self.pc[m] = self.ram[m, 0xF8 + bit]
+
+    def step(self):
+        '''Execute one instruction on every running machine.
+           Returns the number of machines that ran one.'''
+        self.dispatch()
+        machines = np.flatnonzero(self.running)
+        if not len(machines): return 0
+        pc = self.fetched[machines] = self.pc[machines]
+        ops = self.ram[machines, pc]
+        a = self.ram[machines, (pc + 1) & 0xFF]
+        b = self.ram[machines, (pc + 2) & 0xFF]
+
+        # unknown opcodes stop the machine before it executes anything
+        known = self.known[ops]
+        if not known.all():
+            self.halt(machines[~known], ERROR)
+            machines, ops, a, b, pc = (x[known] for x in (machines, ops, a, b, pc))
+
+        self.pc[machines] = pc + LENGTHS[ops] # wraps around like the PC
+        self.cycles[machines] += 1
+
+        # bad register numbers fail after the fetch, like CPU's IndexError;
+        # conditional jumps only read theirs when taken, see jump()
+        count = REGISTER_OPERANDS[ops]
+        bad = ((count >= 1) & (a > 7)) | ((count == 2) & (b > 7))
+        if bad.any():
+            self.bad_register(machines[bad], ops[bad])
+            machines, ops, a, b = (x[~bad] for x in (machines, ops, a, b))
+
+        order = np.argsort(ops, kind='stable')
+        ops, machines, a, b = ops[order], machines[order], a[order], b[order]
+        groups, starts = np.unique(ops, return_index=True)
+        ends = list(starts[1:]) + [len(ops)]
+        for op, start, end in zip(groups.tolist(), starts, ends):
+            self.ops[op](machines[start:end], a[start:end], b[start:end])
+        return len(machines)
+
+    def run(self, max_cycles=None):
+        '''Step until every machine halts or max_cycles steps have run.
+           Returns one RunResult per machine.'''
+        start = self.cycles.copy()
+        marks = [len(out) for out in self.output]
+        steps = 0
+        while self.running.any() and (max_cycles is None or steps < max_cycles):
+            self.step()
+            steps += 1
+        results = []
+        for i in range(self.n):
+            if self.halted[i]: reason = self.halted[i]
+            else: reason = MAX_CYCLES
+            error_pc = int(self.fetched[i]) if reason == ERROR else None
+            results.append(RunResult(reason, int(self.cycles[i] - start[i]),
+                                     ''.join(self.output[i][marks[i]:]),
+                                     tuple(self.reg[i].tolist()),
+                                     int(self.pc[i]), int(self.fl[i]), error_pc))
+        return results
+
+    # Handlers take index arrays: the machines, and their operands A and B.
+    # As in CPU, the PC has already been advanced.
+    def op_ldi(self, m, a, b):
+        self.reg[m, a] = b
+    def op_ld(self, m, a, b):
+        self.reg[m, a] = self.ram[m, self.reg[m, b]]
+    def op_st(self, m, a, b):
+        self.ram[m, self.reg[m, a]] = self.reg[m, b]
+    def op_prn(self, m, a, b):
+        for i, value in zip(m.tolist(), self.reg[m, a].tolist()):
+            self.output[i].append(f'{value}\n')
+    def op_pra(self, m, a, b):
+        for i, value in zip(m.tolist(), self.reg[m, a].tolist()):
+            self.output[i].append(chr(value))
+    def op_hlt(self, m, a, b):
+        self.halt(m, HALT)
+    def op_push(self, m, a, b):
+        self.reg[m, SP] = wrap(self.reg[m, SP].astype(np.int16) - 1)
+        self.ram[m, self.reg[m, SP]] = self.reg[m, a]
+    def op_pop(self, m, a, b):
+        self.reg[m, a] = self.ram[m, self.reg[m, SP]]
+        self.reg[m, SP] = wrap(self.reg[m, SP].astype(np.int16) + 1)
+    def op_jmp(self, m, a, b):
+        self.pc[m] = self.reg[m, a]
+    def jump(self, m, a):
+        bad = a > 7
+        if bad.any():
+            self.halt(m[bad], ERROR)
+            m, a = m[~bad], a[~bad]
+        self.pc[m] = self.reg[m, a]
+    def op_jne(self, m, a, b):
+        taken = (self.fl[m] & 1) == 0
+        self.jump(m[taken], a[taken])
+    def op_jif(self, flags, m, a):
+        taken = (self.fl[m] & flags) != 0
+        self.jump(m[taken], a[taken])
+    def op_call(self, m, a, b):
+        self.reg[m, SP] = wrap(self.reg[m, SP].astype(np.int16) - 1)
+        self.ram[m, self.reg[m, SP]] = self.pc[m]
+        self.pc[m] = self.reg[m, a]
+    def op_ret(self, m, a, b):
+        self.pc[m] = self.ram[m, self.reg[m, SP]]
+        self.reg[m, SP] = wrap(self.reg[m, SP].astype(np.int16) + 1)
+    def op_iret(self, m, a, b):
+        def pop():
+            value = self.ram[m, self.reg[m, SP]]
+            self.reg[m, SP] = wrap(self.reg[m, SP].astype(np.int16) + 1)
+            return value
+        for r in range(5, -1, -1):
+            self.reg[m, r] = pop()
+        self.fl[m] = pop()
+        self.pc[m] = pop()
+        self.ie[m] = True
+    def op_cmp(self, m, a, b):
+        x, y = self.reg[m, a], self.reg[m, b]
+        self.fl[m] = np.where(x < y, 0b100, np.where(x > y, 0b010, 0b001))
+    def op_addi(self, m, a, b):
+        self.reg[m, a] = wrap(self.reg[m, a].astype(np.int16) + b)
+    def op_nop(self, m, a, b):
+        pass
+    def interrupt(self, m, number):
+        number = number.astype(np.int64)
+        bad = number > 7 # no such interrupt, like CPU.interrupt()
+        if bad.any():
+            self.halt(m[bad], ERROR)
+            m, number = m[~bad], number[~bad]
+        self.reg[m, IS] = self.reg[m, IS] | wrap(1 << number)
+    def op_int(self, m, a, b):
+        self.interrupt(m, self.reg[m, a])
+    def op_cid(self, m, a, b):
+        self.reg[m, a] = 0
+    def op_cas(self, m, a, b):
+        addr, expected = self.reg[m, a], self.reg[m, 0]
+        old = self.ram[m, addr]
+        same = old == expected
+        self.ram[m[same], addr[same]] = self.reg[m[same], b[same]]
+        self.reg[m[~same], 0] = old[~same]
+        self.fl[m] = np.where(expected < old, 0b100, np.where(expected > old, 0b010, 0b001))
+    def op_ipi(self, m, a, b):
+        other = self.reg[m, b] != 0 # no core but this one
+        if other.any():
+            self.halt(m[other], ERROR)
+            m, a = m[~other], a[~other]
+        self.interrupt(m, self.reg[m, a])
+    def op_alu(self, op, m, a, b):
+        x = self.reg[m, a].astype(np.int64)
+        y = self.reg[m, b].astype(np.int64)
+        if op in (DIV, MOD):
+            zero = y == 0 # halts the machine, like ZeroDivisionError in CPU
+            if zero.any():
+                self.halt(m[zero], DIV_ZERO)
+                m, a, x, y = m[~zero], a[~zero], x[~zero], y[~zero]
+            result = x // y if op == DIV else x % y
+        elif op == SHL:
+            result = np.where(y < 8, x << np.minimum(y, 8), 0)
+        elif op == SHR:
+            result = np.where(y < 8, x >> np.minimum(y, 8), 0)
+        else:
+            result = ALU_OPS[op](x, y)
+        self.reg[m, a] = wrap(result)
+    def op_alu_(self, op, m, a):
+        self.reg[m, a] = wrap(ALU_OPS_[op](self.reg[m, a].astype(np.int64)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run many LS-8 machines in lockstep.')
+    parser.add_argument('program', help='.ls8 or .ls8b program file')
+    parser.add_argument('-n', '--machines', type=int, default=10000,
+                        help='number of machines (default: 10000)')
+    parser.add_argument('--max-cycles', type=int, default=100000,
+                        help='steps to run at most (default: 100000)')
+    args = parser.parse_args(argv[1:])
+
+    engine = VectorCPU(args.machines)
+    engine.load(args.program)
+    start = time.perf_counter()
+    results = engine.run(args.max_cycles)
+    elapsed = time.perf_counter() - start
+    total = sum(r.cycles for r in results)
+    reasons = {}
+    for r in results:
+        reasons[r.reason] = reasons.get(r.reason, 0) + 1
+    print(f'{args.machines} machines, {total} instructions in {elapsed:.3f} s: '
+          f'{total / elapsed / 1e6:.1f}M instructions/s')
+    print('halted:', ', '.join(f'{n} {reason}' for reason, n in sorted(reasons.items())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))